@@ -0,0 +1,155 @@
+from __future__ import annotations
+import os, gzip, time, hashlib
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # без zstandard артефакты сжимаются gzip
+    zstandard = None
+
+# === Конфиг хранилища артефактов ===
+ARTIFACTS_DIR = os.getenv("ARTIFACTS_DIR", ".qa_cache/artifacts")
+ARTIFACT_CODEC = os.getenv("ARTIFACT_CODEC", "zstd")  # zstd | gzip
+ARTIFACT_CACHE_ITEMS = int(os.getenv("ARTIFACT_CACHE_ITEMS", "16"))
+# Уборка при открытии общего хранилища: старше N дней и сверх M МБ (самые давние) — удаляются; 0 — без предела
+ARTIFACTS_MAX_AGE_DAYS = float(os.getenv("ARTIFACTS_MAX_AGE_DAYS", "7"))
+ARTIFACTS_MAX_MB = float(os.getenv("ARTIFACTS_MAX_MB", "1024"))
+
+_EXT = {"zstd": ".zst", "gzip": ".gz"}
+
+
+class ArtifactStore:
+    """Content-addressed хранилище HTML и прочих крупных артефактов на диске.
+
+    Ссылка — хэш содержимого: одинаковые снимки хранятся один раз. Файлы сжаты
+    (zstd, без пакета zstandard — gzip); последние прочитанные/записанные тексты
+    держатся в небольшом LRU, поэтому память не растёт с длиной прогона.
+    """
+
+    def __init__(self, root: str = ARTIFACTS_DIR, codec: str = ARTIFACT_CODEC, cache_items: int = ARTIFACT_CACHE_ITEMS):
+        self._root = root
+        self._codec = "zstd" if codec == "zstd" and zstandard is not None else "gzip"
+        self._cache: OrderedDict[str, str] = OrderedDict()
+        self._cache_items = cache_items
+        self.stats = {"puts": 0, "dedup": 0, "bytes_in": 0, "bytes_stored": 0}
+
+    def _path(self, ref: str, codec: str) -> str:
+        return os.path.join(self._root, ref[:2], ref + _EXT[codec])
+
+    def _remember(self, ref: str, text: str) -> None:
+        self._cache[ref] = text
+        self._cache.move_to_end(ref)
+        while len(self._cache) > self._cache_items:
+            self._cache.popitem(last=False)
+
+    def put(self, text: str) -> str:
+        data = text.encode("utf-8")
+        ref = hashlib.blake2b(data, digest_size=20).hexdigest()
+        self.stats["puts"] += 1
+        self.stats["bytes_in"] += len(data)
+        self._remember(ref, text)
+        for c in _EXT:
+            existing = self._path(ref, c)
+            if os.path.exists(existing):
+                self.stats["dedup"] += 1
+                # Повторно записанный артефакт снова свежий: уборка по возрасту его не тронет
+                try:
+                    os.utime(existing)
+                except FileNotFoundError:
+                    break
+                return ref
+        path = self._path(ref, self._codec)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        blob = zstandard.ZstdCompressor(level=3).compress(data) if self._codec == "zstd" else gzip.compress(data, 5)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, path)
+        self.stats["bytes_stored"] += len(blob)
+        return ref
+
+    def text(self, ref: Optional[str]) -> str:
+        """Содержимое по ссылке; "" для пустой ссылки или удалённого артефакта."""
+        if not ref:
+            return ""
+        if ref in self._cache:
+            self._cache.move_to_end(ref)
+            return self._cache[ref]
+        for codec in _EXT:
+            try:
+                with open(self._path(ref, codec), "rb") as f:
+                    blob = f.read()
+            except FileNotFoundError:
+                continue
+            if codec == "zstd":
+                if zstandard is None:
+                    continue
+                data = zstandard.ZstdDecompressor().decompress(blob)
+            else:
+                data = gzip.decompress(blob)
+            text = data.decode("utf-8")
+            self._remember(ref, text)
+            return text
+        return ""
+
+    def path(self, ref: str) -> Optional[str]:
+        """Файл артефакта (для отладки: zstdcat/zcat), если он есть."""
+        for codec in _EXT:
+            path = self._path(ref, codec)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def prune(self, max_age_days: float = ARTIFACTS_MAX_AGE_DAYS, max_mb: float = ARTIFACTS_MAX_MB) -> Tuple[int, int]:
+        """Удаляет артефакты, не записывавшиеся дольше max_age_days, а затем самые давние,
+        пока каталог больше max_mb. Возвращает (удалено файлов, освобождено байт)."""
+        files = []
+        try:
+            subdirs = list(os.scandir(self._root))
+        except FileNotFoundError:
+            return 0, 0
+        for sub in subdirs:
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, entry.path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        cutoff = time.time() - max_age_days * 86400 if max_age_days else None
+        limit = max_mb * 1024 * 1024 if max_mb else None
+        removed = freed = 0
+        for mtime, size, path in files:
+            if not ((cutoff is not None and mtime < cutoff) or (limit is not None and total > limit)):
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+            freed += size
+        return removed, freed
+
+    def summary(self) -> str:
+        s = self.stats
+        return (
+            f"{self._codec}: записей {s['puts']} (повторов {s['dedup']}), "
+            f"{s['bytes_in'] / 1024:.0f} КБ -> {s['bytes_stored'] / 1024:.0f} КБ на диске"
+        )
+
+
+@lru_cache(maxsize=None)
+def default_store(root: str = ARTIFACTS_DIR) -> ArtifactStore:
+    """Общее хранилище процесса: драйверы набора делят и файлы, и LRU.
+    При открытии убираются старые артефакты (ARTIFACTS_MAX_AGE_DAYS, ARTIFACTS_MAX_MB)."""
+    store = ArtifactStore(root)
+    removed, freed = store.prune()
+    if removed:
+        print(f"Артефакты: удалено старых {removed} ({freed / 1024 / 1024:.1f} МБ)")
+    return store
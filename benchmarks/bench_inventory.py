@@ -0,0 +1,85 @@
+"""Бенчмарк build_dom_inventory на синтетических документах.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_inventory                # 10k и 100k узлов
+    python -m benchmarks.bench_inventory --sizes 1000 10000 --depth 40 --no-legacy
+"""
+import argparse
+import random
+import time
+
+from bs4 import BeautifulSoup
+
+from dom_tools import _walk, _element_children
+
+
+def make_document(n_nodes: int, depth: int = 25, seed: int = 1) -> str:
+    """Синтетическая SPA-подобная страница: глубокие цепочки обёрток с формами внутри."""
+    rnd = random.Random(seed)
+    parts = ["<html><body><div id=\"app\">"]
+    made = 1
+    while made < n_nodes:
+        d = rnd.randint(depth // 2, depth)
+        for i in range(d):
+            parts.append(f"<div class=\"wrap_{i}-x{rnd.randint(0, 999)}\">")
+        k = rnd.randint(0, 5)
+        if k == 0:
+            parts.append(f"<button data-testid=\"btn-{made}\">Кнопка {made}</button>")
+        elif k == 1:
+            parts.append(f"<label for=\"f{made}\">Поле {made}</label><input id=\"f{made}\" placeholder=\"Введите {made}\">")
+        elif k == 2:
+            parts.append(f"<a href=\"/item/{made}\">Ссылка {made}</a>")
+        elif k == 3:
+            parts.append(f"<span>Текст ячейки {made} " + "лорем ипсум " * rnd.randint(1, 8) + "</span>")
+        elif k == 4:
+            parts.append("<svg viewBox=\"0 0 10 10\"><path d=\"M0 0L10 10\"/><path d=\"M10 0L0 10\"/></svg>")
+        else:
+            parts.append(f"<div role=\"row\"><span>{made}</span><span>значение</span></div>")
+        parts.append("</div>" * d)
+        made += d + 3
+    parts.append("</div></body></html>")
+    return "".join(parts)
+
+
+def legacy_inventory(soup) -> list:
+    # Прежняя реализация: get_text() на каждом элементе — O(n·глубина)
+    items = []
+    for el in soup.find_all(True):
+        if el.name in ("script", "style", "svg", "path"):
+            continue
+        items.append({
+            "tag": el.name,
+            "id": el.get("id"),
+            "text": (el.get_text(strip=True) or "")[:100],
+        })
+    return items
+
+
+def _time(fn, *args):
+    t = time.perf_counter()
+    out = fn(*args)
+    return time.perf_counter() - t, out
+
+
+def run(sizes, depth: int, legacy: bool):
+    # Разбор HTML считается отдельно: обе реализации сравниваются только по обходу дерева
+    print(f"{'узлов':>8} {'HTML, КБ':>9} {'разбор, с':>10} {'обход, с':>9} {'записей':>8}"
+          + (f" {'legacy, с':>10} {'записей':>8}" if legacy else ""))
+    for n in sizes:
+        html = make_document(n, depth)
+        parse_s, soup = _time(BeautifulSoup, html, "lxml")
+        walk_s, items = _time(_walk, _element_children(soup))
+        line = f"{n:>8} {len(html) // 1024:>9} {parse_s:>10.3f} {walk_s:>9.3f} {len(items):>8}"
+        if legacy:
+            legacy_s, legacy_items = _time(legacy_inventory, BeautifulSoup(html, "lxml"))
+            line += f" {legacy_s:>10.3f} {len(legacy_items):>8}"
+        print(line)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    ap.add_argument("--depth", type=int, default=25, help="максимальная глубина вложенности обёрток")
+    ap.add_argument("--no-legacy", action="store_true", help="не замерять прежнюю реализацию")
+    args = ap.parse_args()
+    run(args.sizes, args.depth, not args.no_legacy)
@@ -0,0 +1,349 @@
+"""Офлайн-бенчмарк прогона тест-кейса: локальные страницы-фикстуры и стаб LLM.
+
+Страницы (форма, реестр на 10k узлов, SPA на 100k узлов) отдаёт локальный HTTP-сервер,
+вместо модели отвечает стаб с записанными StepPlan из scenarios.json. Замеряется весь
+run_test и этапы по спанам трейсера: снимок, инвентарь, сборка промпта, исполнение.
+Разбор HTML и сборка промпта по тем же страницам замеряются и отдельно, без браузера:
+эта часть сравнивается с baseline и там, где Chromium не установлен.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_run                          # все сценарии, сравнение с baseline
+    python -m benchmarks.bench_run --scenario spa --repeat 5
+    python -m benchmarks.bench_run --save-baseline          # текущие результаты — новый baseline
+"""
+import io
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import statistics
+import tempfile
+import threading
+from contextlib import redirect_stdout
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+
+from playwright.async_api import async_playwright
+
+import planner
+import main
+from artifacts import ArtifactStore
+from models import StepPlan
+from plan_wire import to_wire
+from context import PlaywrightDriver
+from dom_tools import build_snapshot
+from policy import RunPolicy
+from prompt_budget import estimate_tokens
+from telemetry import Tracer, add
+from benchmarks.bench_inventory import make_document
+
+HERE = Path(__file__).parent
+SCENARIOS_PATH = HERE / "scenarios.json"
+BASELINE_PATH = HERE / "baseline.json"
+
+# Этап бенчмарка → имя спана трейсера
+STAGES = {
+    "snapshot": "snapshot",
+    "inventory": "dom.inventory",
+    "prompt": "prompt.build",
+    "plan": "node.plan",
+    "llm": "llm.call",
+    "execute": "node.execute",
+}
+POLICY = RunPolicy(approval="auto", on_error="fail-fast")
+
+_STEP_ID_RE = re.compile(r'stepId: "([^"]+)"')
+_BATCH_IDS_RE = re.compile(r"планами для шагов: ([^\n]+)")
+_recorded: dict = {}
+
+
+# === Страницы-фикстуры ===
+FORM_HTML = """<!doctype html><html><head><meta charset="utf-8"><title>Вход</title></head><body>
+<form action="/registry" method="get">
+  <label for="login">Логин</label><input id="login" name="login" placeholder="Логин">
+  <label for="password">Пароль</label><input id="password" name="password" type="password" placeholder="Пароль">
+  <button type="submit" data-testid="submit">Войти</button>
+</form></body></html>"""
+
+SPA_SCRIPT = """<script>
+document.querySelector('[data-testid="load-more"]').addEventListener('click', () => {
+  const row = document.createElement('div');
+  row.setAttribute('role', 'row');
+  row.dataset.testid = 'row-new';
+  row.textContent = 'Новая строка';
+  row.addEventListener('click', () => { document.getElementById('card').textContent = 'Карточка строки'; });
+  document.getElementById('rows').prepend(row);
+});
+</script>"""
+
+
+def fixture_pages(registry_nodes: int, spa_nodes: int) -> dict:
+    """path → HTML. Большие страницы — синтетические документы из bench_inventory."""
+    registry = make_document(registry_nodes).replace(
+        "<body>", "<head><meta charset=\"utf-8\"><title>Реестр</title></head><body><h1>Реестр документов</h1>", 1
+    )
+    spa = make_document(spa_nodes).replace(
+        "<body>",
+        "<head><meta charset=\"utf-8\"><title>Приложение</title></head><body>"
+        "<button data-testid=\"load-more\">Загрузить ещё</button><div id=\"card\"></div><div id=\"rows\"></div>",
+        1,
+    ).replace("</body>", SPA_SCRIPT + "</body>", 1)
+    return {"/form": FORM_HTML, "/registry": registry, "/spa": spa}
+
+
+def serve(pages: dict) -> ThreadingHTTPServer:
+    """Локальный сервер фикстур на свободном порту (в фоновом потоке)."""
+    bodies = {path: html.encode("utf-8") for path, html in pages.items()}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = bodies.get(self.path.split("?", 1)[0])
+            self.send_response(200 if body is not None else 404)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body or b"")))
+            self.end_headers()
+            self.wfile.write(body or b"")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# === Стаб LLM ===
+def _stub_answer(messages, fmt=None) -> str:
+    # Ответ по stepId из промпта в компактном формате модели; размеры промпта и ответа —
+    # как prompt_tokens / completion_tokens
+    prompt = messages[-1]["content"]
+    batch = _BATCH_IDS_RE.search(prompt)
+    m = _STEP_ID_RE.search(prompt)
+    if batch:
+        answer = json.dumps({"plans": [_recorded.get(i.strip(), {"ins": [], "exp": []}) for i in batch.group(1).split(",")]})
+    else:
+        answer = json.dumps(_recorded.get(m.group(1), {}) if m else {}, ensure_ascii=False)
+    add(
+        llm_attempts=1,
+        prompt_tokens=sum(estimate_tokens(msg["content"]) for msg in messages),
+        completion_tokens=estimate_tokens(answer),
+    )
+    return answer
+
+
+async def _astub_answer(messages, fmt=None) -> str:
+    return _stub_answer(messages, fmt)
+
+
+def install_stub_llm() -> None:
+    # Подменяются попытки, а не _call_llm: спан llm.call и разбор ответа остаются настоящими
+    planner._call_llm_attempt = _stub_answer
+    planner._acall_llm_attempt = _astub_answer
+
+
+def load_scenarios(base_url: str, names=None) -> dict:
+    raw = SCENARIOS_PATH.read_text(encoding="utf-8").replace("{base}", base_url)
+    scenarios = json.loads(raw)
+    return {k: v for k, v in scenarios.items() if not names or k in names}
+
+
+# === Прогон ===
+async def run_scenario(browser, name: str, scenario: dict, artifacts: ArtifactStore, verbose: bool) -> dict:
+    _recorded.clear()
+    _recorded.update({k: to_wire(StepPlan.model_validate(p)) for k, p in scenario["plans"].items()})
+    tracer = Tracer(None, None)
+    driver = PlaywrightDriver(headless=True, browser=browser, artifacts=artifacts)
+    await driver.start()
+    out = sys.stdout if verbose else io.StringIO()
+    t0 = time.perf_counter()
+    try:
+        with redirect_stdout(out):
+            report = await main.run_test(scenario["test"], driver=driver, case_name=name, policy=POLICY, tracer=tracer)
+    finally:
+        await driver.stop()
+    e2e_ms = (time.perf_counter() - t0) * 1000
+    rows = tracer.summary(name)
+    return {
+        "ok": report["ok"],
+        "e2e_ms": e2e_ms,
+        "stages": {stage: rows.get(span_name, {}).get("total_ms", 0.0) for stage, span_name in STAGES.items()},
+        "prompt_tokens": rows.get("llm.call", {}).get("prompt_tokens", 0),
+        "completion_tokens": rows.get("llm.call", {}).get("completion_tokens", 0),
+        "errors": report["errors"],
+    }
+
+
+def run_offline(pages: dict, repeat: int, verbose: bool = False) -> dict:
+    """Этапы без браузера по страницам-фикстурам: разбор HTML в инвентарь и сборка промпта шага.
+
+    Кроме времени — число записей инвентаря и токенов промпта: они не зависят от машины.
+    """
+    results = {}
+    for path, html in pages.items():
+        inventory_ms, prompt_ms = [], []
+        for _ in range(max(1, repeat)):
+            t0 = time.perf_counter()
+            body_html, inventory = build_snapshot(html)
+            t1 = time.perf_counter()
+            with redirect_stdout(sys.stdout if verbose else io.StringIO()):
+                messages = planner._build_messages(
+                    "1", "Нажать «Войти»", "", "Нажать «Войти»", "Открыт реестр",
+                    f"http://fixture{path}", path, body_html, inventory, None,
+                )
+            inventory_ms.append((t1 - t0) * 1000)
+            prompt_ms.append((time.perf_counter() - t1) * 1000)
+        results[path.strip("/")] = {
+            "stages": {
+                "inventory": round(statistics.median(inventory_ms), 1),
+                "prompt": round(statistics.median(prompt_ms), 1),
+            },
+            "inventory_items": len(inventory),
+            "prompt_tokens": sum(estimate_tokens(m["content"]) for m in messages),
+        }
+    return results
+
+
+async def _launch(play):
+    try:
+        return await play.chromium.launch(headless=True)
+    except Exception as e:
+        print(f"Chromium не запускается ({str(e).splitlines()[0]}): e2e-сценарии пропущены")
+        return None
+
+
+def _median_run(runs: list) -> dict:
+    return {
+        "ok": all(r["ok"] for r in runs),
+        "e2e_ms": round(statistics.median(r["e2e_ms"] for r in runs), 1),
+        "stages": {s: round(statistics.median(r["stages"][s] for r in runs), 1) for s in STAGES},
+        "prompt_tokens": runs[-1]["prompt_tokens"],
+        "completion_tokens": runs[-1]["completion_tokens"],
+        "errors": next((r["errors"] for r in runs if r["errors"]), []),
+    }
+
+
+async def run(args) -> dict:
+    install_stub_llm()
+    # Бенчмарк не должен зависеть от окружения: без кэша планов, чекпоинтов и BASE_URL
+    main.PLAN_CACHE_ENABLED = False
+    main.CHECKPOINTS_ENABLED = False
+    main.BASE_URL = None
+    pages = fixture_pages(args.registry_nodes, args.spa_nodes)
+    offline = run_offline(pages, args.repeat, args.verbose)
+    for name, r in offline.items():
+        print(f"{name} (без браузера): инвентарь {r['stages']['inventory']:.0f} мс, промпт {r['prompt_tokens']} ток.")
+    server = serve(pages)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    scenarios = load_scenarios(base_url, args.scenario)
+    results = {}
+    play = await async_playwright().start()
+    browser = await _launch(play)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            artifacts = ArtifactStore(tmp)
+            for name, scenario in (scenarios.items() if browser else ()):
+                for _ in range(args.warmup):
+                    await run_scenario(browser, name, scenario, artifacts, args.verbose)
+                runs = [await run_scenario(browser, name, scenario, artifacts, args.verbose) for _ in range(args.repeat)]
+                results[name] = _median_run(runs)
+                print(f"{name}: {'OK' if results[name]['ok'] else 'FAIL'} {results[name]['e2e_ms']:.0f} мс")
+    finally:
+        if browser:
+            await browser.close()
+        await play.stop()
+        server.shutdown()
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "sizes": {"registry_nodes": args.registry_nodes, "spa_nodes": args.spa_nodes},
+        "offline": offline,
+        "scenarios": results,
+    }
+
+
+# === Сравнение с baseline ===
+def _metrics(result: dict):
+    if "e2e_ms" in result:
+        yield "e2e", result["e2e_ms"]
+    yield from result["stages"].items()
+
+
+# Счётчики не зависят от машины: рост больше порога — регрессия при любом абсолютном изменении
+_COUNTERS = ("prompt_tokens", "inventory_items")
+
+
+def _compare_section(title: str, current: dict, baseline: dict, threshold: float, min_ms: float) -> list:
+    regressions = []
+    for name, cur in current.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{title + name:<34}{'—':>14}{'':>12}   (нет в baseline)")
+            continue
+        base_metrics = dict(_metrics(base))
+        rows = [(m, v, base_metrics.get(m), "мс") for m, v in _metrics(cur)]
+        rows += [(c, cur[c], base.get(c), "") for c in _COUNTERS if c in cur]
+        for metric, value, was, unit in rows:
+            if not was:
+                continue
+            delta = (value - was) / was
+            mark = ""
+            if delta > threshold and (unit == "" or value - was > min_ms):
+                mark = "  ← регрессия"
+                regressions.append(f"{title}{name}.{metric}: {was:.1f} → {value:.1f} {unit}({delta:+.0%})")
+            print(f"{title + name + '.' + metric:<34}{was:>14.1f}{value:>12.1f}{delta:>+9.0%}{mark}")
+    return regressions
+
+
+def compare(current: dict, baseline: dict, threshold: float, min_ms: float) -> list:
+    """Печатает таблицу «baseline → сейчас» и возвращает список регрессий.
+
+    Сравниваются этапы без браузера (offline.*) и e2e-сценарии, если они есть в обоих замерах.
+    """
+    print(f"\n{'сценарий.этап':<34}{'baseline':>14}{'сейчас':>12}{'Δ':>9}")
+    regressions = _compare_section("offline.", current.get("offline", {}), baseline.get("offline", {}), threshold, min_ms)
+    regressions += _compare_section("", current["scenarios"], baseline.get("scenarios", {}), threshold, min_ms)
+    return regressions
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--scenario", nargs="+", help="какие сценарии гонять (по умолчанию все)")
+    ap.add_argument("--repeat", type=int, default=3, help="замеров на сценарий (берётся медиана)")
+    ap.add_argument("--warmup", type=int, default=1, help="прогонов без замера перед замерами")
+    ap.add_argument("--registry-nodes", type=int, default=10_000)
+    ap.add_argument("--spa-nodes", type=int, default=100_000)
+    ap.add_argument("--out", default="bench_results.json", help="куда сохранить результаты")
+    ap.add_argument("--baseline", default=str(BASELINE_PATH), help="baseline для сравнения")
+    ap.add_argument("--save-baseline", action="store_true", help="сохранить результаты как новый baseline")
+    ap.add_argument("--threshold", type=float, default=0.15, help="допустимое замедление (доля)")
+    ap.add_argument("--min-ms", type=float, default=5.0, help="меньшие абсолютные изменения не считаются регрессией")
+    ap.add_argument("--verbose", action="store_true", help="не скрывать вывод run_test")
+    args = ap.parse_args()
+
+    results = asyncio.run(run(args))
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены: {args.out}")
+    failed = [name for name, r in results["scenarios"].items() if not r["ok"]]
+    for name in failed:
+        print(f"Сценарий {name} не прошёл: {results['scenarios'][name]['errors']}")
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Baseline сохранён: {args.baseline}")
+        sys.exit(1 if failed else 0)
+    try:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(f"Baseline {args.baseline} не найден — сохраните его флагом --save-baseline.")
+        sys.exit(1 if failed else 0)
+    regressions = compare(results, baseline, args.threshold, args.min_ms)
+    for line in regressions:
+        print(f"РЕГРЕССИЯ {line}")
+    sys.exit(1 if failed or regressions else 0)
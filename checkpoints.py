@@ -0,0 +1,113 @@
+from __future__ import annotations
+import os, hashlib
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional, Tuple
+
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from models import StepPlan, ExecResult
+from dom_tools import InventoryItem
+from plan_cache import normalize_step_text
+
+# === Конфиг чекпоинтов ===
+# Выключены по умолчанию: каждый шаг — запись состояния в SQLite и storage_state браузера.
+# --resume включает их на время прогона
+CHECKPOINTS_ENABLED = os.getenv("CHECKPOINTS", "0") in ("1", "true", "yes")
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", ".qa_cache/checkpoints.sqlite")
+
+_TAG = "__qa__"
+_TYPES = {"StepPlan": StepPlan, "ExecResult": ExecResult}
+
+
+class StateSerializer:
+    """Сериализация TestState для чекпоинтера.
+
+    Штатный сериализатор LangGraph восстанавливает pydantic-модели без валидации
+    (вложенные Instruction/Target остаются dict), поэтому наши типы перед записью
+    превращаются в помеченные dict, а при чтении собираются обратно через model_validate.
+    """
+
+    def __init__(self):
+        self._inner = JsonPlusSerializer()
+
+    def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
+        return self._inner.dumps_typed(_pack(obj))
+
+    def loads_typed(self, data: Tuple[str, bytes]) -> Any:
+        return _unpack(self._inner.loads_typed(data))
+
+
+def _pack(v: Any) -> Any:
+    if isinstance(v, (StepPlan, ExecResult)):
+        return {_TAG: type(v).__name__, "data": v.model_dump(by_alias=True)}
+    if isinstance(v, InventoryItem):
+        return {_TAG: "InventoryItem", "data": v.to_dict()}
+    if isinstance(v, dict):
+        return {k: _pack(x) for k, x in v.items()}
+    if isinstance(v, (list, tuple)):
+        return [_pack(x) for x in v]
+    return v
+
+
+def _unpack(v: Any) -> Any:
+    if isinstance(v, dict):
+        tag = v.get(_TAG)
+        if tag == "InventoryItem":
+            return InventoryItem(**v["data"])
+        if tag in _TYPES:
+            return _TYPES[tag].model_validate(v["data"])
+        return {k: _unpack(x) for k, x in v.items()}
+    if isinstance(v, list):
+        return [_unpack(x) for x in v]
+    return v
+
+
+@asynccontextmanager
+async def open_checkpointer(path: str = CHECKPOINT_PATH, required: bool = False):
+    """SQLite-чекпоинтер LangGraph. Если пакет не установлен — None (или ошибка при required)."""
+    try:
+        import aiosqlite
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+    except ImportError:
+        if required:
+            raise RuntimeError("Для --resume нужен пакет langgraph-checkpoint-sqlite (pip install langgraph-checkpoint-sqlite)")
+        print("Чекпоинты выключены: не установлен langgraph-checkpoint-sqlite.")
+        yield None
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = await aiosqlite.connect(path)
+    try:
+        saver = AsyncSqliteSaver(conn, serde=StateSerializer())
+        await saver.setup()
+        yield saver
+    finally:
+        await conn.close()
+
+
+def run_thread_id(case_name: str, steps: List[Dict[str, Any]]) -> str:
+    """Один и тот же тест-кейс (имя и текст шагов) — один поток чекпоинтов."""
+    h = hashlib.sha256(case_name.encode("utf-8"))
+    for step in steps:
+        h.update(b"\x00")
+        h.update(normalize_step_text(step).encode("utf-8"))
+    return h.hexdigest()[:24]
+
+
+async def load_resume_state(graph, config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Состояние для продолжения прогона с последнего завершённого шага или None.
+
+    Упавший (или ждущий одобрения) последний шаг повторяется; если процесс умер
+    посреди шага, шаг начинается заново.
+    """
+    snap = await graph.aget_state(config)
+    values = dict(snap.values or {})
+    if not values.get("steps"):
+        return None
+    res = values.get("exec_result")
+    if not snap.next and res is not None and not res.ok and values.get("current_idx", 0) > 0:
+        values["current_idx"] -= 1
+        history = values.get("history") or []
+        if history and not history[-1]["ok"]:
+            values["history"] = history[:-1]
+    values.update(user_hints=None, need_replan=False, pending_approval=False, plan_queue=[], plan_error=None)
+    return values
@@ -0,0 +1,68 @@
+import json
+from typing import Dict, Any, Optional, Tuple
+
+from models import StepPlan
+
+# Консольное взаимодействие с человеком. Граф вызывает его только при политике approval="ask".
+
+
+def print_plan(plan: StepPlan):
+    print("\n--- Предпросмотр шага ---")
+    print(f"Шаг {plan.stepId}: {plan.title}")
+    print("Инструкции:")
+    for i, ins in enumerate(plan.instructions):
+        line = f"  {i}. action={ins.action}"
+        if ins.url:
+            line += f" url={ins.url}"
+        if ins.target:
+            t = ins.target.selector
+            line += f" target=({t.type}='{t.value}')"
+            if ins.target.alternatives:
+                line += f" alts=[{', '.join(f'{a.type}:{a.value}' for a in ins.target.alternatives[:2])}...]"
+        if ins.value is not None:
+            line += f" value={ins.value!r}"
+        print(line)
+    if plan.expects:
+        print("Ожидания:")
+        for e in plan.expects:
+            if e.selector:
+                print(f"  - {e.kind} selector({e.selector.type}='{e.selector.value}') value={e.value}")
+            else:
+                print(f"  - {e.kind} value={e.value}")
+    print("-------------------------")
+
+
+def collect_hints() -> Optional[Dict[str, Any]]:
+    print("\nХотите указать верный селектор или поправить последовательность?")
+    print("Введите подсказки в JSON или нажмите Enter, чтобы пропустить.")
+    print("Примеры:")
+    print('  {"selector_override": {"instructionIndex": 1, "selector": {"type":"css","value":"[class^=\\"btn_primary\\"]"}}}')
+    print('  {"prepend_instructions": [{"action":"click","target":{"selector":{"type":"text","value":"Меню"}}}]}')
+    raw = input("> ").strip()
+    if not raw:
+        return None
+    try:
+        return json.loads(raw)
+    except Exception as e:
+        print(f"Не получилось разобрать JSON: {e}")
+        return None
+
+
+def ask_approval(plan: StepPlan) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    """Показывает план и спрашивает одобрение. При отказе возвращает подсказки для перепланирования."""
+    print_plan(plan)
+    ans = input("Одобрить этот шаг? [y/n]: ").strip().lower()
+    if ans in ("y", "yes", ""):
+        return True, None
+    return False, collect_hints() or {"note": "user_rejected_without_hints"}
+
+
+def ask_continue_after_error() -> bool:
+    ans = (
+        input(
+            "Шаг завершился с ошибками. Продолжить к следующему шагу? [y/n]: "
+        )
+        .strip()
+        .lower()
+    )
+    return ans in ("y", "yes", "")
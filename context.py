@@ -1,17 +1,74 @@
+import os
+import asyncio
+from contextlib import asynccontextmanager
+from urllib.parse import urldefrag
+
 from playwright.async_api import async_playwright
-from bs4 import BeautifulSoup
 
-class PlaywrightDriver:
-    def __init__(self, headless: bool = True):
+from dom_tools import build_snapshot, inventory_from_records, diff_inventory, INVENTORY_JS
+from telemetry import span, annotate
+from load_profile import LoadProfile, HttpCache, install as install_load_profile
+from artifacts import ArtifactStore, default_store
+
+# html — инвентарь строится в Python из page.content();
+# browser — один evaluate в странице, HTML через pipe не передаётся
+INVENTORY_MODE = os.getenv("INVENTORY_MODE", "html")
+INVENTORY_LIMIT = int(os.getenv("INVENTORY_LIMIT", "2000"))
+# Спекулятивная загрузка страницы шага в фоновой вкладке, пока идёт планирование.
+# Выключена по умолчанию: фоновая вкладка делит с тестом BrowserContext, и её GET уходит в ту же сессию
+PREFETCH_ENABLED = os.getenv("PREFETCH", "0") in ("1", "true", "yes")
+PREFETCH_TIMEOUT_MS = int(os.getenv("PREFETCH_TIMEOUT_MS", "30000"))
+
+# Счётчик мутаций DOM: ставится до загрузки любых скриптов страницы.
+# __qaDocId меняется при каждой навигации, __qaDomVersion — при любой мутации.
+DOM_VERSION_JS = """
+(() => {
+  if (window.__qaDocId) return;
+  window.__qaDocId = Math.random().toString(36).slice(2);
+  window.__qaDomVersion = 0;
+  new MutationObserver(() => { window.__qaDomVersion++; }).observe(document, {
+    subtree: true, childList: true, attributes: true, characterData: true,
+  });
+})();
+"""
+
+
+# Счётчик вызовов window.open: по нему исполнитель понимает, стоит ли после клика ждать popup
+WINDOW_OPEN_JS = """
+(() => {
+  if (window.__qaWindowOpens !== undefined) return;
+  window.__qaWindowOpens = 0;
+  const open = window.open;
+  window.open = function (...args) {
+    window.__qaWindowOpens++;
+    return open.apply(this, args);
+  };
+})();
+"""
+
+
+class BrowserPool:
+    """Один процесс Chromium на весь прогон и ограниченный пул изолированных контекстов."""
+
+    def __init__(
+        self,
+        headless: bool = True,
+        size: int = 4,
+        profile: LoadProfile | None = None,
+        http_cache: HttpCache | None = None,
+    ):
         self._headless = headless
+        self._size = max(1, size)
+        self._profile = profile
+        self._http_cache = http_cache
         self._play = None
         self._browser = None
-        self.page = None
+        self._sem = None
 
     async def start(self):
         self._play = await async_playwright().start()
         self._browser = await self._play.chromium.launch(headless=self._headless)
-        self.page = await self._browser.new_page()
+        self._sem = asyncio.Semaphore(self._size)
 
     async def stop(self):
         if self._browser:
@@ -19,14 +76,261 @@ class PlaywrightDriver:
         if self._play:
             await self._play.stop()
 
-    async def snapshot(self):
-        html = await self.page.content()
-        soup = BeautifulSoup(html, "lxml")
-        body = soup.body
-        if body:
-            for svg in body.find_all("svg"):
-                svg.decompose()
-            body_html = str(body)
-        else:
-            body_html = html
-        return {"url": self.page.url, "title": await self.page.title(), "bodyHtml": body_html}
+    @asynccontextmanager
+    async def driver(self, limit: bool = True):
+        """Контекст выдаётся только при свободном слоте пула и закрывается после теста.
+
+        limit=False — вне лимита пула: для setup-кейса сессии, который запускается,
+        пока тест-кейсы держат все слоты и ждут эту сессию.
+        """
+        if limit:
+            await self._sem.acquire()
+        try:
+            drv = PlaywrightDriver(
+                headless=self._headless, browser=self._browser,
+                profile=self._profile, http_cache=self._http_cache,
+            )
+            await drv.start()
+            try:
+                yield drv
+            finally:
+                await drv.stop()
+        finally:
+            if limit:
+                self._sem.release()
+
+
+class PlaywrightDriver:
+    """Браузерный контекст теста и его вкладки.
+
+    page — активная вкладка: новая вкладка или popup (напр. после клика по target=_blank)
+    сразу становится активной, при её закрытии активной снова становится предыдущая.
+    prefetch() заранее открывает URL в фоновой вкладке; navigate на тот же URL забирает
+    её вместе с готовым снимком вместо повторной загрузки.
+    """
+
+    def __init__(
+        self,
+        headless: bool = True,
+        browser=None,
+        inventory_mode: str = INVENTORY_MODE,
+        profile: LoadProfile | None = None,
+        http_cache: HttpCache | None = None,
+        storage_state: dict | None = None,
+        artifacts: ArtifactStore | None = None,
+    ):
+        self._headless = headless
+        self.inventory_mode = inventory_mode
+        # HTML снимков живёт в хранилище артефактов, в снимке и состоянии — только ссылка
+        self.artifacts = artifacts or default_store()
+        self.storage_state = storage_state
+        self.profile = profile or LoadProfile()
+        self._http_cache = http_cache
+        self._play = None
+        self._browser = browser
+        self._owns_browser = browser is None
+        self.context = None
+        self.page = None
+        self.pages = []
+        self._snap_key = None
+        self._snap = None
+        self._prefetch = None
+        self._opening_prefetch = False
+
+    async def start(self):
+        if self._browser is None:
+            self._play = await async_playwright().start()
+            self._browser = await self._play.chromium.launch(headless=self._headless)
+        # Каждый тест — в своём BrowserContext: cookies/storage не пересекаются
+        # storage_state — cookies и localStorage сохранённой сессии (напр. после логина)
+        self.context = await self._browser.new_context(
+            storage_state=self.storage_state, **self.profile.context_options()
+        )
+        await self.context.add_init_script(DOM_VERSION_JS)
+        await self.context.add_init_script(WINDOW_OPEN_JS)
+        # Профиль загрузки: блокировка лишних ресурсов, без анимаций, локальный кэш статики
+        await install_load_profile(self.context, self.profile, self._http_cache)
+        self.pages = []
+        self.context.on("page", self._on_page)
+        self.page = await self.context.new_page()
+
+    def _on_page(self, page):
+        if page in self.pages:
+            return
+        self.pages.append(page)
+        page.on("close", lambda _: self._on_close(page))
+        # Фоновая вкладка prefetch не должна перехватывать фокус
+        if not self._opening_prefetch:
+            self.page = page
+
+    def _on_close(self, page):
+        if page in self.pages:
+            self.pages.remove(page)
+        if page is self.page:
+            self.page = self.pages[-1] if self.pages else None
+
+    async def active_page(self):
+        """Активная вкладка; если тест закрыл все вкладки — новая пустая."""
+        if self.page is None:
+            await self.context.new_page()  # _on_page сделает её активной
+        return self.page
+
+    async def restart(self, storage_state: dict | None = None):
+        """Новый BrowserContext в том же браузере, например с другим storage state."""
+        await self.drop_prefetch()
+        if self.context:
+            await self.context.close()
+        self.storage_state = storage_state
+        self._snap_key = self._snap = None
+        await self.start()
+
+    async def stop(self):
+        await self.drop_prefetch()
+        if self.context:
+            await self.context.close()
+        if self._owns_browser:
+            if self._browser:
+                await self._browser.close()
+            if self._play:
+                await self._play.stop()
+
+    @property
+    def tabs(self) -> int:
+        """Открытые вкладки теста, без фоновой вкладки prefetch."""
+        return len(self.pages) - (1 if self._prefetch else 0)
+
+    # === Prefetch ===
+    async def prefetch(self, url: str):
+        """Начинает загрузку url в фоновой вкладке и разбор её DOM, не дожидаясь результата."""
+        if not PREFETCH_ENABLED or self.context is None:
+            return
+        url = urldefrag(url)[0]
+        if self._prefetch and self._prefetch["url"] == url:
+            return
+        await self.drop_prefetch()
+        self._opening_prefetch = True
+        try:
+            page = await self.context.new_page()
+        finally:
+            self._opening_prefetch = False
+        pf = {"url": url, "page": page, "cookies": None, "snap": None}
+        pf["task"] = asyncio.create_task(self._warm(page, url, pf))
+        self._prefetch = pf
+        print(f"[prefetch] {url}")
+
+    async def _warm(self, page, url: str, pf: dict):
+        await page.goto(url, wait_until="domcontentloaded", timeout=PREFETCH_TIMEOUT_MS)
+        # Если до перехода cookies сменятся (напр. логин на текущем шаге), загрузка устарела
+        pf["cookies"] = await self._cookie_jar()
+        key = await self._dom_version(page)
+        pf["snap"] = (key, await self._build_snapshot(page, key))
+
+    async def take_prefetched(self, url: str) -> bool:
+        """Переход на url через готовую фоновую вкладку: она становится активной, старая закрывается.
+
+        False — подходящей загрузки нет или она устарела; тогда переходить нужно обычным goto.
+        Загрузка другого URL остаётся ждать своего шага.
+        """
+        pf = self._prefetch
+        if pf is None or pf["url"] != urldefrag(url)[0]:
+            return False
+        self._prefetch = None
+        with span("prefetch.take", url=pf["url"]):
+            try:
+                await pf["task"]
+                if await self._cookie_jar() != pf["cookies"]:
+                    raise LookupError("cookies изменились")
+            except Exception as e:
+                annotate(hit=False, reason=str(e)[:120])
+                await self._discard(pf)
+                return False
+            annotate(hit=True)
+            old, self.page = self.page, pf["page"]
+            if old is not None and old is not self.page:
+                await old.close()
+            self._snap_key, self._snap = pf["snap"]
+            return True
+
+    async def _cookie_jar(self):
+        # Только то, что уходит на сервер: продление expires изменением не считается
+        return sorted((c["name"], c["domain"], c["path"], c["value"]) for c in await self.context.cookies())
+
+    async def drop_prefetch(self):
+        pf, self._prefetch = self._prefetch, None
+        if pf is not None:
+            await self._discard(pf)
+
+    async def _discard(self, pf: dict):
+        pf["task"].cancel()
+        try:
+            await pf["task"]
+        except BaseException:
+            pass
+        try:
+            await pf["page"].close()
+        except Exception:
+            pass
+
+    # === Снимок ===
+    async def _dom_version(self, page=None):
+        page = page or self.page
+        try:
+            doc_id, version = await page.evaluate(
+                "() => [window.__qaDocId || null, window.__qaDomVersion || 0]"
+            )
+        except Exception:
+            return None
+        if not doc_id:
+            return None
+        return (page.url, doc_id, version)
+
+    async def _build_snapshot(self, page, key) -> dict:
+        with span("dom.inventory"):
+            if self.inventory_mode == "browser":
+                records = await page.evaluate(INVENTORY_JS, INVENTORY_LIMIT)
+                body_html, inventory = "", inventory_from_records(records)
+            else:
+                html = await page.content()
+                annotate(html_chars=len(html))
+                body_html, inventory = build_snapshot(html)
+            annotate(inventory_items=len(inventory))
+        annotate(body_chars=len(body_html))
+        return {
+            "url": page.url,
+            "title": await page.title(),
+            "bodyRef": self.artifacts.put(body_html) if body_html else None,
+            "inventory": inventory,
+            "diff": None,
+            "tabs": self.tabs,
+            # Документ (меняется при навигации): дифф инвентаря имеет смысл только внутри одного
+            "doc": key[1] if key else None,
+        }
+
+    async def snapshot(self, since: dict | None = None):
+        """Снимок активной вкладки: url, title, bodyRef (ссылка на body без svg в self.artifacts),
+        DOM-инвентарь и число открытых вкладок.
+
+        HTML разбирается один раз; пока URL и счётчик мутаций DOM не изменились,
+        повторные вызовы возвращают уже готовый результат без разбора.
+        since — более ранний снимок (например, тот, по которому планировался прошлый шаг):
+        если документ тот же (SPA), в "diff" кладётся дифф инвентаря относительно него.
+        Без since, после навигации и при неизменном DOM "diff" — None.
+        В режиме inventory_mode="browser" инвентарь собирается в странице,
+        а bodyRef — None.
+        """
+        with span("snapshot", mode=self.inventory_mode):
+            page = await self.active_page()
+            key = await self._dom_version(page)
+            if key is not None and key == self._snap_key:
+                annotate(reused=True)
+                snap = {**self._snap, "title": await page.title(), "tabs": self.tabs}
+            else:
+                snap = await self._build_snapshot(page, key)
+                annotate(reused=False)
+                self._snap_key, self._snap = key, snap
+                snap = dict(snap)
+            # Тот же объект инвентаря — DOM с since не менялся, диффа нет
+            same_doc = since and snap["doc"] is not None and since.get("doc") == snap["doc"]
+            if same_doc and since.get("inventory") is not snap["inventory"]:
+                snap["diff"] = diff_inventory(since["inventory"], snap["inventory"])
+            return snap
@@ -1,27 +1,338 @@
-from bs4 import BeautifulSoup
-from typing import List, Dict
+from __future__ import annotations
+import hashlib
+from dataclasses import dataclass, field, asdict
+from bs4 import BeautifulSoup, NavigableString
+from typing import List, Dict, Tuple, Any, Optional
 
-def build_dom_inventory(html: str) -> List[Dict]:
+TEXT_LIMIT = 100
+
+_DROP_TAGS = frozenset(("script", "style", "noscript", "template", "svg"))
+_INTERACTIVE_TAGS = frozenset((
+    "a", "button", "input", "select", "textarea", "option", "label",
+    "summary", "details", "form", "img", "iframe",
+    "h1", "h2", "h3", "h4", "h5", "h6",
+))
+_IDENTIFYING_ATTRS = (
+    "id", "role", "data-testid", "placeholder", "name", "aria-label",
+    "onclick", "tabindex", "contenteditable", "href",
+)
+_LABELABLE_TAGS = frozenset(("input", "select", "textarea", "button"))
+
+
+@dataclass(slots=True)
+class InventoryItem:
+    """Компактная запись DOM-инвентаря. Поддерживает dict-доступ (`item["tag"]`, `item.get()`)."""
+
+    tag: str
+    id: Optional[str] = None
+    role: Optional[str] = None
+    testid: Optional[str] = None
+    placeholder: Optional[str] = None
+    label: Optional[str] = None
+    text: str = ""
+    cssCandidates: List[str] = field(default_factory=list)
+    # Заполняются только при сборе инвентаря в браузере (INVENTORY_JS)
+    name: Optional[str] = None
+    bbox: Optional[List[int]] = None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def _is_hidden(el) -> bool:
+    attrs = el.attrs
+    if "hidden" in attrs or attrs.get("aria-hidden") == "true":
+        return True
+    if el.name == "input" and (attrs.get("type") or "").lower() == "hidden":
+        return True
+    style = attrs.get("style")
+    if style:
+        style = style.replace(" ", "").lower()
+        if "display:none" in style or "visibility:hidden" in style:
+            return True
+    return False
+
+
+def _css_candidates(el) -> List[str]:
+    return _css_from_classes(el.attrs.get("class") or ())
+
+
+def _css_from_classes(classes) -> List[str]:
+    out = []
+    for c in classes:
+        if c:
+            stable = c.split("-")[0]
+            out.append(f"[class^=\"{stable}\"]")
+    return out
+
+
+def _new_item(el) -> InventoryItem:
+    attrs = el.attrs
+    return InventoryItem(
+        tag=el.name,
+        id=attrs.get("id"),
+        role=attrs.get("role"),
+        testid=attrs.get("data-testid"),
+        placeholder=attrs.get("placeholder"),
+        cssCandidates=_css_candidates(el),
+    )
+
+
+def _element_children(el) -> list:
+    return [c for c in el.children if c.name]
+
+
+def _walk(roots) -> List[InventoryItem]:
+    """Один линейный обход: svg вырезается на месте, текст копится снизу вверх.
+
+    Каждый узел получает не более TEXT_LIMIT символов от каждого ребёнка, поэтому
+    стоимость O(n), а не O(n·глубина), как у get_text() на каждом элементе.
+    В инвентарь попадают только видимые (по статическому HTML) интерактивные
+    или идентифицируемые элементы и элементы с собственным текстом.
+    """
+    items: List[InventoryItem] = []
+    # Запись стека: [el, item|None, text_parts, text_len]
+    stack: List[list] = []
+    labels_for: Dict[str, str] = {}
+    label_controls: List[List[InventoryItem]] = []
+
+    def _enter(el):
+        name = el.name
+        if name in _DROP_TAGS:
+            if name == "svg":
+                el.decompose()
+            return
+        if _is_hidden(el):
+            # Скрытое поддерево в инвентарь не идёт, но svg из HTML всё равно вырезаем
+            for svg in el.find_all("svg"):
+                svg.decompose()
+            return
+        attrs = el.attrs
+        children = list(el.children)
+        # Обёртки без атрибутов оставляем, только если у них есть собственный текст
+        keep = (
+            name in _INTERACTIVE_TAGS
+            or any(a in attrs for a in _IDENTIFYING_ATTRS)
+            or any(_is_text(c) and c.strip() for c in children)
+        )
+        item = _new_item(el) if keep else None
+        if item is not None:
+            items.append(item)
+            if name in _LABELABLE_TAGS and label_controls:
+                label_controls[-1].append(item)
+        if name == "label":
+            label_controls.append([])
+        stack.append([el, item, [], 0])
+        # Дети обрабатываются в порядке документа; маркер None закрывает элемент
+        todo.append(None)
+        todo.extend(reversed(children))
+
+    def _exit():
+        el, item, parts, _ = stack.pop()
+        text = "".join(parts)
+        if item is not None:
+            item.text = text
+        if el.name == "label":
+            controls = label_controls.pop()
+            label_text = text[:80] or None
+            for ctl in controls:
+                if ctl.label is None:
+                    ctl.label = label_text
+            target = el.attrs.get("for")
+            if target and label_text:
+                labels_for.setdefault(target, label_text)
+        if stack and text:
+            _append_text(stack[-1], text)
+
+    todo: list = list(reversed(roots))
+    while todo:
+        node = todo.pop()
+        if node is None:
+            _exit()
+        elif node.name:
+            _enter(node)
+        elif stack and _is_text(node):
+            s = node.strip()
+            if s:
+                _append_text(stack[-1], s)
+
+    if labels_for:
+        for item in items:
+            if item.label is None and item.id in labels_for:
+                item.label = labels_for[item.id]
+    return items
+
+
+def _is_text(node) -> bool:
+    # Комментарии, CDATA, doctype и т.п. — тоже NavigableString, но текстом не считаются
+    return type(node) is NavigableString
+
+
+def _append_text(frame: list, s: str) -> None:
+    room = TEXT_LIMIT - frame[3]
+    if room <= 0:
+        return
+    if len(s) > room:
+        s = s[:room]
+    frame[2].append(s)
+    frame[3] += len(s)
+
+
+def build_snapshot(html: str) -> Tuple[str, List[InventoryItem]]:
+    """Разбирает HTML один раз: возвращает body без svg и DOM-инвентарь."""
+    soup = BeautifulSoup(html, "lxml")
+    body = soup.body
+    if not body:
+        return html, _walk(_element_children(soup))
+    items = _walk([body])
+    return str(body), items
+
+
+def build_dom_inventory(html: str) -> List[InventoryItem]:
     soup = BeautifulSoup(html, "lxml")
+    return _walk(_element_children(soup))
+
+
+# === Дифф инвентаря между снимками ===
+# Поля, изменение которых делает элемент «изменённым», а не удалённым и добавленным заново
+DIFF_FIELDS = ("text", "label", "placeholder", "name", "role")
+_SIGNATURE_FIELDS = ("tag", "role", "placeholder", "label", "name")
+
+
+def item_key(e: Dict[str, Any]) -> str:
+    """Устойчивая идентичность элемента между снимками: testid, id или хэш сигнатуры.
+
+    Текст входит в сигнатуру только у элементов без других отличительных признаков —
+    иначе смена текста кнопки выглядела бы как удаление и добавление.
+    """
+    if e.get("testid"):
+        return f"testid:{e['testid']}"
+    if e.get("id"):
+        return f"id:{e['id']}"
+    css = e.get("cssCandidates") or []
+    parts = [str(e.get(k) or "") for k in _SIGNATURE_FIELDS] + [css[0] if css else ""]
+    if not any(parts[1:]):
+        parts.append(e.get("text") or "")
+    return "h:" + hashlib.blake2b("|".join(parts).encode("utf-8"), digest_size=6).hexdigest()
+
+
+def _keyed(inventory) -> Dict[str, Any]:
+    # Одинаковые ключи различаем порядковым номером в документе
+    out: Dict[str, Any] = {}
+    seen: Dict[str, int] = {}
+    for e in inventory or []:
+        k = item_key(e)
+        n = seen.get(k, 0)
+        seen[k] = n + 1
+        out[f"{k}#{n}" if n else k] = e
+    return out
+
+
+def diff_inventory(prev, cur) -> Dict[str, Any]:
+    """Структурный дифф двух инвентарей одного документа.
+
+    Возвращает {"added": [...], "removed": [...], "changed": [(было, стало), ...], "unchanged": n}.
+    """
+    old, new = _keyed(prev), _keyed(cur)
+    added, changed = [], []
+    for k, e in new.items():
+        before = old.get(k)
+        if before is None:
+            added.append(e)
+        elif any(before.get(f) != e.get(f) for f in DIFF_FIELDS):
+            changed.append((before, e))
+    removed = [e for k, e in old.items() if k not in new]
+    return {
+        "added": added,
+        "removed": removed,
+        "changed": changed,
+        "unchanged": len(new) - len(added) - len(changed),
+    }
+
+
+# === Инвентарь, собранный в браузере ===
+# Один evaluate в странице: только видимые интерактивные элементы, с вычисленной
+# ролью, доступным именем, связанным <label> и bounding box. HTML в Python не передаётся.
+INVENTORY_JS = """
+(limit) => {
+  const SELECTOR = 'a,button,input,select,textarea,option,label,summary,details,iframe,img[alt],'
+    + 'h1,h2,h3,h4,h5,h6,[role],[data-testid],[onclick],[tabindex],[contenteditable="true"],[contenteditable=""]';
+  const IMPLICIT = {A: 'link', BUTTON: 'button', SELECT: 'combobox', TEXTAREA: 'textbox', OPTION: 'option',
+    SUMMARY: 'button', IMG: 'img', H1: 'heading', H2: 'heading', H3: 'heading', H4: 'heading',
+    H5: 'heading', H6: 'heading'};
+  const INPUT_ROLES = {checkbox: 'checkbox', radio: 'radio', button: 'button', submit: 'button',
+    reset: 'button', image: 'button', range: 'slider', search: 'searchbox', number: 'spinbutton'};
+  const clip = (s, n) => (s || '').replace(/\\s+/g, ' ').trim().slice(0, n);
+  const isVisible = (el, r) => {
+    if (r.width === 0 && r.height === 0) return false;
+    const cs = getComputedStyle(el);
+    return cs.visibility !== 'hidden' && cs.display !== 'none' && parseFloat(cs.opacity || '1') > 0;
+  };
+  const roleOf = (el) => {
+    const explicit = el.getAttribute('role');
+    if (explicit) return explicit;
+    if (el.tagName === 'INPUT') return INPUT_ROLES[(el.type || '').toLowerCase()] || 'textbox';
+    if (el.tagName === 'A' && !el.hasAttribute('href')) return null;
+    return IMPLICIT[el.tagName] || null;
+  };
+  const labelOf = (el) => {
+    if (el.labels && el.labels.length) return clip([...el.labels].map((l) => l.innerText).join(' '), 80) || null;
+    const ids = el.getAttribute('aria-labelledby');
+    if (ids) {
+      return clip(ids.split(/\\s+/).map((i) => (document.getElementById(i) || {}).innerText || '').join(' '), 80) || null;
+    }
+    return null;
+  };
+  const isField = (el) => el.tagName === 'INPUT' || el.tagName === 'TEXTAREA' || el.tagName === 'SELECT';
+  const out = [];
+  for (const el of document.querySelectorAll(SELECTOR)) {
+    if (out.length >= limit) break;
+    if (el.closest('svg')) continue;
+    const r = el.getBoundingClientRect();
+    if (!isVisible(el, r)) continue;
+    const label = labelOf(el);
+    const text = isField(el) ? '' : clip(el.innerText, 100);
+    const name = clip(el.getAttribute('aria-label') || label || el.getAttribute('alt') || el.getAttribute('title')
+      || (isField(el) ? el.getAttribute('placeholder') : text), 100) || null;
+    out.push({
+      tag: el.tagName.toLowerCase(),
+      id: el.id || null,
+      role: roleOf(el),
+      testid: el.getAttribute('data-testid'),
+      placeholder: el.getAttribute('placeholder'),
+      label, text, name,
+      bbox: [Math.round(r.x), Math.round(r.y), Math.round(r.width), Math.round(r.height)],
+      cls: el.getAttribute('class') || '',
+    });
+  }
+  return out;
+}
+"""
+
+
+def inventory_from_records(records: List[Dict[str, Any]]) -> List[InventoryItem]:
+    """Превращает результат INVENTORY_JS в записи инвентаря."""
     items = []
-    for el in soup.find_all(True):
-        tag = el.name
-        if tag in ("script","style","svg","path"):
-            continue
-        item = {
-            "tag": tag,
-            "id": el.get("id"),
-            "role": el.get("role"),
-            "testid": el.get("data-testid"),
-            "placeholder": el.get("placeholder"),
-            "label": None,
-            "text": (el.get_text(strip=True) or "")[:100],
-            "cssCandidates": []
-        }
-        if "class" in el.attrs:
-            for c in el["class"]:
-                if c:
-                    stable = c.split("-")[0]
-                    item["cssCandidates"].append(f"[class^=\"{stable}\"]")
-        items.append(item)
+    for r in records or []:
+        items.append(InventoryItem(
+            tag=r.get("tag") or "",
+            id=r.get("id"),
+            role=r.get("role"),
+            testid=r.get("testid"),
+            placeholder=r.get("placeholder"),
+            label=r.get("label"),
+            text=r.get("text") or "",
+            cssCandidates=_css_from_classes((r.get("cls") or "").split()),
+            name=r.get("name"),
+            bbox=r.get("bbox"),
+        ))
     return items
@@ -1,25 +1,375 @@
+import os
+import re
+import time
+import asyncio
 import traceback
-from models import StepPlan, ExecResult, ExecError
+from typing import List
+from models import StepPlan, ExecResult, ExecError, Instruction, Expectation, Selector, Target, WaitSpec
+from healing import heal_selector
+from telemetry import span, annotate
 
-async def execute_step(driver, plan: StepPlan) -> ExecResult:
+# Таймаут повторной попытки с «вылеченным» селектором: элемент уже есть на странице
+HEAL_TIMEOUT_MS = int(os.getenv("HEAL_TIMEOUT_MS", "2000"))
+
+ACTION_TIMEOUT_MS = int(os.getenv("ACTION_TIMEOUT_MS", "10000"))
+EXPECT_TIMEOUT_MS = int(os.getenv("EXPECT_TIMEOUT_MS", "10000"))
+# Сколько ждать уникального совпадения, если уже есть видимое, но неоднозначное
+SELECTOR_RACE_MS = int(os.getenv("SELECTOR_RACE_MS", "1500"))
+# Сколько каждый кандидат ждёт в гонке селекторов; полный таймаут действия — только на общее ожидание
+SELECTOR_PROBE_MS = int(os.getenv("SELECTOR_PROBE_MS", "2000"))
+# Сколько от начала клика ждать события новой вкладки/popup, если клик мог его открыть (0 — не ждать)
+POPUP_WAIT_MS = int(os.getenv("POPUP_WAIT_MS", "500"))
+
+# Действия, после которых заранее загруженная страница шага ещё актуальна
+_READ_ONLY_ACTIONS = {"waitForSelector", "waitForURL", "assertVisible", "assertText"}
+
+# role-селектор: "button", "button[name=\"Сохранить\"]" или "button[name=Сохранить]"
+_ROLE_RE = re.compile(r"""^\s*([a-zA-Z]+)\s*(?:\[\s*name\s*=\s*(["']?)(.*?)\2\s*\])?\s*$""")
+
+# Ожидание текста без опроса: проверка на каждую пачку мутаций DOM внутри root
+_WAIT_TEXT_FN = """
+(root, text, timeout) => new Promise((resolve) => {
+  const has = () => (root.textContent || '').includes(text);
+  if (has()) return resolve(true);
+  let timer = null;
+  const obs = new MutationObserver(() => {
+    if (has()) { obs.disconnect(); clearTimeout(timer); resolve(true); }
+  });
+  obs.observe(root, {subtree: true, childList: true, characterData: true});
+  timer = setTimeout(() => { obs.disconnect(); resolve(false); }, timeout);
+})
+"""
+_PAGE_WAIT_TEXT_JS = f"([t, ms]) => ({_WAIT_TEXT_FN})(document.documentElement, t, ms)"
+_ELEMENT_WAIT_TEXT_JS = f"(el, [t, ms]) => ({_WAIT_TEXT_FN})(el, t, ms)"
+
+
+class ExpectationFailed(Exception):
+    pass
+
+
+def resolve_locator(page, sel: Selector):
+    """Selector из плана → Playwright Locator с учётом типа селектора."""
+    v = sel.value
+    if sel.type == "testid":
+        return page.get_by_test_id(v)
+    if sel.type == "role":
+        m = _ROLE_RE.match(v)
+        if m:
+            role, _, name = m.groups()
+            return page.get_by_role(role.lower(), name=name) if name else page.get_by_role(role.lower())
+        return page.locator(f"[role=\"{v}\"]")
+    if sel.type == "label":
+        return page.get_by_label(v)
+    if sel.type == "placeholder":
+        return page.get_by_placeholder(v)
+    if sel.type == "text":
+        return page.get_by_text(v)
+    if sel.type == "id":
+        ident = v[1:] if v.startswith("#") else v
+        return page.locator(f"[id=\"{ident}\"]")
+    return page.locator(v)
+
+
+async def _race(page, candidates: List[Selector], budget: int):
+    # Все кандидаты ждут параллельно не дольше budget; побеждает первый видимый уникальный
+    async def _probe(i: int, sel: Selector):
+        loc = resolve_locator(page, sel)
+        await loc.first.wait_for(state="visible", timeout=budget)
+        return i, sel, loc, await loc.count()
+
+    tasks = [asyncio.create_task(_probe(i, sel)) for i, sel in enumerate(candidates)]
+    ambiguous = {}
+    errors = {}
+    started = time.monotonic()
+    pending = set(tasks)
+    try:
+        while pending:
+            wait_for = None
+            if ambiguous:
+                wait_for = max(0.0, started + SELECTOR_RACE_MS / 1000 - time.monotonic())
+            done, pending = await asyncio.wait(pending, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            unique = []
+            for t in done:
+                if t.exception() is not None:
+                    errors[tasks.index(t)] = t.exception()
+                    continue
+                i, sel, loc, count = t.result()
+                if count == 1:
+                    unique.append((i, loc, sel))
+                else:
+                    ambiguous[i] = (loc.first, sel)
+            if unique:
+                _, loc, sel = min(unique, key=lambda u: u[0])
+                return loc, sel
+        if ambiguous:
+            return ambiguous[min(ambiguous)]
+        raise errors.get(0) or TimeoutError("Ни один селектор цели не найден")
+    finally:
+        for t in pending:
+            t.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def resolve_target(page, target: Target, timeout: int, probe_only: bool = False):
+    """Гонка основного и альтернативных селекторов: побеждает первый видимый уникальный.
+
+    Кандидаты проверяются параллельно с коротким бюджетом SELECTOR_PROBE_MS, так что
+    промах основного селектора не стоит полного таймаута. Если за SELECTOR_RACE_MS
+    нашлись только неоднозначные совпадения, берётся первое совпадение самого
+    приоритетного из них. Если не нашлось ничего (страница ещё грузится), остаток
+    таймаута уходит на одно общее ожидание любого из кандидатов; probe_only=True —
+    только короткая проверка. Возвращает (locator, selector).
+    """
+    candidates = [target.selector, *target.alternatives]
+    started = time.monotonic()
+    try:
+        return await _race(page, candidates, min(timeout, SELECTOR_PROBE_MS))
+    except Exception:
+        remaining = int(timeout - (time.monotonic() - started) * 1000)
+        if probe_only or remaining <= 0:
+            raise
+    any_of = resolve_locator(page, candidates[0])
+    for sel in candidates[1:]:
+        any_of = any_of.or_(resolve_locator(page, sel))
+    await any_of.first.wait_for(state="visible", timeout=remaining)
+    # Что-то появилось — выбираем кандидата по тем же правилам
+    return await _race(page, candidates, SELECTOR_RACE_MS)
+
+
+def promote_selector(target: Target, winner: Selector) -> bool:
+    """Делает победивший селектор основным; прежний основной уходит в альтернативы."""
+    if winner is target.selector:
+        return False
+    rest = [a for a in target.alternatives if a is not winner]
+    target.alternatives = [target.selector, *rest]
+    target.selector = winner
+    return True
+
+
+def _timeout(spec: WaitSpec | None, default: int) -> int:
+    return spec.timeoutMs if spec else default
+
+
+async def _wait_load(page, spec: WaitSpec | None):
+    if spec:
+        await page.wait_for_load_state(spec.for_, timeout=spec.timeoutMs)
+
+
+async def _wait_url(page, part: str, timeout: int):
+    # wait_for_url реагирует на события навигации (в т.ч. pushState в SPA), без опроса
+    await page.wait_for_url(lambda u: part in u, wait_until="commit", timeout=timeout)
+
+
+async def _wait_text(page, text: str, timeout: int, locator=None) -> bool:
+    deadline = time.monotonic() + timeout / 1000
+    while True:
+        left = int((deadline - time.monotonic()) * 1000)
+        if left <= 0:
+            return False
+        try:
+            if locator is not None:
+                await locator.wait_for(state="attached", timeout=left)
+                left = max(1, int((deadline - time.monotonic()) * 1000))
+                return await locator.evaluate(_ELEMENT_WAIT_TEXT_JS, [text, left])
+            return await page.evaluate(_PAGE_WAIT_TEXT_JS, [text, left])
+        except Exception as e:
+            # Навигация уничтожила документ, в котором ждали, — продолжаем ждать в новом
+            if "context was destroyed" not in str(e) and "navigat" not in str(e):
+                raise
+
+
+# Может ли клик открыть вкладку: ссылка/форма с target или вызов window.open (счётчик
+# ставит WINDOW_OPEN_JS драйвера). Возвращает [target открывает окно, счётчик до клика]
+_OPENS_WINDOW_JS = """
+(el) => {
+  const owner = el.closest('a[target], area[target], form[target], [formtarget]');
+  const target = owner ? (owner.getAttribute('formtarget') || owner.getAttribute('target') || '') : '';
+  return [!['', '_self', '_parent', '_top'].includes(target.toLowerCase()), window.__qaWindowOpens || 0];
+}
+"""
+_WINDOW_OPENS_JS = "() => window.__qaWindowOpens || 0"
+
+
+async def _click(page, locator, timeout: int):
+    # Событие "page" для popup может прийти уже после возврата click(): без ожидания
+    # следующие инструкции и проверки ушли бы в старую вкладку. Ждём его, только если клик
+    # мог открыть окно, — обычный клик возвращается сразу. Окно ожидания отсчитывается
+    # от начала клика, поэтому долгий клик (с навигацией) лишнего времени не добавляет
+    if POPUP_WAIT_MS <= 0:
+        await locator.click(timeout=timeout)
+        return
+    opened = asyncio.Event()
+
+    def on_page(_):
+        opened.set()
+
+    context = page.context
+    context.on("page", on_page)
+    try:
+        t0 = time.monotonic()
+        try:
+            may_open, before = await locator.evaluate(_OPENS_WINDOW_JS, timeout=min(timeout, POPUP_WAIT_MS))
+        except Exception:
+            # Элемента ещё нет — дождётся сам click(); судим только по window.open
+            may_open, before = False, None
+        await locator.click(timeout=timeout)
+        if opened.is_set():
+            return
+        if not may_open:
+            try:
+                may_open = await page.evaluate(_WINDOW_OPENS_JS) > (before or 0)
+            except Exception:
+                # Клик увёл вкладку на другой документ — новой вкладки он не открывал
+                return
+        if may_open:
+            left = POPUP_WAIT_MS / 1000 - (time.monotonic() - t0)
+            if left > 0:
+                try:
+                    await asyncio.wait_for(opened.wait(), left)
+                except asyncio.TimeoutError:
+                    pass
+    finally:
+        context.remove_listener("page", on_page)
+
+
+async def run_instruction(page, ins: Instruction, locator=None):
+    """wait — чего дождаться перед действием (для navigate — условие загрузки), waitAfter — после."""
+    timeout = _timeout(ins.wait, ACTION_TIMEOUT_MS)
+    if ins.action == "navigate" and ins.url:
+        wait_until = ins.wait.for_ if ins.wait else "domcontentloaded"
+        await page.goto(ins.url, wait_until=wait_until, timeout=timeout)
+    elif ins.action == "waitForURL" and (ins.url or ins.value):
+        await _wait_url(page, ins.url or ins.value, timeout)
+        await _wait_load(page, ins.wait)
+    else:
+        await _wait_load(page, ins.wait)
+        if ins.action == "assertText" and ins.value is not None:
+            if not await _wait_text(page, ins.value, timeout, locator):
+                raise ExpectationFailed(f"Text not found: {ins.value!r}")
+        elif locator is not None:
+            if ins.action == "click":
+                await _click(page, locator, timeout)
+            elif ins.action == "fill":
+                await locator.fill(ins.value or "", timeout=timeout)
+            elif ins.action in ("waitForSelector", "assertVisible"):
+                await locator.wait_for(state="visible", timeout=timeout)
+    await _wait_load(page, ins.waitAfter)
+
+
+async def check_expectation(page, exp: Expectation, timeout: int = EXPECT_TIMEOUT_MS):
+    if exp.kind == "urlIncludes" and exp.value:
+        try:
+            await _wait_url(page, exp.value, timeout)
+        except Exception:
+            raise ExpectationFailed(f"URL does not include {exp.value!r}: {page.url}")
+    elif exp.kind == "elementVisible" and exp.selector:
+        try:
+            await resolve_locator(page, exp.selector).first.wait_for(state="visible", timeout=timeout)
+        except Exception:
+            raise ExpectationFailed(f"Element not visible: {exp.selector.type}={exp.selector.value!r}")
+    elif exp.kind == "assertText" and exp.value:
+        locator = resolve_locator(page, exp.selector).first if exp.selector else None
+        if not await _wait_text(page, exp.value, timeout, locator):
+            raise ExpectationFailed(f"Text not found: {exp.value!r}")
+
+
+async def _heal_target(driver, target: Target, plan_inventory, res: ExecResult, idx: int):
+    """Локальное лечение цели по инвентарю: без обращения к LLM. Возвращает locator или None."""
+    snap = await driver.snapshot()
+    for failed in [target.selector, *target.alternatives]:
+        healed = heal_selector(failed, plan_inventory, snap["inventory"])
+        if not healed:
+            continue
+        sel, score = healed
+        try:
+            locator, _ = await resolve_target(driver.page, Target(selector=sel), HEAL_TIMEOUT_MS)
+        except Exception:
+            continue
+        target.alternatives = [target.selector, *(a for a in target.alternatives if a != sel)]
+        target.selector = sel
+        res.logs.append(f"{idx}. selector: вылечен {failed.type}={failed.value!r} → {sel.type}={sel.value!r} (score {score:.2f})")
+        return locator
+    return None
+
+
+async def execute_step(driver, plan: StepPlan, heal_inventory=None, snapshot: bool = True) -> ExecResult:
+    """Исполняет план. heal_inventory — инвентарь, по которому строился план: если цель не
+    найдена, селектор лечится локально по похожести на текущий инвентарь.
+    snapshot=False — не снимать DOM после шага (режим replay)."""
     res = ExecResult(ok=True)
+    page = await driver.active_page()
+    stage = "instructions"
+    idx = None
     try:
-        for ins in plan.instructions:
-            if ins.action == "navigate" and ins.url:
-                await driver.page.goto(ins.url)
-            elif ins.action == "click" and ins.target:
-                await driver.page.click(ins.target.selector.value)
-            elif ins.action == "fill" and ins.target:
-                await driver.page.fill(ins.target.selector.value, ins.value or "")
-            elif ins.action == "waitForSelector" and ins.target:
-                await driver.page.wait_for_selector(ins.target.selector.value)
-            elif ins.action == "assertVisible" and ins.target:
-                el = await driver.page.wait_for_selector(ins.target.selector.value)
-                if not el:
-                    raise Exception(f"Element not visible: {ins.target.selector.value}")
-        snap = await driver.snapshot()
-        res.url, res.title, res.bodyHtml = snap["url"], snap["title"], snap["bodyHtml"]
+        for idx, ins in enumerate(plan.instructions):
+            t0 = time.perf_counter()
+            locator = None
+            with span(f"action.{ins.action}", step=plan.stepId, index=idx):
+                if ins.target and ins.action != "navigate":
+                    with span("selector.resolve"):
+                        timeout = _timeout(ins.wait, ACTION_TIMEOUT_MS)
+                        winner = None
+                        try:
+                            # Если селектор можно вылечить, сначала только короткая проверка:
+                            # лечение не должно ждать полный таймаут действия
+                            locator, winner = await resolve_target(
+                                page, ins.target, timeout, probe_only=heal_inventory is not None
+                            )
+                        except Exception:
+                            if heal_inventory is None:
+                                raise
+                            locator = await _heal_target(driver, ins.target, heal_inventory, res, idx)
+                            annotate(healed=locator is not None)
+                            if locator is None:
+                                # Похожего элемента нет — страница, возможно, ещё грузится: ждём цель полный таймаут
+                                locator, winner = await resolve_target(page, ins.target, timeout)
+                        # Запомним сработавший селектор в плане: дальше (и в кэше планов) он будет основным
+                        if winner is not None and promote_selector(ins.target, winner):
+                            annotate(alternative=True)
+                            res.logs.append(f"{idx}. selector: сработала альтернатива {winner.type}={winner.value!r}")
+                if ins.action == "navigate" and ins.url and await driver.take_prefetched(ins.url):
+                    # Страница уже загружена в фоновой вкладке, пока шаг планировался
+                    page = await driver.active_page()
+                    await _wait_load(page, ins.wait)
+                    await _wait_load(page, ins.waitAfter)
+                    res.logs.append(f"{idx}. navigate: из prefetch")
+                else:
+                    if ins.action not in _READ_ONLY_ACTIONS:
+                        # Клик, ввод или переход могут изменить данные и storage — prefetch устарел
+                        await driver.drop_prefetch()
+                    await run_instruction(page, ins, locator)
+                # Клик мог открыть новую вкладку или popup (дальше работаем с ней) или закрыть текущую
+                page = await driver.active_page()
+            res.logs.append(f"{idx}. {ins.action}: {(time.perf_counter() - t0) * 1000:.0f} мс")
+        stage = "expects"
+        for idx, exp in enumerate(plan.expects):
+            t0 = time.perf_counter()
+            with span(f"expect.{exp.kind}", step=plan.stepId, index=idx):
+                await check_expectation(page, exp)
+            res.logs.append(f"expect {exp.kind}: {(time.perf_counter() - t0) * 1000:.0f} мс")
+        if snapshot:
+            snap = await driver.snapshot()
+            res.url, res.title, res.bodyRef = snap["url"], snap["title"], snap["bodyRef"]
+        else:
+            res.url, res.title = page.url, await page.title()
+    except ExpectationFailed as e:
+        res.ok = False
+        res.errors.append(ExecError(code="expectation", message=str(e), details={"stage": stage, "index": idx}))
     except Exception as e:
         res.ok = False
-        res.errors.append(ExecError(code="runtime", message=str(e), details={"trace": traceback.format_exc()}))
+        res.errors.append(ExecError(
+            code="runtime", message=str(e),
+            details={"stage": stage, "index": idx, "trace": traceback.format_exc()},
+        ))
+    if not res.ok:
+        res.url = page.url
+        # HTML страницы, на которой шаг упал, — для отладки и перепланирования
+        try:
+            res.bodyRef = driver.artifacts.put(await page.content())
+        except Exception:
+            pass
+    # Prefetch живёт в пределах шага: не взятую страницу следующий шаг не получит
+    await driver.drop_prefetch()
     return res
@@ -1,136 +1,331 @@
-import json
+import os
+import re
+from functools import partial
 from langgraph.graph import StateGraph, END
-from typing import TypedDict, List, Dict, Any, Optional
+from typing import Annotated, TypedDict, List, Dict, Any, Optional
+from langgraph.channels.untracked_value import UntrackedValue
 
 from context import PlaywrightDriver
-from dom_tools import build_dom_inventory
-from planner import plan_step_llm
-from executor import execute_step
-from models import StepPlan, ExecResult
+from planner import aplan_step_llm, aplan_steps_llm_batch
+from llm_scheduler import llm_background
+from plan_wire import PlanFormatError
+from executor import execute_step, resolve_locator
+from models import StepPlan, ExecResult, ExecError, Selector
+from plan_cache import PlanCache, plan_cache_key
+from policy import RunPolicy, enqueue_approval
+from cli import ask_approval
+from telemetry import span, annotate
+
+# Сколько шагов планировать одним запросом (1 — по шагу, как раньше)
+PLAN_LOOKAHEAD = int(os.getenv("PLAN_LOOKAHEAD", "1"))
+
+# Явный URL в тексте шага («Открыть https://…») — его можно грузить, пока LLM планирует
+_STEP_URL_RE = re.compile(r"https?://[^\s\"'«»<>()]+")
 
 class TestState(TypedDict, total=False):
     steps: List[Dict[str, Any]]
     current_idx: int
-    last_snapshot: Dict[str, Any]
-    inventory: List[Dict[str, Any]]
+    # Снимок и инвентарь (тысячи элементов, дифф) в чекпоинт не пишутся: node_context
+    # строит их заново в начале каждого шага, в том числе после --resume
+    last_snapshot: Annotated[Dict[str, Any], UntrackedValue(dict)]
+    inventory: Annotated[List[Dict[str, Any]], UntrackedValue(list)]
     plan: StepPlan
     exec_result: ExecResult
     user_hints: Optional[Dict[str, Any]]
     need_replan: bool
+    plan_cache_key: Optional[str]
+    plan_from_cache: bool
+    plan_error: Optional[str]
+    plan_queue: List[StepPlan]
+    pending_approval: bool
+    case_name: str
+    # Для чекпоинтов: исполненные шаги ({idx, ok, url, bodyRef, plan}) и состояние браузера ({url, storage})
+    history: List[Dict[str, Any]]
+    browser: Dict[str, Any]
 
 async def node_context(state: TestState, driver: PlaywrightDriver) -> TestState:
-    # Снимаем снапшот текущей страницы и строим инвентарь DOM
-    snap = await driver.snapshot()
-    inv = build_dom_inventory(snap["bodyHtml"] or "")
+    # Снимаем снапшот текущей страницы; если DOM не менялся с шага execute —
+    # драйвер вернёт уже разобранный снимок вместе с инвентарём.
+    # Дифф — относительно снимка, по которому планировался прошлый шаг
+    snap = await driver.snapshot(since=state.get("last_snapshot"))
     state["last_snapshot"] = snap
-    state["inventory"] = inv
+    state["inventory"] = snap["inventory"]
     return state
 
-async def node_plan(state: TestState, driver: PlaywrightDriver) -> TestState:
-    step = state["steps"][state["current_idx"]]
+def _selector_in_inventory(sel: Selector, inventory: List[Dict[str, Any]]) -> Optional[bool]:
+    # None — по инвентарю не проверить, нужен запрос к странице
+    v = sel.value
+    if sel.type == "testid":
+        return any(e.get("testid") == v for e in inventory)
+    if sel.type == "id":
+        return any(e.get("id") == v.lstrip("#") for e in inventory)
+    if sel.type == "placeholder":
+        return any(e.get("placeholder") == v for e in inventory)
+    if sel.type == "label":
+        return any(v in (e.get("label") or "") or v == e.get("name") for e in inventory)
+    if sel.type == "text":
+        return any(v in (e.get("text") or "") for e in inventory)
+    return None
+
+
+async def _selector_present(driver: PlaywrightDriver, sel: Selector, inventory: List[Dict[str, Any]]) -> bool:
+    found = _selector_in_inventory(sel, inventory)
+    if found is not None:
+        return found
+    try:
+        return await resolve_locator(driver.page, sel).count() > 0
+    except Exception:
+        return False
+
+
+async def _preconditions_hold(
+    driver: PlaywrightDriver, snap: Dict[str, Any], inventory: List[Dict[str, Any]],
+    prev_plan: Optional[StepPlan], plan: StepPlan,
+) -> bool:
+    """Применим ли заранее спланированный шаг к текущей странице: URL и наличие первой цели."""
+    if prev_plan:
+        for e in prev_plan.expects:
+            if e.kind == "urlIncludes" and e.value and e.value not in (snap.get("url") or ""):
+                return False
+    for ins in plan.instructions:
+        if ins.action == "navigate":
+            return True
+        if ins.target:
+            for sel in [ins.target.selector, *ins.target.alternatives]:
+                if await _selector_present(driver, sel, inventory):
+                    return True
+            return False
+    return True
+
+
+async def _prefetch_step_url(driver: PlaywrightDriver, step: Dict[str, Any], current_url: str) -> None:
+    # Только URL самого шага: до его исполнения в сессии ничего не происходит, кроме планирования.
+    # Страницу следующего шага заранее не грузим — текущий шаг может изменить данные или
+    # localStorage, а GET с побочным эффектом (logout, confirm) сработал бы на шаг раньше
+    m = _STEP_URL_RE.search(step.get("do") or "")
+    url = m.group(0).rstrip(".,;:!?") if m else None
+    if url and url.rstrip("/") != (current_url or "").rstrip("/"):
+        await driver.prefetch(url)
+
+
+async def node_plan(
+    state: TestState, driver: PlaywrightDriver, cache: Optional[PlanCache] = None,
+    lookahead: int = PLAN_LOOKAHEAD,
+) -> TestState:
+    steps = state["steps"]
+    idx = state["current_idx"]
+    step = steps[idx]
     snap = state["last_snapshot"]
-    plan = plan_step_llm(
+    hints = state.get("user_hints")
+    queue = list(state.get("plan_queue") or [])
+    queued = queue.pop(0) if queue and queue[0].stepId == step["id"] else None
+    if queued is None or hints:
+        queue = []
+    state["plan_queue"] = queue
+    state["plan_from_cache"] = False
+    state["need_replan"] = False
+    state["plan_error"] = None
+
+    key = plan_cache_key(step, snap["url"], state["inventory"]) if cache is not None else None
+    state["plan_cache_key"] = key
+    # С подсказками пользователя кэш не используем: нужен именно новый план
+    if cache is not None and not hints:
+        cached = cache.get(key)
+        if cached is not None:
+            cached.stepId = step["id"]
+            state["plan"] = cached
+            state["plan_from_cache"] = True
+            annotate(source="cache")
+            return state
+
+    # План из пакета lookahead: берём, если страница в ожидаемом состоянии,
+    # иначе выбрасываем очередь и перепланируем с этого шага
+    if queued is not None and not hints:
+        if await _preconditions_hold(driver, snap, state["inventory"], state.get("plan"), queued):
+            print(f"[lookahead] шаг {step['id']}: план из пакета, пред-условия выполнены")
+            state["plan"] = queued
+            annotate(source="lookahead")
+            return state
+        print(f"[lookahead] шаг {step['id']}: пред-условия не выполнены, перепланирование")
+        state["plan_queue"] = []
+
+    # Пока модель думает, браузер грузит страницу, названную в шаге
+    await _prefetch_step_url(driver, step, snap["url"])
+
+    try:
+        return await _plan_llm(state, driver, step, snap, hints, lookahead)
+    except PlanFormatError as e:
+        # Модель так и не вернула валидный план: шаг падает с этой ошибкой, а не «проходит» пустым
+        print(f"[planner] шаг {step['id']}: невалидный план: {e}")
+        state["plan"] = StepPlan(stepId=step["id"], title=step["raw"][:80], instructions=[])
+        state["plan_error"] = str(e)
+        annotate(source="llm", plan_error=True)
+        return state
+
+async def _plan_llm(
+    state: TestState, driver: PlaywrightDriver, step: Dict[str, Any], snap: Dict[str, Any],
+    hints: Optional[Dict[str, Any]], lookahead: int,
+) -> TestState:
+    idx = state["current_idx"]
+    steps = state["steps"]
+    if lookahead > 1 and not hints:
+        # Пакет длиннее и большей частью спекулятивный: уступает одиночным шагам других кейсов
+        with llm_background():
+            plans = await aplan_steps_llm_batch(
+                steps=steps[idx: idx + lookahead],
+                url=snap["url"],
+                title=snap["title"],
+                body_html=driver.artifacts.text(snap.get("bodyRef")),
+                dom_inventory=state["inventory"],
+                dom_diff=snap.get("diff"),
+            )
+        state["plan"] = plans[0]
+        state["plan_queue"] = plans[1:]
+        annotate(source="llm-batch", batch=len(plans))
+        return state
+
+    plan = await aplan_step_llm(
         step_id=step["id"],
         step_title=step["raw"][:80],
-        dane=step["dano"],
+        dano=step.get("dano", ""),
         action=step["do"],
         result=step["result"],
         url=snap["url"],
         title=snap["title"],
-        body_html=snap["bodyHtml"],
+        body_html=driver.artifacts.text(snap.get("bodyRef")),
         dom_inventory=state["inventory"],
-        hints=state.get("user_hints"),
+        hints=hints,
+        dom_diff=snap.get("diff"),
     )
     state["plan"] = plan
-    state["need_replan"] = False
+    annotate(source="llm")
     return state
 
-def _print_plan_for_cli(plan: StepPlan):
-    print("\n--- Предпросмотр шага ---")
-    print(f"Шаг {plan.stepId}: {plan.title}")
-    print("Инструкции:")
-    for i, ins in enumerate(plan.instructions):
-        line = f"  {i}. action={ins.action}"
-        if ins.url:
-            line += f" url={ins.url}"
-        if ins.target:
-            t = ins.target.selector
-            line += f" target=({t.type}='{t.value}')"
-            if ins.target.alternatives:
-                line += f" alts=[{', '.join(f'{a.type}:{a.value}' for a in ins.target.alternatives[:2])}...]"
-        if ins.value is not None:
-            line += f" value={ins.value!r}"
-        print(line)
-    if plan.expects:
-        print("Ожидания:")
-        for e in plan.expects:
-            if e.selector:
-                print(f"  - {e.kind} selector({e.selector.type}='{e.selector.value}') value={e.value}")
-            else:
-                print(f"  - {e.kind} value={e.value}")
-    print("-------------------------")
-
-def _collect_hints_from_cli() -> Optional[Dict[str, Any]]:
-    print("\nХотите указать верный селектор или поправить последовательность?")
-    print("Введите подсказки в JSON или нажмите Enter, чтобы пропустить.")
-    print("Примеры:")
-    print('  {"selector_override": {"instructionIndex": 1, "selector": {"type":"css","value":"[class^=\\"btn_primary\\"]"}}}')
-    print('  {"prepend_instructions": [{"action":"click","target":{"selector":{"type":"text","value":"Меню"}}}]}')
-    raw = input("> ").strip()
-    if not raw:
-        return None
-    try:
-        return json.loads(raw)
-    except Exception as e:
-        print(f"Не получилось разобрать JSON: {e}")
-        return None
-
-async def node_validate(state: TestState) -> TestState:
+async def node_validate(state: TestState, policy: Optional[RunPolicy] = None) -> TestState:
+    policy = policy or RunPolicy()
     plan = state["plan"]
-    _print_plan_for_cli(plan)
-    ans = input("Одобрить этот шаг? [y/n]: ").strip().lower()
-    if ans in ("y", "yes", ""):
-        state["need_replan"] = False
+    state["need_replan"] = False
+    state["pending_approval"] = False
+    if policy.approval == "auto":
         return state
-    # Отклонён → соберём hints и вернёмся на планирование
-    hints = _collect_hints_from_cli()
-    if hints:
-        state["user_hints"] = hints
-    else:
-        state["user_hints"] = {"note": "user_rejected_without_hints"}
+    if policy.approval == "cached-only":
+        # Новый план без человека не исполняем: кладём в очередь на офлайн-ревью
+        step = state["steps"][state["current_idx"]]
+        snap = state.get("last_snapshot") or {}
+        enqueue_approval(
+            policy.approval_queue, plan, step, snap.get("url"),
+            state.get("plan_cache_key"), state.get("case_name", ""),
+        )
+        state["pending_approval"] = True
+        state["exec_result"] = ExecResult(
+            ok=False,
+            url=snap.get("url"),
+            title=snap.get("title"),
+            errors=[ExecError(
+                code="pending_approval",
+                message=f"План шага {plan.stepId} отправлен на одобрение в {policy.approval_queue}",
+            )],
+        )
+        return state
+    approved, hints = ask_approval(plan)
+    if approved:
+        return state
+    # Отклонён → вернёмся на планирование с подсказками
+    state["user_hints"] = hints
     state["need_replan"] = True
     return state
 
-async def node_execute(state: TestState, driver: PlaywrightDriver) -> TestState:
-    result = await execute_step(driver, state["plan"])
+async def node_execute(
+    state: TestState, driver: PlaywrightDriver, cache: Optional[PlanCache] = None,
+    persist_browser: bool = False,
+) -> TestState:
+    # План из кэша перезаписываем, только если исполнение его изменило (вылеченный селектор)
+    cached_json = state["plan"].model_dump_json(by_alias=True) if state.get("plan_from_cache") else None
+    if state.get("plan_error"):
+        snap = state.get("last_snapshot") or {}
+        result = ExecResult(
+            ok=False, url=snap.get("url"), title=snap.get("title"), bodyRef=snap.get("bodyRef"),
+            errors=[ExecError(code="plan_invalid", message=state["plan_error"])],
+        )
+    else:
+        # Инвентарь, по которому строился план, нужен для локального лечения селекторов
+        result = await execute_step(driver, state["plan"], heal_inventory=state.get("inventory"))
     state["exec_result"] = result
-    # Обновим контекст после исполнения (для следующего шага)
-    new_snap = {"url": result.url, "title": result.title, "bodyHtml": result.bodyHtml or ""}
-    state["last_snapshot"] = new_snap
-    state["inventory"] = build_dom_inventory(new_snap["bodyHtml"])
+    state["history"] = [
+        *(state.get("history") or []),
+        {
+            "idx": state["current_idx"], "ok": result.ok, "url": result.url, "bodyRef": result.bodyRef,
+            "plan": state["plan"] if result.ok else None,
+        },
+    ]
+    if persist_browser and result.ok:
+        # Страница после последнего удачного шага: с неё продолжится --resume
+        state["browser"] = {"url": driver.page.url, "storage": await driver.context.storage_state()}
+    key = state.get("plan_cache_key")
+    if cache is not None and key:
+        if result.ok and state["plan"].instructions:
+            # До execute доходят только одобренные планы — их и запоминаем; попадание в кэш
+            # уже отмечено в cache.get, повторная запись того же плана не нужна
+            if state["plan"].model_dump_json(by_alias=True) != cached_json:
+                cache.put(key, state["plan"])
+        elif state.get("plan_from_cache"):
+            cache.invalidate(key)
+    if not result.ok:
+        # Страница ушла не туда — заранее спланированные шаги больше не актуальны
+        state["plan_queue"] = []
+    # last_snapshot остаётся снимком, по которому планировался шаг: node_context следующего
+    # шага снимет новый (execute_step уже разобрал HTML) и дифф относительно этого
     return state
 
 async def node_next(state: TestState) -> TestState:
     state["current_idx"] += 1
     return state
 
-def build_graph(driver: PlaywrightDriver):
+def _traced(name: str, node):
+    # Спан на каждый вызов узла; номер шага — чтобы в трейсе было видно, к чему он относится
+    async def _run(state: TestState) -> TestState:
+        steps = state.get("steps") or []
+        idx = state.get("current_idx", 0)
+        step_id = steps[idx]["id"] if idx < len(steps) else None
+        with span(f"node.{name}", step=step_id):
+            return await node(state)
+    return _run
+
+def build_graph(
+    driver: PlaywrightDriver,
+    cache: Optional[PlanCache] = None,
+    lookahead: int = PLAN_LOOKAHEAD,
+    policy: Optional[RunPolicy] = None,
+    persist_browser: bool = False,
+):
+    """persist_browser — сохранять в состоянии URL и storage state после каждого удачного шага
+    (нужно для продолжения прогона из чекпоинта)."""
     g = StateGraph(TestState)
 
-    g.add_node("context", lambda s: node_context(s, driver))
-    g.add_node("plan",     lambda s: node_plan(s, driver))
-    g.add_node("validate", node_validate)
-    g.add_node("execute",  lambda s: node_execute(s, driver))
+    g.add_node("context",  _traced("context", partial(node_context, driver=driver)))
+    g.add_node("plan",     _traced("plan", partial(node_plan, driver=driver, cache=cache, lookahead=lookahead)))
+    g.add_node("validate", _traced("validate", partial(node_validate, policy=policy)))
+    g.add_node("execute",  _traced("execute", partial(node_execute, driver=driver, cache=cache, persist_browser=persist_browser)))
     g.add_node("next",     node_next)
 
     g.set_entry_point("context")
     g.add_edge("context", "plan")
 
-    # Условная развилка из validate: либо повторное планирование, либо исполнение
+    # План из кэша уже был одобрен ранее — сразу исполняем; невалидный план одобрять нечего —
+    # execute сразу запишет ошибку шага
+    def _after_plan(state: TestState) -> str:
+        return "execute" if state.get("plan_from_cache") or state.get("plan_error") else "validate"
+
+    g.add_conditional_edges("plan", _after_plan, {"validate": "validate", "execute": "execute"})
+
+    # Условная развилка из validate: повторное планирование, исполнение
+    # или пропуск исполнения, если план ждёт офлайн-одобрения
     def _should_replan(state: TestState) -> str:
+        if state.get("pending_approval"):
+            return "next"
         return "plan" if state.get("need_replan") else "execute"
 
-    g.add_conditional_edges("validate", _should_replan, {"plan": "plan", "execute": "execute"})
+    g.add_conditional_edges("validate", _should_replan, {"plan": "plan", "execute": "execute", "next": "next"})
     g.add_edge("execute", "next")
     g.add_edge("next", END)
     return g
@@ -0,0 +1,163 @@
+from __future__ import annotations
+import os
+import re
+from difflib import SequenceMatcher
+from typing import Dict, Any, List, Optional, Tuple
+
+from models import Selector
+
+# Минимальная похожесть кандидата на исходный элемент, чтобы подставить его без LLM
+HEAL_THRESHOLD = float(os.getenv("HEAL_THRESHOLD", "0.6"))
+
+# Имя в role-селекторе: button[name="Сохранить"] или button[name=Сохранить]
+_ROLE_NAME_RE = re.compile(r"""\[\s*name\s*=\s*(["']?)(.*?)\1\s*\]""")
+
+_WEIGHTS = {
+    "testid": 0.35,
+    "id": 0.2,
+    "text": 0.25,
+    "role": 0.1,
+    "tag": 0.1,
+    "placeholder": 0.1,
+    "label": 0.1,
+    "cssCandidates": 0.1,
+}
+
+# Элементы, по которым кликают и в которые вводят. Контейнер (div#app, form) с тем же
+# текстом, унаследованным от кнопки, не должен ни считаться исходным элементом, ни подменять её.
+_ACTIONABLE_TAGS = frozenset(("a", "button", "input", "select", "textarea", "option", "summary"))
+
+
+def _text_ratio(a: str, b: str) -> float:
+    if not a or not b:
+        return 0.0
+    if a == b:
+        return 1.0
+    return SequenceMatcher(None, a.lower(), b.lower()).ratio()
+
+
+def _actionable(e: Dict[str, Any]) -> bool:
+    return e.get("tag") in _ACTIONABLE_TAGS or bool(e.get("role"))
+
+
+def _matches_selector(e: Dict[str, Any], sel: Selector) -> bool:
+    v = sel.value
+    if sel.type == "testid":
+        return e.get("testid") == v
+    if sel.type == "id":
+        return e.get("id") == v.lstrip("#")
+    if sel.type == "placeholder":
+        return e.get("placeholder") == v
+    if sel.type == "label":
+        return e.get("label") == v or e.get("name") == v
+    if sel.type == "text":
+        return v in (e.get("text") or "")
+    if sel.type == "role":
+        role, _, rest = v.partition("[")
+        if e.get("role") != role.strip():
+            return False
+        if not rest:
+            return True
+        # Элемент без имени не совпадает с селектором, где имя задано
+        m = _ROLE_NAME_RE.search(v)
+        name = e.get("name") or e.get("text")
+        return bool(m and name) and name == m.group(2)
+    return v in (e.get("cssCandidates") or [])
+
+
+def find_origin(sel: Selector, inventory: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Атрибуты элемента, на который указывал селектор, по инвентарю на момент планирования.
+
+    Текст предков включает текст потомков, поэтому для text-селектора из совпавших берётся
+    самый точный: совпадение текста целиком, затем кнопки/ссылки/поля и элементы с role,
+    затем самый короткий текст и самый глубокий (последний в порядке документа).
+    Если элемент не найден, атрибуты восстанавливаются из самого селектора.
+    """
+    best, best_rank = None, None
+    for i, e in enumerate(inventory or []):
+        if not _matches_selector(e, sel):
+            continue
+        if sel.type != "text":
+            best = e
+            break
+        text = e.get("text") or ""
+        rank = (text == sel.value, _actionable(e), -len(text), i)
+        if best_rank is None or rank > best_rank:
+            best, best_rank = e, rank
+    if best is not None:
+        return {k: best.get(k) for k in _WEIGHTS}
+    origin: Dict[str, Any] = {}
+    if sel.type == "testid":
+        origin["testid"] = sel.value
+    elif sel.type == "id":
+        origin["id"] = sel.value.lstrip("#")
+    elif sel.type in ("placeholder", "label", "text"):
+        origin[sel.type] = sel.value
+    elif sel.type == "role":
+        origin["role"] = sel.value.partition("[")[0].strip()
+    else:
+        origin["cssCandidates"] = [sel.value]
+    return origin
+
+
+def similarity(origin: Dict[str, Any], e: Dict[str, Any]) -> float:
+    total = 0.0
+    score = 0.0
+    for key, w in _WEIGHTS.items():
+        a = origin.get(key)
+        if not a:
+            continue
+        total += w
+        b = e.get(key)
+        if key == "text":
+            score += w * _text_ratio(a, b or "")
+        elif key == "cssCandidates":
+            sa, sb = set(a), set(b or ())
+            if sa and sb:
+                score += w * len(sa & sb) / len(sa | sb)
+        elif a == b:
+            score += w
+    return score / total if total else 0.0
+
+
+def selector_for(e: Dict[str, Any]) -> Optional[Selector]:
+    if e.get("testid"):
+        return Selector(type="testid", value=e["testid"])
+    if e.get("id"):
+        return Selector(type="id", value=e["id"])
+    if e.get("placeholder"):
+        return Selector(type="placeholder", value=e["placeholder"])
+    if e.get("label"):
+        return Selector(type="label", value=e["label"])
+    name = e.get("name") or e.get("text")
+    if e.get("role") and name:
+        return Selector(type="role", value=f'{e["role"]}[name="{name}"]')
+    if e.get("text"):
+        return Selector(type="text", value=e["text"])
+    if e.get("cssCandidates"):
+        return Selector(type="css", value=e["cssCandidates"][0])
+    return None
+
+
+def heal_selector(
+    failed: Selector,
+    old_inventory: List[Dict[str, Any]],
+    new_inventory: List[Dict[str, Any]],
+    threshold: float = HEAL_THRESHOLD,
+) -> Optional[Tuple[Selector, float]]:
+    """Лучший кандидат текущей страницы на место упавшего селектора или None."""
+    origin = find_origin(failed, old_inventory)
+    # Кнопку заменяет только кнопка/ссылка/поле, а не обёртка с её текстом
+    actionable = _actionable(origin)
+    best: Optional[Tuple[Selector, float]] = None
+    for e in new_inventory or []:
+        if actionable and not _actionable(e):
+            continue
+        score = similarity(origin, e)
+        if score < threshold or (best and score <= best[1]):
+            continue
+        sel = selector_for(e)
+        if sel is None or (sel.type == failed.type and sel.value == failed.value):
+            continue
+        best = (sel, score)
+    return best
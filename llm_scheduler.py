@@ -0,0 +1,286 @@
+from __future__ import annotations
+import os, json, time, heapq, random, asyncio, hashlib, itertools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional
+
+import openai
+
+from prompt_budget import estimate_tokens
+from telemetry import annotate, add
+
+# === Конфиг планировщика запросов к LLM ===
+LLM_RPM = int(os.getenv("LLM_RPM", "0"))  # запросов в минуту, 0 — без ограничения
+LLM_TPM = int(os.getenv("LLM_TPM", "0"))  # токенов в минуту, 0 — без ограничения
+LLM_COMPLETION_RESERVE = int(os.getenv("LLM_COMPLETION_RESERVE", "800"))  # токенов на ответ при оценке
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))  # сетевые ошибки и 5xx
+LLM_RATE_LIMIT_ATTEMPTS = int(os.getenv("LLM_RATE_LIMIT_ATTEMPTS", "8"))  # ответы 429
+
+# Приоритеты: меньше — раньше. Setup-кейс сессии держит весь набор, шаг — свой тест-кейс
+PRIORITY_CRITICAL = 0
+PRIORITY_BLOCKED = 1
+PRIORITY_BACKGROUND = 2
+
+_priority: ContextVar[int] = ContextVar("qa_llm_priority", default=PRIORITY_BLOCKED)
+_usage: ContextVar[Optional[Dict[str, int]]] = ContextVar("qa_llm_usage", default=None)
+
+
+@contextmanager
+def llm_priority(priority: int) -> Iterator[None]:
+    """Приоритет запросов к LLM из этого блока (и порождённых им задач)."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def llm_background():
+    """Фоновые запросы блока (напр. пакет lookahead) уступают обычным шагам тест-кейсов;
+    запросы с повышенным приоритетом (setup-кейс сессии) при этом не понижаются."""
+    current = _priority.get()
+    return llm_priority(current if current < PRIORITY_BLOCKED else PRIORITY_BACKGROUND)
+
+
+def record_usage(total_tokens: int) -> None:
+    """Фактический расход токенов текущего запроса — для поправки бюджета TPM."""
+    slot = _usage.get()
+    if slot is not None:
+        slot["tokens"] = total_tokens
+
+
+class TokenBucket:
+    """Бюджет на минуту, пополняется равномерно. per_minute=0 — без ограничения."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self._rate = per_minute / 60.0
+        self._level = float(per_minute)
+        self._at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._level = min(self.capacity, self._level + (now - self._at) * self._rate)
+        self._at = now
+
+    def delay(self, amount: float) -> float:
+        """Через сколько секунд в ведре наберётся amount."""
+        if not self.capacity:
+            return 0.0
+        self._refill()
+        need = min(amount, self.capacity) - self._level
+        return max(0.0, need / self._rate)
+
+    def take(self, amount: float) -> None:
+        if self.capacity:
+            self._refill()
+            self._level -= amount
+
+    def adjust(self, amount: float) -> None:
+        # Поправка оценки по факту; уровень может уйти в минус — следующие запросы подождут
+        if self.capacity:
+            self._level = min(self.capacity, self._level - amount)
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return float(ms) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def _retryable(e: Exception) -> bool:
+    if isinstance(e, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code >= 500 or e.status_code in (408, 409)
+    return False
+
+
+def _backoff(attempt: int) -> float:
+    return min(30.0, 1.2 * 2 ** (attempt - 1)) * random.uniform(0.8, 1.2)
+
+
+def _retry_delay(e: Exception, attempts: Dict[str, int]) -> Optional[float]:
+    """Пауза перед следующей попыткой или None, если ошибка не повторяется или попытки кончились.
+
+    attempts — счётчики запроса {"errors": …, "rate_limited": …}: сетевые ошибки и 5xx —
+    до LLM_MAX_ATTEMPTS попыток, 429 — до LLM_RATE_LIMIT_ATTEMPTS, пауза — по Retry-After.
+    """
+    if isinstance(e, openai.RateLimitError):
+        attempts["rate_limited"] += 1
+        if attempts["rate_limited"] >= LLM_RATE_LIMIT_ATTEMPTS:
+            return None
+        return _retry_after(e) or _backoff(attempts["rate_limited"])
+    attempts["errors"] += 1
+    if not _retryable(e) or attempts["errors"] >= LLM_MAX_ATTEMPTS:
+        return None
+    return _retry_after(e) or _backoff(attempts["errors"])
+
+
+def call_sync(send: Callable[[], str]) -> str:
+    """Синхронный запрос (plan_step_llm) с той же политикой повторов, что и у планировщика.
+
+    Лимиты RPM/TPM, приоритеты и объединение одинаковых запросов есть только в асинхронном пути.
+    """
+    attempts = {"errors": 0, "rate_limited": 0}
+    while True:
+        try:
+            return send()
+        except Exception as e:
+            if isinstance(e, openai.RateLimitError):
+                add(rate_limited=1)
+            delay = _retry_delay(e, attempts)
+            if delay is None:
+                raise
+            time.sleep(delay)
+
+
+class LlmScheduler:
+    """Единая точка выхода запросов к LLM для всех тест-кейсов процесса.
+
+    - одинаковые запросы, уже ушедшие к модели, не дублируются (single-flight);
+    - запросы в минуту и токены в минуту ограничены token bucket'ами (LLM_RPM, LLM_TPM);
+    - очередь упорядочена по приоритету, внутри него — по времени первой попытки;
+    - 429 с Retry-After ставит на паузу весь поток запросов, а не только упавший.
+    """
+
+    def __init__(self, rpm: int = LLM_RPM, tpm: int = LLM_TPM):
+        self._requests = TokenBucket(rpm)
+        self._tokens = TokenBucket(tpm)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._waiting: List[tuple] = []
+        self._seq = itertools.count()
+        self._cond = asyncio.Condition()
+        self._pause_until = 0.0
+        self.stats = {"requests": 0, "coalesced": 0, "rate_limited": 0, "retries": 0}
+
+    async def call(self, messages: List[Dict[str, str]], send: Callable[[], Awaitable[str]], model: str = "") -> str:
+        """Ответ модели на messages; send — одна попытка запроса (без ретраев)."""
+        key = hashlib.sha256(json.dumps([model, messages], ensure_ascii=False).encode("utf-8")).hexdigest()
+        leader = self._inflight.get(key)
+        if leader is not None:
+            self.stats["coalesced"] += 1
+            annotate(coalesced=True)
+            try:
+                return await asyncio.shield(leader)
+            except asyncio.CancelledError:
+                # Отменили запрос-лидер, а не нас — спрашиваем модель сами
+                if not leader.cancelled():
+                    raise
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            result = await self._run(messages, send)
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()  # ведомых может не быть — без предупреждения «never retrieved»
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            if self._inflight.get(key) is fut:
+                del self._inflight[key]
+
+    async def _run(self, messages, send) -> str:
+        estimate = sum(estimate_tokens(m.get("content") or "") for m in messages) + LLM_COMPLETION_RESERVE
+        order = (_priority.get(), next(self._seq))
+        attempts = {"errors": 0, "rate_limited": 0}
+        while True:
+            await self._admit(order, estimate)
+            slot = {"tokens": estimate}
+            token = _usage.set(slot)
+            try:
+                self.stats["requests"] += 1
+                result = await send()
+            except Exception as e:
+                limited = isinstance(e, openai.RateLimitError)
+                if limited:
+                    self.stats["rate_limited"] += 1
+                    add(rate_limited=1)
+                delay = _retry_delay(e, attempts)
+                if delay is None:
+                    raise
+                if limited:
+                    # 429 — превышен лимит всего ключа: пауза для всех запросов
+                    self._pause_until = max(self._pause_until, time.monotonic() + delay)
+                    annotate(retry_after_s=round(delay, 2))
+                else:
+                    await asyncio.sleep(delay)
+            else:
+                self._tokens.adjust(slot["tokens"] - estimate)
+                return result
+            finally:
+                _usage.reset(token)
+            self.stats["retries"] += 1
+
+    async def _admit(self, order: tuple, tokens: int) -> None:
+        # Повторная попытка сохраняет своё место: кто дольше ждёт, тот и идёт первым
+        t0 = time.monotonic()
+        heapq.heappush(self._waiting, order)
+        try:
+            async with self._cond:
+                while True:
+                    wait = None
+                    if self._waiting[0] == order:
+                        wait = max(
+                            self._pause_until - time.monotonic(),
+                            self._requests.delay(1),
+                            self._tokens.delay(tokens),
+                        )
+                        if wait <= 0:
+                            heapq.heappop(self._waiting)
+                            self._requests.take(1)
+                            self._tokens.take(tokens)
+                            self._cond.notify_all()
+                            break
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+        except BaseException:
+            if order in self._waiting:
+                self._waiting.remove(order)
+                heapq.heapify(self._waiting)
+                async with self._cond:
+                    self._cond.notify_all()
+            raise
+        add(llm_queue_ms=round((time.monotonic() - t0) * 1000, 1))
+
+    def summary(self) -> str:
+        s = self.stats
+        return (
+            f"запросов {s['requests']}, объединено одинаковых {s['coalesced']}, "
+            f"429 {s['rate_limited']}, повторов {s['retries']}"
+        )
+
+
+_scheduler: Optional[LlmScheduler] = None
+_scheduler_loop = None
+
+
+def get_scheduler() -> LlmScheduler:
+    """Планировщик процесса (пересоздаётся, если сменился event loop)."""
+    global _scheduler, _scheduler_loop
+    loop = asyncio.get_running_loop()
+    if _scheduler is None or _scheduler_loop is not loop:
+        _scheduler, _scheduler_loop = LlmScheduler(), loop
+    return _scheduler
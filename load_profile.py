@@ -0,0 +1,296 @@
+from __future__ import annotations
+import os, json, time, sqlite3
+from email.utils import parsedate_to_datetime
+from fnmatch import fnmatchcase
+from typing import Dict, Any, List, Literal, Optional, Tuple
+from pydantic import BaseModel, ConfigDict
+
+# === Конфиг профиля загрузки ===
+LOAD_PROFILE = os.getenv("LOAD_PROFILE", "full")  # full | lean (opt-in)
+BLOCK_RESOURCE_TYPES = os.getenv("BLOCK_RESOURCE_TYPES", "image,media,font")
+BLOCK_URL_PATTERNS = os.getenv("BLOCK_URL_PATTERNS", "")  # дополнительно к трекерам по умолчанию
+ALLOW_URL_PATTERNS = os.getenv("ALLOW_URL_PATTERNS", "")
+VIEWPORT = os.getenv("VIEWPORT", "1280x720")
+HTTP_CACHE_DIR = os.getenv("HTTP_CACHE_DIR")  # напр. .qa_cache; пусто — без кэша ответов
+# Предел эвристической свежести для ответов без max-age/Expires (10% от возраста Last-Modified)
+HTTP_CACHE_TTL = int(os.getenv("HTTP_CACHE_TTL", str(24 * 3600)))
+
+# Аналитика, реклама и RUM-маяки: страницам для тестов не нужны, а networkidle на них висит
+DEFAULT_BLOCK_PATTERNS = (
+    "*google-analytics.com/*",
+    "*googletagmanager.com/*",
+    "*doubleclick.net/*",
+    "*mc.yandex.ru/*",
+    "*top-fwz1.mail.ru/*",
+    "*hotjar.com/*",
+    "*connect.facebook.net/*",
+    "*clarity.ms/*",
+    "*sentry.io/*",
+    "*/collect?*",
+    "*/beacon*",
+)
+
+# Ответы каких ресурсов можно отдавать из локального кэша: статика, не данные
+_CACHEABLE_TYPES = frozenset(("script", "stylesheet", "font", "image"))
+# Заголовки, которые нельзя отдавать с уже раскодированным телом
+_DROP_HEADERS = frozenset(("content-encoding", "content-length", "transfer-encoding", "set-cookie"))
+
+# Выключает CSS-анимации и переходы: элементы сразу в конечном состоянии, без ожидания стабильности
+NO_ANIMATIONS_JS = """
+(() => {
+  const css = '*,*::before,*::after{animation-duration:0s!important;animation-delay:0s!important;'
+    + 'transition-duration:0s!important;transition-delay:0s!important;scroll-behavior:auto!important}';
+  const add = () => {
+    const s = document.createElement('style');
+    s.textContent = css;
+    (document.head || document.documentElement).appendChild(s);
+  };
+  if (document.documentElement) add(); else document.addEventListener('DOMContentLoaded', add);
+})();
+"""
+
+
+def _split(value: str) -> List[str]:
+    return [p.strip() for p in (value or "").split(",") if p.strip()]
+
+
+def _viewport(value: str) -> Optional[Dict[str, int]]:
+    try:
+        w, h = value.lower().split("x")
+        return {"width": int(w), "height": int(h)}
+    except ValueError:
+        return None
+
+
+class LoadProfile(BaseModel):
+    """Как драйвер загружает страницы.
+
+    lean — блокирует ресурсы типов block_types и URL по block_patterns (кроме allow_patterns),
+    выключает анимации, уменьшает viewport; full — поведение браузера по умолчанию.
+    """
+
+    model_config = ConfigDict(validate_default=True)
+
+    name: Literal["lean", "full"] = LOAD_PROFILE
+    block_types: List[str] = _split(BLOCK_RESOURCE_TYPES)
+    block_patterns: List[str] = [*DEFAULT_BLOCK_PATTERNS, *_split(BLOCK_URL_PATTERNS)]
+    allow_patterns: List[str] = _split(ALLOW_URL_PATTERNS)
+    viewport: Optional[Dict[str, int]] = _viewport(VIEWPORT)
+
+    @property
+    def lean(self) -> bool:
+        return self.name == "lean"
+
+    def context_options(self) -> Dict[str, Any]:
+        if not self.lean:
+            return {}
+        opts: Dict[str, Any] = {"reduced_motion": "reduce", "service_workers": "block"}
+        if self.viewport:
+            opts["viewport"] = self.viewport
+        return opts
+
+    def blocks(self, url: str, resource_type: str) -> bool:
+        if not self.lean:
+            return False
+        if any(fnmatchcase(url, p) for p in self.allow_patterns):
+            return False
+        return resource_type in self.block_types or any(fnmatchcase(url, p) for p in self.block_patterns)
+
+
+# === Локальный кэш HTTP-ответов ===
+def _cache_control(headers: Dict[str, str]) -> Dict[str, Optional[str]]:
+    out: Dict[str, Optional[str]] = {}
+    for part in (headers.get("cache-control") or "").lower().split(","):
+        name, _, value = part.strip().partition("=")
+        if name:
+            out[name] = value.strip('"') or None
+    return out
+
+
+def _http_date(value: Optional[str]) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(value).timestamp() if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def storable(headers: Dict[str, str]) -> bool:
+    """Можно ли класть ответ в общий кэш: без no-store/private и без Vary по заголовкам запроса
+    (кэш ключуется только URL; Accept-Encoding не в счёт — тело хранится раскодированным)."""
+    cc = _cache_control(headers)
+    if "no-store" in cc or "private" in cc:
+        return False
+    vary = {v.strip().lower() for v in (headers.get("vary") or "").split(",") if v.strip()}
+    return vary <= {"accept-encoding"}
+
+
+def freshness(headers: Dict[str, str], heuristic_cap: float = HTTP_CACHE_TTL) -> float:
+    """Сколько секунд ответ свеж с момента получения (RFC 9111, 4.2): s-maxage/max-age,
+    затем Expires, затем эвристика по Last-Modified; no-cache — 0 (только с ревалидацией)."""
+    cc = _cache_control(headers)
+    if "no-cache" in cc:
+        return 0.0
+    try:
+        age = float(headers.get("age") or 0)
+    except ValueError:
+        age = 0.0
+    for name in ("s-maxage", "max-age"):
+        if name in cc:
+            try:
+                return max(0.0, int(cc[name] or "") - age)
+            except ValueError:
+                return 0.0
+    date = _http_date(headers.get("date")) or time.time()
+    if "expires" in headers:
+        # Невалидный Expires (напр. "0") означает «уже устарел»
+        expires = _http_date(headers["expires"])
+        return max(0.0, expires - date - age) if expires else 0.0
+    modified = _http_date(headers.get("last-modified"))
+    if modified:
+        return max(0.0, min(heuristic_cap, (date - modified) / 10) - age)
+    return 0.0
+
+
+class HttpCache:
+    """Кэш статических ответов (SQLite), общий для всех контекстов и прогонов.
+
+    Свежесть записи — по Cache-Control/Expires ответа; устаревшая запись с ETag или
+    Last-Modified ревалидируется условным запросом, без них — удаляется.
+    """
+
+    def __init__(self, path: str, ttl: int = HTTP_CACHE_TTL):
+        self._ttl = ttl
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                fresh_until REAL NOT NULL,
+                created_at REAL NOT NULL
+            )"""
+        )
+        self.stats = {"hits": 0, "misses": 0, "revalidated": 0, "stores": 0, "bytes_saved": 0}
+
+    def _row(self, url: str):
+        return self._db.execute(
+            "SELECT status, headers, body, fresh_until FROM responses WHERE url = ?", (url,)
+        ).fetchone()
+
+    def _hit(self, row) -> Tuple[int, Dict[str, str], bytes]:
+        self.stats["bytes_saved"] += len(row[2])
+        return row[0], json.loads(row[1]), row[2]
+
+    def get(self, url: str) -> Optional[Tuple[int, Dict[str, str], bytes]]:
+        """Свежий ответ из кэша или None (тогда — validators() и запрос к серверу)."""
+        row = self._row(url)
+        if row is None or row[3] <= time.time():
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return self._hit(row)
+
+    def validators(self, url: str) -> Dict[str, str]:
+        """Заголовки условного запроса для устаревшей записи; пусто — записи нет или проверять нечем."""
+        row = self._row(url)
+        if row is None:
+            return {}
+        headers = json.loads(row[1])
+        cond = {}
+        if headers.get("etag"):
+            cond["if-none-match"] = headers["etag"]
+        if headers.get("last-modified"):
+            cond["if-modified-since"] = headers["last-modified"]
+        if not cond:
+            self._db.execute("DELETE FROM responses WHERE url = ?", (url,))
+        return cond
+
+    def revalidate(self, url: str, headers: Dict[str, str]) -> Optional[Tuple[int, Dict[str, str], bytes]]:
+        """Ответ 304 на условный запрос: запись снова свежа, заголовки обновляются из 304."""
+        row = self._row(url)
+        if row is None:
+            return None
+        merged = {**json.loads(row[1]), **{k: v for k, v in headers.items() if k.lower() not in _DROP_HEADERS}}
+        now = time.time()
+        self._db.execute(
+            "UPDATE responses SET headers = ?, fresh_until = ? WHERE url = ?",
+            (json.dumps(merged), now + freshness(merged, self._ttl), url),
+        )
+        self.stats["revalidated"] += 1
+        return self._hit((row[0], json.dumps(merged), row[2]))
+
+    def put(self, url: str, status: int, headers: Dict[str, str], body: bytes) -> bool:
+        """Сохраняет ответ, если его можно хранить и его можно будет либо отдать свежим, либо проверить."""
+        if not storable(headers):
+            return False
+        headers = {k: v for k, v in headers.items() if k.lower() not in _DROP_HEADERS}
+        now = time.time()
+        lifetime = freshness(headers, self._ttl)
+        if lifetime <= 0 and not (headers.get("etag") or headers.get("last-modified")):
+            return False
+        self._db.execute(
+            "INSERT OR REPLACE INTO responses (url, status, headers, body, fresh_until, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (url, status, json.dumps(headers), body, now + lifetime, now),
+        )
+        self.stats["stores"] += 1
+        return True
+
+    def close(self) -> None:
+        self._db.close()
+
+    def summary(self) -> str:
+        s = self.stats
+        return (
+            f"hits={s['hits']} misses={s['misses']} revalidated={s['revalidated']} stores={s['stores']} "
+            f"сэкономлено {s['bytes_saved'] / 1024:.0f} КБ"
+        )
+
+
+def open_http_cache(cache_dir: Optional[str] = HTTP_CACHE_DIR) -> Optional[HttpCache]:
+    return HttpCache(os.path.join(cache_dir, "http.sqlite")) if cache_dir else None
+
+
+async def install(context, profile: LoadProfile, http_cache: Optional[HttpCache] = None) -> None:
+    """Вешает на BrowserContext блокировку ресурсов, отключение анимаций и кэш ответов."""
+    if profile.lean:
+        await context.add_init_script(NO_ANIMATIONS_JS)
+    if not profile.lean and http_cache is None:
+        return
+
+    async def _route(route):
+        req = route.request
+        if profile.blocks(req.url, req.resource_type):
+            await route.abort("blockedbyclient")
+            return
+        if http_cache is None or req.method != "GET" or req.resource_type not in _CACHEABLE_TYPES:
+            await route.continue_()
+            return
+        hit = http_cache.get(req.url)
+        if hit is None:
+            # Устаревшую запись проверяем условным запросом: 304 — тело берём из кэша
+            cond = http_cache.validators(req.url)
+            try:
+                resp = await route.fetch(headers={**req.headers, **cond}) if cond else await route.fetch()
+            except Exception:
+                await route.continue_()
+                return
+            if resp.status == 304 and cond:
+                hit = http_cache.revalidate(req.url, resp.headers)
+                if hit is None:
+                    await route.continue_()
+                    return
+        if hit is not None:
+            status, headers, body = hit
+            await route.fulfill(status=status, headers=headers, body=body)
+            return
+        body = await resp.body()
+        if resp.status == 200:
+            http_cache.put(req.url, resp.status, resp.headers, body)
+        await route.fulfill(response=resp, body=body)
+
+    await context.route("**/*", _route)
@@ -1,13 +1,38 @@
 import sys
+import json
+import time
+import asyncio
+import uuid
+import tempfile
+import argparse
 import anyio
+from contextlib import AsyncExitStack
+from functools import partial
+from itertools import islice
+from pathlib import Path
 
-from context import PlaywrightDriver
-from parser import parse_test_case
+from context import PlaywrightDriver, BrowserPool
+from parser import parse_test_case, iter_test_cases
 from graph import build_graph
 from models import ExecResult
+from plan_cache import PlanCache
+from planner import aclose_llm_client
+from llm_scheduler import PRIORITY_CRITICAL, get_scheduler, llm_priority
+from load_profile import open_http_cache
+from artifacts import default_store
+from sessions import Session, SETUP_CASE_STEM
+from policy import RunPolicy, review_approvals, import_approvals, append_approvals, load_approvals
+from cli import ask_continue_after_error
+from telemetry import Tracer, bind, span, TRACE_PATH, TRACE_CHROME_PATH
+from checkpoints import CHECKPOINTS_ENABLED, CHECKPOINT_PATH, open_checkpointer, run_thread_id, load_resume_state
+from work_queue import QUEUE_URL, QUEUE_POLL, open_queue, worker_id
+from replay import compile_bundle, save_bundle, load_bundle, generate_playwright_script, run_replay
 import os
 
 BASE_URL = os.getenv("BASE_URL")
+PLAN_CACHE_ENABLED = os.getenv("PLAN_CACHE", "1") not in ("0", "false", "no")
+SUITE_CONCURRENCY = int(os.getenv("SUITE_CONCURRENCY", "4"))
+SUITE_PATTERNS = ("*.txt", "*.md")
 
 DEFAULT_TEST = """
 1. Что сделать: Открыть главную страницу. Результат: Главная страница открыта.
@@ -15,10 +40,11 @@ DEFAULT_TEST = """
 """
 
 
-def _print_step_result(step_idx: int, res: ExecResult):
+def _print_step_result(step_idx: int, res: ExecResult, case_name: str = ""):
     border = "=" * 60
+    prefix = f"[{case_name}] " if case_name else ""
     print(f"\n{border}")
-    print(f"РЕЗУЛЬТАТ ШАГА #{step_idx}: {'OK' if res.ok else 'FAIL'}")
+    print(f"{prefix}РЕЗУЛЬТАТ ШАГА #{step_idx}: {'OK' if res.ok else 'FAIL'}")
     print(f"URL: {res.url}")
     print(f"TITLE: {res.title}")
     if res.ok:
@@ -41,62 +67,821 @@ def _print_step_result(step_idx: int, res: ExecResult):
     print(border)
 
 
-async def run_test(test_text: str):
-    steps = parse_test_case(test_text)
+async def run_test(
+    test_text: str | list,
+    driver: PlaywrightDriver | None = None,
+    cache: PlanCache | None = None,
+    case_name: str = "",
+    policy: RunPolicy | None = None,
+    export_bundle: str | None = None,
+    export_script: str | None = None,
+    tracer: Tracer | None = None,
+    session: Session | None = None,
+    checkpointer=None,
+    resume: bool = False,
+    checkpoints: bool = True,
+) -> dict:
+    """Прогоняет один тест-кейс (текст или уже разобранные шаги). Если driver не передан —
+    поднимает собственный браузер.
+
+    export_bundle/export_script — после успешного прогона сохранить исполненные планы
+    бандлом для replay и/или самостоятельным Playwright-скриптом.
+    tracer — общий трейсер набора; без него трейс кейса выгружается по TRACE_PATH/TRACE_CHROME_PATH.
+    session — начать кейс уже залогиненным; при разлогине сессия пересоздаётся и кейс повторяется.
+    checkpointer — чекпоинтер LangGraph (без него открывается свой по CHECKPOINT_PATH);
+    resume — продолжить кейс с последнего завершённого шага прошлого прогона;
+    checkpoints=False — без чекпоинтов и без своего соединения с их файлом (setup-кейс сессии)."""
+    policy = policy or RunPolicy()
+    own_tracer = tracer is None
+    tracer = tracer or Tracer()
+    async with AsyncExitStack() as stack:
+        if not checkpoints:
+            checkpointer = None
+        elif checkpointer is None and (CHECKPOINTS_ENABLED or resume):
+            checkpointer = await stack.enter_async_context(open_checkpointer(CHECKPOINT_PATH, required=resume))
+        with bind(tracer, case_name):
+            report = await _run_test(
+                test_text, driver, cache, case_name, policy, export_bundle, export_script, session,
+                checkpointer, resume,
+            )
+    print(f"\n{case_name + ': ' if case_name else ''}ВРЕМЯ ПО ЭТАПАМ\n{tracer.summary_table(case_name)}")
+    if own_tracer:
+        tracer.export()
+    return report
+
+
+async def _run_steps(
+    driver: PlaywrightDriver,
+    cache: PlanCache | None,
+    steps: list,
+    case_name: str,
+    policy: RunPolicy,
+    report: dict,
+    session: Session | None,
+    checkpointer=None,
+    resume: bool = False,
+) -> tuple[list, bool]:
+    """Цикл шагов тест-кейса. Возвращает (исполненные (шаг, план), разлогинена ли сессия).
+
+    С чекпоинтером состояние графа пишется в поток кейса один раз за шаг (durability="exit"):
+    весь шаг — один вызов графа;
+    resume продолжает поток с последнего завершённого шага, иначе поток начинается заново.
+    """
+    state = {
+        "steps": steps,
+        "current_idx": 0,
+        "user_hints": None,
+        "need_replan": False,
+        "case_name": case_name,
+    }
+
+    graph = build_graph(driver, cache, policy=policy, persist_browser=checkpointer is not None)
+    graph = graph.compile(checkpointer=checkpointer)
+    config = None
+    executed = []
+    if checkpointer is not None:
+        thread_id = run_thread_id(case_name, steps)
+        config = {"configurable": {"thread_id": thread_id}}
+        restored = await load_resume_state(graph, config) if resume else None
+        if restored is None:
+            await checkpointer.adelete_thread(thread_id)
+        else:
+            state = restored
+            executed = _restore_progress(state, steps, report)
+            await _restore_browser(driver, state.get("browser"))
+            print(
+                f"[resume] {case_name + ': ' if case_name else ''}пройдено {report['steps_passed']} из {len(steps)}, "
+                f"продолжаем с шага #{state['current_idx'] + 1}"
+            )
+
+    while state["current_idx"] < len(steps):
+        # Один полный прогон: context -> plan -> validate -> (plan?) -> execute -> next
+        with span("step", step=steps[state["current_idx"]]["id"]):
+            if config is not None:
+                state = await graph.ainvoke(state, config, durability="exit")
+            else:
+                state = await graph.ainvoke(state)
+        res: ExecResult = state["exec_result"]
+        current_step_number = int(steps[state["current_idx"] - 1]["id"])
+        _print_step_result(current_step_number, res, case_name)
+
+        if res.ok:
+            report["steps_passed"] += 1
+            executed.append((steps[state["current_idx"] - 1], state["plan"]))
+            continue
+        if session is not None and session.logged_out(res.url):
+            # Шаг упал на странице логина — виноват не тест, а протухшая сессия
+            return executed, True
+        if report["failed_step"] is None:
+            report["failed_step"] = current_step_number
+        report["errors"].extend(f"[{e.code}] {e.message}" for e in res.errors)
+        if state.get("pending_approval"):
+            # Дальше без одобренного плана идти нельзя: страница не в том состоянии
+            report["pending_approvals"] += 1
+            print("План ждёт одобрения, тест-кейс остановлен.")
+            break
+        if policy.on_error == "continue":
+            continue
+        if policy.on_error == "fail-fast":
+            break
+        if not ask_continue_after_error():
+            print("Остановлено по запросу пользователя.")
+            break
+    return executed, False
+
+
+def _restore_progress(state: dict, steps: list, report: dict) -> list:
+    """Счётчики отчёта и исполненные планы по истории шагов из чекпоинта."""
+    executed = []
+    for entry in state.get("history") or []:
+        step = steps[entry["idx"]]
+        if entry["ok"]:
+            report["steps_passed"] += 1
+            executed.append((step, entry["plan"]))
+            continue
+        if report["failed_step"] is None:
+            report["failed_step"] = int(step["id"])
+        report["errors"].append(f"[resumed] шаг #{step['id']} упал в прошлом прогоне")
+    return executed
+
+
+async def _restore_browser(driver: PlaywrightDriver, browser: dict | None):
+    # Cookies и localStorage после последнего удачного шага, затем та же страница
+    if not browser:
+        return
+    await driver.restart(browser.get("storage"))
+    if browser.get("url") and browser["url"] != "about:blank":
+        await driver.page.goto(browser["url"])
+
+
+async def _run_test(
+    test_text: str | list,
+    driver: PlaywrightDriver | None,
+    cache: PlanCache | None,
+    case_name: str,
+    policy: RunPolicy,
+    export_bundle: str | None,
+    export_script: str | None,
+    session: Session | None = None,
+    checkpointer=None,
+    resume: bool = False,
+) -> dict:
+    started = time.monotonic()
+    report = {
+        "name": case_name,
+        "ok": False,
+        "steps_total": 0,
+        "steps_passed": 0,
+        "failed_step": None,
+        "pending_approvals": 0,
+        "errors": [],
+        "duration_s": 0.0,
+    }
+    steps = test_text if isinstance(test_text, list) else parse_test_case(test_text)
+    report["steps_total"] = len(steps)
     if not steps:
         print("Не найдено ни одного шага. Проверь формат нумерованного списка.")
-        return
+        report["errors"].append("no_steps")
+        return report
 
-    driver = PlaywrightDriver(headless=True)
-    await driver.start()
+    storage_state = None
+    if session is not None:
+        storage_state = await session.state()
+        if storage_state is None:
+            report["errors"].append(f"[session] Сессия '{session.name}' не создана: нет сохранённой или setup-кейс не прошёл")
+            return report
 
-    if BASE_URL:
-        print(f"Открываем главную страницу: {BASE_URL}")
-        await driver.page.goto(BASE_URL)
+    own_driver = driver is None
+    own_cache = cache is None and PLAN_CACHE_ENABLED
+    http_cache = None
+    if own_driver:
+        http_cache = open_http_cache()
+        driver = PlaywrightDriver(headless=True, http_cache=http_cache, storage_state=storage_state)
+        await driver.start()
+    elif storage_state is not None:
+        await driver.restart(storage_state)
+    if own_cache:
+        cache = PlanCache()
 
+    executed = []
     try:
-        state = {
-            "steps": steps,
-            "current_idx": 0,
-            "user_hints": None,
-            "need_replan": False,
-        }
-
-        graph = build_graph(driver).compile()
-
-        while state["current_idx"] < len(steps):
-            # Один полный прогон: context -> plan -> validate -> (plan?) -> execute -> next
-            state = await graph.ainvoke(state)
-            res: ExecResult = state["exec_result"]
-            current_step_number = int(steps[state["current_idx"] - 1]["id"])
-            _print_step_result(current_step_number, res)
-
-            if not res.ok:
-                ans = (
-                    input(
-                        "Шаг завершился с ошибками. Продолжить к следующему шагу? [y/n]: "
-                    )
-                    .strip()
-                    .lower()
+        # Вторая попытка — только если сессия оказалась разлогиненной и её удалось пересоздать
+        for attempt in (1, 2):
+            if BASE_URL:
+                print(f"Открываем главную страницу: {BASE_URL}")
+                await driver.page.goto(BASE_URL)
+            if session is not None and session.logged_out(driver.page.url):
+                expired = True
+            else:
+                # Повтор с новой сессией начинает кейс заново, а не из чекпоинта
+                executed, expired = await _run_steps(
+                    driver, cache, steps, case_name, policy, report, session, checkpointer, resume and attempt == 1,
                 )
-                if ans not in ("y", "yes", ""):
-                    print("Остановлено по запросу пользователя.")
-                    break
+            if not expired:
+                break
+            report["errors"].append(f"[session_expired] Сессия '{session.name}' разлогинена: {driver.page.url}")
+            report["session_expired"] = True
+            if attempt == 2:
+                break
+            storage_state = await session.refresh(storage_state)
+            if storage_state is None:
+                break
+            print(f"{case_name + ': ' if case_name else ''}повторяем тест-кейс с новой сессией.")
+            report.update(steps_passed=0, failed_step=None, pending_approvals=0, errors=[], session_expired=False)
+            await driver.restart(storage_state)
+
+        print(f"\n{case_name + ': ' if case_name else ''}ТЕСТ ЗАВЕРШЁН.")
+        if own_cache and cache is not None:
+            print(f"Кэш планов: {cache.summary()}")
+        if own_driver:
+            print(f"Артефакты: {driver.artifacts.summary()}")
+    finally:
+        if own_cache and cache is not None:
+            cache.close()
+        if own_driver:
+            await aclose_llm_client()
+            await driver.stop()
+        if http_cache is not None:
+            print(f"Кэш HTTP: {http_cache.summary()}")
+            http_cache.close()
+
+    report["ok"] = report["failed_step"] is None and report["steps_passed"] == len(steps)
+    report["duration_s"] = round(time.monotonic() - started, 3)
+    if report["ok"] and (export_bundle or export_script):
+        _export(compile_bundle(executed, BASE_URL, case_name), export_bundle, export_script)
+    elif export_bundle or export_script:
+        print("Тест-кейс не прошёл целиком — бандл не сохранён.")
+    return report
+
+
+# === Record & replay ===
+def _export(bundle: dict, bundle_path: str | None, script_path: str | None):
+    if bundle_path:
+        save_bundle(bundle_path, bundle)
+        print(f"Бандл сохранён: {bundle_path} ({len(bundle['steps'])} шагов)")
+    if script_path:
+        with open(script_path, "w", encoding="utf-8") as f:
+            f.write(generate_playwright_script(bundle))
+        print(f"Playwright-скрипт сохранён: {script_path}")
+
 
-        print("\nТЕСТ ЗАВЕРШЁН.")
+async def replay_test(
+    bundle_path: str,
+    policy: RunPolicy | None = None,
+    export_script: str | None = None,
+    tracer: Tracer | None = None,
+    session: Session | None = None,
+) -> dict:
+    """Прогон бандла без LLM; упавшие шаги перепланирует агент, бандл обновляется."""
+    policy = policy or RunPolicy()
+    own_tracer = tracer is None
+    tracer = tracer or Tracer()
+    bundle = load_bundle(bundle_path)
+    storage_state = await session.state() if session is not None else None
+    http_cache = open_http_cache()
+    driver = PlaywrightDriver(headless=True, http_cache=http_cache, storage_state=storage_state)
+    await driver.start()
+    cache = PlanCache() if PLAN_CACHE_ENABLED else None
+    try:
+        with bind(tracer, bundle_path):
+            report, changed = await run_replay(bundle, driver, cache=cache, policy=policy, case_name=bundle_path)
     finally:
+        if cache is not None:
+            cache.close()
+        await aclose_llm_client()
         await driver.stop()
+        if http_cache is not None:
+            http_cache.close()
+    print(
+        f"\nREPLAY: {'OK' if report['ok'] else 'FAIL'} — {report['steps_passed']}/{report['steps_total']} шагов, "
+        f"без LLM: {report['replayed']}, через агента: {report['agent_fallbacks']}, {report['duration_s']:.1f} c"
+    )
+    for err in report["errors"]:
+        print(f"  {err}")
+    print(f"ВРЕМЯ ПО ЭТАПАМ\n{tracer.summary_table()}")
+    if own_tracer:
+        tracer.export()
+    if report["ok"] and changed:
+        _export(bundle, bundle_path, export_script)
+    elif export_script:
+        _export(bundle, None, export_script)
+    return report
+
+
+# === Режим набора тестов ===
+def _case_stub(name: str, code: str, message: str) -> dict:
+    return {
+        "name": name, "ok": False, "steps_total": 0, "steps_passed": 0,
+        "failed_step": None, "pending_approvals": 0, "errors": [f"[{code}] {message}"],
+        "duration_s": 0.0,
+    }
+
+
+def _unattended_policy(policy: RunPolicy | None) -> RunPolicy:
+    """Политика для набора: параллельные кейсы (и воркеры) не могут ждать input().
+
+    on_error=ask → fail-fast; approval=ask → cached-only: новые планы — в очередь одобрения.
+    """
+    policy = policy or RunPolicy(on_error="fail-fast")
+    if policy.on_error == "ask":
+        policy = policy.model_copy(update={"on_error": "fail-fast"})
+    if policy.approval == "ask":
+        print(
+            f"[policy] approval=ask недоступен для набора: новые планы уходят в {policy.approval_queue} "
+            "(--review-approvals / --import-approvals), для одобрения без вопросов — --approve auto"
+        )
+        policy = policy.model_copy(update={"approval": "cached-only"})
+    return policy
+
+
+def _collect_suite(suite_dir: str) -> list[Path]:
+    root = Path(suite_dir)
+    if root.is_file():
+        return [root]
+    files = {p for pattern in SUITE_PATTERNS for p in root.rglob(pattern) if p.is_file()}
+    return sorted(p for p in files if p.stem != SETUP_CASE_STEM)
+
+
+def _iter_suite_cases(suite_dir: str, files: list[Path]):
+    """Лениво отдаёт (имя, шаги, ошибка) по всем тест-кейсам файлов набора.
+
+    Файл читается построчно; файл с несколькими тест-кейсами даёт имена вида «файл::кейс».
+    """
+    base = Path(suite_dir) if Path(suite_dir).is_dir() else Path(suite_dir).parent
+    for path in files:
+        rel = str(path.relative_to(base))
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                cases = iter_test_cases(f)
+                first = next(cases, None)
+                if first is None:
+                    yield rel, [], None
+                    continue
+                second = next(cases, None)
+                if second is None:
+                    yield rel, first["steps"], None
+                    continue
+                for i, case in enumerate((first, second), 1):
+                    yield f"{rel}::{case['name'] or f'#{i}'}", case["steps"], None
+                for i, case in enumerate(cases, 3):
+                    yield f"{rel}::{case['name'] or f'#{i}'}", case["steps"], None
+        except Exception as e:
+            yield rel, None, e
+
+
+def _suite_setup_case(suite_dir: str) -> Path | None:
+    for pattern in SUITE_PATTERNS:
+        path = Path(suite_dir) / pattern.replace("*", SETUP_CASE_STEM)
+        if path.is_file():
+            return path
+    return None
+
+
+# === Сессии ===
+def make_session(
+    name: str,
+    setup_path: str | None,
+    cache: PlanCache | None = None,
+    policy: RunPolicy | None = None,
+    tracer: Tracer | None = None,
+    pool: BrowserPool | None = None,
+) -> Session:
+    """Сессия, которую при отсутствии сохранённой создаёт setup-кейс из setup_path."""
+    if not setup_path:
+        return Session(name)
+    text = Path(setup_path).read_text(encoding="utf-8")
+
+    async def _run(driver: PlaywrightDriver):
+        # Пока setup-кейс не прошёл, ждёт весь набор — его запросы к LLM идут первыми
+        with llm_priority(PRIORITY_CRITICAL):
+            # Логин всегда проходится заново: чекпоинты setup-кейсу не нужны
+            case = await run_test(
+                text, driver=driver, cache=cache, case_name=f"setup:{name}", policy=policy, tracer=tracer,
+                checkpoints=False,
+            )
+        return await driver.context.storage_state() if case["ok"] else None
+
+    async def _setup():
+        if pool is not None:
+            async with pool.driver(limit=False) as driver:
+                return await _run(driver)
+        driver = PlaywrightDriver(headless=True)
+        await driver.start()
+        try:
+            return await _run(driver)
+        finally:
+            await driver.stop()
+
+    return Session(name, _setup)
+
+
+def _is_multi_case(path: str) -> bool:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return len(list(islice(iter_test_cases(f), 2))) > 1
+    except OSError:
+        return False
+
+
+def _print_suite_summary(report: dict):
+    border = "=" * 60
+    print(f"\n{border}")
+    print(
+        f"НАБОР: {report['passed']}/{report['total']} OK, "
+        f"{report['failed']} FAIL за {report['duration_s']:.1f} c"
+    )
+    if report.get("pending_approvals"):
+        print(f"  Планов ждут одобрения: {report['pending_approvals']}")
+    for case in report["cases"]:
+        mark = "OK  " if case["ok"] else "FAIL"
+        line = f"  {mark} {case['name']} ({case['steps_passed']}/{case['steps_total']}, {case['duration_s']:.1f} c)"
+        if case["failed_step"] is not None:
+            line += f" — упал шаг #{case['failed_step']}"
+        print(line)
+    print(border)
+
+
+async def run_suite(
+    suite_dir: str,
+    concurrency: int = SUITE_CONCURRENCY,
+    report_path: str | None = None,
+    policy: RunPolicy | None = None,
+    tracer: Tracer | None = None,
+    session_name: str | None = None,
+    setup_path: str | None = None,
+    resume: bool = False,
+) -> dict:
+    """Прогоняет все тест-кейсы каталога параллельно.
+
+    Если задана сессия (или в каталоге есть _setup.txt/_setup.md), setup-кейс прогоняется
+    один раз, а тест-кейсы стартуют уже с его cookies и localStorage.
+    resume — каждый кейс продолжается с последнего завершённого шага прошлого прогона.
+    """
+    own_tracer = tracer is None
+    tracer = tracer or Tracer()
+    policy = _unattended_policy(policy)
+    files = _collect_suite(suite_dir)
+    if not files:
+        print(f"В '{suite_dir}' не найдено файлов тест-кейсов ({', '.join(SUITE_PATTERNS)}).")
+        return {"total": 0, "passed": 0, "failed": 0, "pending_approvals": 0, "duration_s": 0.0, "cases": []}
+
+    started = time.monotonic()
+    stack = AsyncExitStack()
+    checkpointer = None
+    if CHECKPOINTS_ENABLED or resume:
+        checkpointer = await stack.enter_async_context(open_checkpointer(CHECKPOINT_PATH, required=resume))
+    http_cache = open_http_cache()
+    pool = BrowserPool(headless=True, size=concurrency, http_cache=http_cache)
+    await pool.start()
+    cache = PlanCache() if PLAN_CACHE_ENABLED else None
+    stop = asyncio.Event()
+    setup = setup_path or _suite_setup_case(suite_dir)
+    session = None
+    if session_name or setup:
+        session = make_session(session_name or Path(suite_dir).resolve().name, setup, cache, policy, tracer, pool)
+
+    async def _run_one(name: str, steps: list | None, error: Exception | None) -> dict:
+        if error is not None:
+            return _case_stub(name, "runtime", str(error))
+        try:
+            async with pool.driver() as driver:
+                if stop.is_set():
+                    return _case_stub(name, "skipped", "набор остановлен (fail-fast)")
+                case = await run_test(
+                    steps, driver=driver, cache=cache, case_name=name, policy=policy, tracer=tracer, session=session,
+                    checkpointer=checkpointer, resume=resume,
+                )
+        except Exception as e:
+            case = _case_stub(name, "runtime", str(e))
+        # fail-fast останавливает набор на настоящей ошибке; ожидание одобрения — не ошибка
+        if not case["ok"] and not case.get("pending_approvals") and policy.on_error == "fail-fast":
+            stop.set()
+        return case
+
+    # Тест-кейсы читаются из файлов по мере того, как воркеры их разбирают:
+    # выгрузка на тысячи кейсов не разбирается в память целиком
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    results: dict[int, dict] = {}
+
+    async def _produce():
+        for i, item in enumerate(_iter_suite_cases(suite_dir, files)):
+            await queue.put((i, item))
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def _work():
+        while (job := await queue.get()) is not None:
+            i, item = job
+            results[i] = await _run_one(*item)
+
+    try:
+        # Сессию создаём до старта кейсов: иначе каждый из них ждал бы setup, держа слот пула
+        if session is not None and await session.state() is None:
+            msg = f"сессия '{session.name}' не создана: setup-кейс не прошёл"
+            cases = [_case_stub(name, "session", msg) for name, _, _ in _iter_suite_cases(suite_dir, files)]
+        else:
+            await asyncio.gather(_produce(), *(_work() for _ in range(concurrency)))
+            cases = [results[i] for i in sorted(results)]
+    finally:
+        if cache is not None:
+            print(f"Кэш планов: {cache.summary()}")
+            cache.close()
+        print(f"Артефакты: {default_store().summary()}")
+        print(f"Запросы к LLM: {get_scheduler().summary()}")
+        await aclose_llm_client()
+        await pool.stop()
+        if http_cache is not None:
+            print(f"Кэш HTTP: {http_cache.summary()}")
+            http_cache.close()
+        await stack.aclose()
+        if own_tracer:
+            tracer.export()
+
+    report = _suite_report(cases, started, report_path)
+    print(f"ВРЕМЯ ПО ЭТАПАМ (весь набор)\n{tracer.summary_table()}")
+    return report
+
+
+def _suite_report(cases: list, started: float, report_path: str | None) -> dict:
+    passed = sum(1 for c in cases if c["ok"])
+    report = {
+        "total": len(cases),
+        "passed": passed,
+        "failed": len(cases) - passed,
+        "pending_approvals": sum(c.get("pending_approvals", 0) for c in cases),
+        "duration_s": round(time.monotonic() - started, 3),
+        "cases": list(cases),
+    }
+    _print_suite_summary(report)
+    if report_path:
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Отчёт сохранён: {report_path}")
+    return report
+
+
+# === Распределённый режим: координатор и воркеры ===
+async def run_coordinator(
+    suite_dir: str,
+    queue_url: str = QUEUE_URL,
+    report_path: str | None = None,
+    policy: RunPolicy | None = None,
+) -> dict:
+    """Кладёт тест-кейсы набора в очередь и ждёт результатов от воркеров (python main.py --worker).
+
+    Сам браузер не поднимает; просроченные аренды пропавших воркеров возвращает в очередь.
+    """
+    policy = _unattended_policy(policy)
+    files = _collect_suite(suite_dir)
+    started = time.monotonic()
+    queue = open_queue(queue_url)
+    run_id = uuid.uuid4().hex[:12]
+    order: list = []  # (job_id | None, кейс-заглушка)
+
+    def _cases():
+        for name, steps, error in _iter_suite_cases(suite_dir, files):
+            if error is not None:
+                order.append((None, _case_stub(name, "runtime", str(error))))
+                continue
+            order.append((name, None))
+            yield name, steps
+
+    try:
+        # Вызовы очереди блокирующие (SQLite ждёт блокировку файла, Redis — сеть): вне event loop
+        ids = iter(await asyncio.to_thread(queue.enqueue_many, run_id, _cases(), policy.model_dump()))
+        order = [(next(ids), None) if stub is None else (None, stub) for _, stub in order]
+        total = sum(1 for job_id, _ in order if job_id)
+        print(f"[coordinator] ран {run_id}: в очереди {total} тест-кейсов ({queue_url})")
+        done = {}
+        while len(done) < total:
+            await asyncio.to_thread(queue.requeue_expired)
+            results = await asyncio.to_thread(queue.results, run_id)
+            if len(results) != len(done):
+                print(f"[coordinator] готово {len(results)}/{total}")
+                # Планы на одобрение воркеры присылают с результатом — в очередь этой машины
+                for job_id in results.keys() - done.keys():
+                    append_approvals(policy.approval_queue, results[job_id].get("approvals") or [])
+            done = results
+            if len(done) < total:
+                await asyncio.sleep(QUEUE_POLL)
+    finally:
+        queue.close()
+    cases = [done[job_id] if job_id else stub for job_id, stub in order]
+    for case in cases:
+        case.pop("approvals", None)
+    return _suite_report(cases, started, report_path)
+
+
+async def _heartbeat(queue, job, worker: str):
+    while True:
+        await asyncio.sleep(queue.lease_ttl / 3)
+        if not await asyncio.to_thread(queue.heartbeat, job.id, worker):
+            print(f"[worker] {job.name}: аренда потеряна, кейс может выполняться повторно")
+            return
+
+
+async def run_worker(
+    queue_url: str = QUEUE_URL,
+    concurrency: int = SUITE_CONCURRENCY,
+    policy: RunPolicy | None = None,
+    tracer: Tracer | None = None,
+    session_name: str | None = None,
+    setup_path: str | None = None,
+    exit_when_idle: bool = True,
+) -> int:
+    """Берёт тест-кейсы из очереди и прогоняет их на своём пуле браузерных контекстов.
+
+    exit_when_idle — завершиться, когда в очереди не осталось ни ожидающих, ни арендованных кейсов.
+    Возвращает число выполненных кейсов.
+    """
+    own_tracer = tracer is None
+    tracer = tracer or Tracer()
+    policy = policy or RunPolicy(on_error="fail-fast")
+    worker = worker_id()
+    queue = open_queue(queue_url)
+    stack = AsyncExitStack()
+    checkpointer = None
+    if CHECKPOINTS_ENABLED:
+        checkpointer = await stack.enter_async_context(open_checkpointer(CHECKPOINT_PATH))
+    http_cache = open_http_cache()
+    pool = BrowserPool(headless=True, size=concurrency, http_cache=http_cache)
+    await pool.start()
+    cache = PlanCache() if PLAN_CACHE_ENABLED else None
+    # Очередь одобрения — файл координатора: воркер пишет её во временный файл кейса
+    # и отправляет записи вместе с результатом
+    approvals_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix="qa-approvals-"))
+    session = None
+    if session_name or setup_path:
+        session = make_session(session_name or Path(setup_path).stem, setup_path, cache, policy, tracer, pool)
+    slots = asyncio.Semaphore(concurrency)
+    running: set = set()
+    completed = 0
+
+    async def _run_job(job):
+        nonlocal completed
+        beat = asyncio.create_task(_heartbeat(queue, job, worker))
+        job_policy = RunPolicy(**job.policy) if job.policy else policy
+        approvals = os.path.join(approvals_dir, f"{job.id}.jsonl")
+        job_policy = job_policy.model_copy(update={"approval_queue": approvals})
+        try:
+            async with pool.driver() as driver:
+                case = await run_test(
+                    job.steps, driver=driver, cache=cache, case_name=job.name, policy=job_policy,
+                    tracer=tracer, session=session, checkpointer=checkpointer,
+                    # Повторная аренда на том же хосте продолжает кейс из чекпоинта
+                    resume=job.attempts > 1 and checkpointer is not None,
+                )
+        except Exception as e:
+            case = _case_stub(job.name, "runtime", str(e))
+        finally:
+            beat.cancel()
+            slots.release()
+        case["approvals"] = load_approvals(approvals)
+        if os.path.exists(approvals):
+            os.remove(approvals)
+        await asyncio.to_thread(queue.complete, job.id, worker, case)
+        completed += 1
+
+    print(f"[worker] {worker}: очередь {queue_url}, параллельно {concurrency}")
+    try:
+        if session is not None and await session.state() is None:
+            print(f"[worker] сессия '{session.name}' не создана: setup-кейс не прошёл")
+            return 0
+        while True:
+            await slots.acquire()
+            await asyncio.to_thread(queue.requeue_expired)
+            job = await asyncio.to_thread(queue.lease, worker)
+            if job is None:
+                slots.release()
+                if exit_when_idle and not running and await asyncio.to_thread(queue.idle):
+                    break
+                await asyncio.sleep(QUEUE_POLL)
+                continue
+            print(f"[worker] {job.name} (попытка {job.attempts})")
+            task = asyncio.create_task(_run_job(job))
+            running.add(task)
+            task.add_done_callback(running.discard)
+    finally:
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+        if cache is not None:
+            print(f"Кэш планов: {cache.summary()}")
+            cache.close()
+        print(f"Артефакты: {default_store().summary()}")
+        print(f"Запросы к LLM: {get_scheduler().summary()}")
+        await aclose_llm_client()
+        await pool.stop()
+        if http_cache is not None:
+            http_cache.close()
+        await stack.aclose()
+        queue.close()
+        if own_tracer:
+            tracer.export()
+    print(f"[worker] {worker}: выполнено тест-кейсов: {completed}")
+    print(f"ВРЕМЯ ПО ЭТАПАМ (воркер)\n{tracer.summary_table()}")
+    return completed
+
+
+def _parse_args(argv):
+    ap = argparse.ArgumentParser(description="Автоагент Playwright + LLM")
+    ap.add_argument("path", nargs="?", help="файл тест-кейса")
+    ap.add_argument("--suite", metavar="DIR", help="каталог с файлами тест-кейсов")
+    ap.add_argument("--concurrency", type=int, default=SUITE_CONCURRENCY, help="сколько тест-кейсов гонять параллельно")
+    ap.add_argument("--report", default="suite_report.json", help="куда сохранить сводный отчёт набора")
+    ap.add_argument("--approve", choices=["ask", "auto", "cached-only"], help="политика одобрения планов")
+    ap.add_argument("--on-error", choices=["ask", "fail-fast", "continue"], help="политика при упавшем шаге")
+    ap.add_argument("--ci", action="store_true", help="без вопросов человеку: --approve cached-only --on-error fail-fast")
+    ap.add_argument("--approval-queue", help="файл очереди планов на одобрение (JSONL)")
+    ap.add_argument("--review-approvals", action="store_true", help="офлайн-ревью очереди одобрения")
+    ap.add_argument("--import-approvals", action="store_true", help="загрузить одобренные планы из очереди в кэш")
+    ap.add_argument("--export-bundle", metavar="PATH", help="сохранить исполненные планы бандлом для replay")
+    ap.add_argument("--export-script", metavar="PATH", help="сгенерировать самостоятельный Playwright-скрипт")
+    ap.add_argument("--replay", metavar="BUNDLE", help="прогнать бандл без LLM (агент — только для упавших шагов)")
+    ap.add_argument("--session", metavar="NAME", help="начинать тест-кейсы с сохранённой сессией (cookies + localStorage)")
+    ap.add_argument("--setup", metavar="FILE", help="setup-кейс, создающий сессию (напр. логин)")
+    ap.add_argument("--resume", action="store_true", help="продолжить прерванный прогон с последнего завершённого шага")
+    ap.add_argument("--coordinator", action="store_true", help="положить кейсы набора в очередь и ждать результатов воркеров")
+    ap.add_argument("--worker", action="store_true", help="брать тест-кейсы из очереди и прогонять их")
+    ap.add_argument("--queue", default=QUEUE_URL, help="очередь: sqlite:///path или redis://host:port/db")
+    ap.add_argument("--keep-alive", action="store_true", help="воркер не завершается, когда очередь пуста")
+    ap.add_argument("--trace", metavar="PATH", default=TRACE_PATH, help="сохранить спаны прогона в JSONL")
+    ap.add_argument("--chrome-trace", metavar="PATH", default=TRACE_CHROME_PATH, help="сохранить трейс для chrome://tracing")
+    return ap.parse_args(argv)
+
+
+def _policy_from_args(args) -> RunPolicy:
+    data = {}
+    if args.ci:
+        data.update(approval="cached-only", on_error="fail-fast")
+    if args.approve:
+        data["approval"] = args.approve
+    if args.on_error:
+        data["on_error"] = args.on_error
+    if args.approval_queue:
+        data["approval_queue"] = args.approval_queue
+    return RunPolicy(**data)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        path = sys.argv[1]
+    args = _parse_args(sys.argv[1:])
+    policy = _policy_from_args(args)
+    tracer = Tracer(args.trace, args.chrome_trace)
+    if policy.approval == "cached-only" and not PLAN_CACHE_ENABLED:
+        print("Политика cached-only требует кэш планов (PLAN_CACHE=1).")
+        sys.exit(2)
+    if args.review_approvals:
+        counts = review_approvals(policy.approval_queue)
+        print(f"Одобрено: {counts['approved']}, отклонено: {counts['rejected']}, пропущено: {counts['skipped']}")
+        sys.exit(0)
+    if args.import_approvals:
+        cache = PlanCache()
+        print(f"Загружено в кэш планов: {import_approvals(policy.approval_queue, cache)}")
+        cache.close()
+        sys.exit(0)
+    if args.path and not args.suite and _is_multi_case(args.path):
+        # Выгрузка с несколькими тест-кейсами в одном файле — прогоняем как набор
+        args.suite = args.path
+    session = None
+    if (args.session or args.setup) and not args.suite:
+        session = make_session(args.session or Path(args.setup).stem, args.setup, policy=policy, tracer=tracer)
+    if args.worker:
+        anyio.run(partial(
+            run_worker, args.queue, args.concurrency, policy, tracer,
+            session_name=args.session, setup_path=args.setup, exit_when_idle=not args.keep_alive,
+        ))
+        tracer.export()
+        sys.exit(0)
+    if args.coordinator:
+        if not (args.suite or args.path):
+            print("Для --coordinator нужен каталог (--suite) или файл тест-кейсов.")
+            sys.exit(2)
+        report = anyio.run(partial(run_coordinator, args.suite or args.path, args.queue, args.report, policy))
+        sys.exit(0 if report["failed"] == 0 else 1)
+    if args.replay:
+        report = anyio.run(partial(replay_test, args.replay, policy=policy, export_script=args.export_script, tracer=tracer, session=session))
+    elif args.suite:
+        report = anyio.run(partial(
+            run_suite, args.suite, args.concurrency, args.report, policy, tracer,
+            session_name=args.session, setup_path=args.setup, resume=args.resume,
+        ))
+        report["ok"] = report["failed"] == 0
+    elif args.path:
         try:
-            with open(path, "r", encoding="utf-8") as f:
+            with open(args.path, "r", encoding="utf-8") as f:
                 text = f.read()
         except Exception as e:
-            print(f"Не удалось прочитать файл '{path}': {e}")
+            print(f"Не удалось прочитать файл '{args.path}': {e}")
             sys.exit(1)
-        anyio.run(run_test, text)
+        report = anyio.run(partial(
+            run_test, text, policy=policy,
+            export_bundle=args.export_bundle, export_script=args.export_script, tracer=tracer, session=session,
+            resume=args.resume,
+        ))
     else:
-        anyio.run(run_test, DEFAULT_TEST)
+        report = anyio.run(partial(
+            run_test, DEFAULT_TEST, policy=policy,
+            export_bundle=args.export_bundle, export_script=args.export_script, tracer=tracer, session=session,
+            resume=args.resume,
+        ))
+    tracer.export()
+    sys.exit(0 if report["ok"] else 1)
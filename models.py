@@ -53,5 +53,5 @@ class ExecResult(BaseModel):
     errors: List[ExecError] = Field(default_factory=list)
     url: Optional[str] = None
     title: Optional[str] = None
-    bodyHtml: Optional[str] = None
+    bodyRef: Optional[str] = None  # HTML страницы после шага в ArtifactStore
     logs: List[str] = Field(default_factory=list)
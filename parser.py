@@ -1,33 +1,134 @@
 import re
-from typing import List, Dict
+from functools import lru_cache
+from typing import List, Dict, Iterable, Iterator, Optional
 
 STEP_RE = re.compile(r"^\s*(\d+)\.\s*(.+)$", re.MULTILINE)
+# Граница тест-кейса в выгрузке из TMS: заголовок «Тест-кейс …» / «Test case …» или линия ---/===
+CASE_RE = re.compile(
+    r"^\s*(?:#{1,6}\s*)?(?:ТЕСТ-КЕЙС|Тест-кейс|тест-кейс|TEST CASE|Test case)\b[\s:№#-]*(.*?)\s*$"
+    r"|^\s*(?:-{3,}|={3,})\s*$"
+)
+
+_SECTION_KEYS = {
+    "дано": "dano",
+    "предусловия": "dano",
+    "предусловие": "dano",
+    "что сделать": "do",
+    "действие": "do",
+    "ожидаемый результат": "result",
+    "результат": "result",
+    "ожидание": "result",
+}
+# Заглавный и «как в предложении» варианты, как в выгрузках; длинные ключи — раньше коротких
+_SECTION_RE = re.compile(
+    r"("
+    + "|".join(
+        re.escape(v)
+        for k in sorted(_SECTION_KEYS, key=len, reverse=True)
+        for v in (k.upper(), k.capitalize())
+    )
+    + r")\s*:?\s*"
+)
+
+
+def split_sections(body: str) -> Dict[str, str]:
+    """Дано / Что сделать / Результат из текста шага за один проход по precompiled-шаблону.
+
+    Секция тянется до следующего ключа; берётся первое вхождение каждой. Шаг без
+    ключей целиком считается действием.
+    """
+    out = {"dano": "", "do": "", "result": ""}
+    matches = list(_SECTION_RE.finditer(body))
+    if not matches:
+        out["do"] = body.strip()
+        return out
+    for i, m in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(body)
+        field = _SECTION_KEYS[m.group(1).lower()]
+        if not out[field]:
+            out[field] = body[m.end():end].strip()
+    return out
+
+
+def _make_step(num: str, lines: List[str]) -> Dict:
+    body = "\n".join(lines).strip()
+    return {"id": num.strip(), **split_sections(body), "raw": body}
+
+
+def _iter_events(lines: Iterable[str]) -> Iterator[tuple]:
+    """Построчный разбор: ("case", имя), ("step", шаг), ("preamble", текст до первого шага)."""
+    num: Optional[str] = None
+    body: List[str] = []
+    preamble: List[str] = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        case = CASE_RE.match(line)
+        step = None if case else STEP_RE.match(line)
+        if (case or step) and num is not None:
+            yield "step", _make_step(num, body)
+            num, body = None, []
+        if case:
+            if preamble:
+                yield "preamble", "\n".join(preamble)
+                preamble = []
+            yield "case", (case.group(1) or "").strip()
+        elif step:
+            if preamble:
+                yield "preamble", "\n".join(preamble)
+                preamble = []
+            num, body = step.group(1), [step.group(2)]
+        elif num is not None:
+            body.append(line)
+        elif line.strip():
+            preamble.append(line)
+    if num is not None:
+        yield "step", _make_step(num, body)
+
+
+def iter_test_cases(lines: Iterable[str]) -> Iterator[Dict]:
+    """Лениво отдаёт тест-кейсы из потока строк (файл можно передавать как есть).
+
+    Тест-кейс — {"name", "dano", "steps"}. «Дано»/«Предусловия» перед первым шагом
+    относится ко всему кейсу и подставляется первому шагу, если у того своего нет.
+    """
+    case: Dict = {"name": "", "dano": "", "steps": []}
+    for kind, value in _iter_events(lines):
+        if kind == "case":
+            if case["steps"]:
+                yield case
+            case = {"name": value, "dano": "", "steps": []}
+        elif kind == "preamble":
+            if not case["steps"]:
+                case["dano"] = split_sections(value)["dano"] or case["dano"]
+        else:
+            if not case["steps"] and case["dano"] and not value["dano"]:
+                value["dano"] = case["dano"]
+            case["steps"].append(value)
+    if case["steps"]:
+        yield case
+
+
+def iter_steps(lines: Iterable[str]) -> Iterator[Dict]:
+    """Лениво отдаёт шаги из потока строк, не обращая внимания на границы тест-кейсов."""
+    for kind, value in _iter_events(lines):
+        if kind == "step":
+            yield value
 
 
 def parse_test_case(text: str) -> List[Dict]:
-    matches = STEP_RE.findall(text)
-    steps = []
-    for num, body in matches:
-        action = extract_section(
-            body, ["ЧТО СДЕЛАТЬ", "Что сделать", "ДЕЙСТВИЕ", "Действие"]
-        )
-        result = extract_section(
-            body, ["РЕЗУЛЬТАТ", "Результат", "ОЖИДАНИЕ", "Ожидание"]
-        )
-        steps.append(
-            {"id": num.strip(), "do": action, "result": result, "raw": body.strip()}
-        )
-    return steps
+    """Шаги первого тест-кейса текста."""
+    for case in iter_test_cases(text.splitlines()):
+        return case["steps"]
+    return []
+
+
+@lru_cache(maxsize=32)
+def _section_pattern(keys: tuple) -> "re.Pattern":
+    return re.compile(r"(?:" + "|".join(re.escape(k) for k in keys) + r")\s*:?\s*")
 
 
 def extract_section(text: str, keys) -> str:
-    pattern = r"(?:" + "|".join(re.escape(k) for k in keys) + r")\s*:?\s*"
-    parts = re.split(pattern, text)
+    parts = _section_pattern(tuple(keys)).split(text, maxsplit=1)
     if len(parts) == 1:
         return ""
-    tail = parts[1]
-    next_split = re.split(
-        r"(?:ЧТО СДЕЛАТЬ|Что сделать|ДЕЙСТВИЕ|Действие|РЕЗУЛЬТАТ|Результат|ОЖИДАНИЕ|Ожидание)\s*:?\s*",
-        tail,
-    )
-    return next_split[0].strip()
+    return _SECTION_RE.split(parts[1], maxsplit=1)[0].strip()
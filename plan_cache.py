@@ -0,0 +1,140 @@
+from __future__ import annotations
+import os, re, time, hashlib, sqlite3
+from typing import Dict, Any, List, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+from models import StepPlan
+
+# === Конфиг кэша планов ===
+PLAN_CACHE_PATH = os.getenv("PLAN_CACHE_PATH", ".qa_cache/plans.sqlite")
+PLAN_CACHE_TTL = int(os.getenv("PLAN_CACHE_TTL", str(7 * 24 * 3600)))  # секунды, 0 = без TTL
+PLAN_CACHE_MAX = int(os.getenv("PLAN_CACHE_MAX", "5000"))  # записей, сверх — вытесняем LRU
+
+_WS_RE = re.compile(r"\s+")
+# Поля инвентаря, задающие «структуру» страницы. Текст сознательно не берём:
+# даты, счётчики и прочий динамический контент не должны сбрасывать кэш.
+_FP_FIELDS = ("tag", "id", "role", "testid", "placeholder")
+
+
+# === Ключ кэша ===
+def normalize_step_text(step: Dict[str, Any]) -> str:
+    parts = (step.get("dano") or "", step.get("do") or "", step.get("result") or "")
+    return "\n".join(_WS_RE.sub(" ", p).strip().lower() for p in parts)
+
+
+def normalize_url(url: str | None) -> str:
+    if not url:
+        return ""
+    p = urlsplit(url)
+    return urlunsplit((p.scheme, p.netloc.lower(), p.path.rstrip("/") or "/", p.query, ""))
+
+
+def inventory_fingerprint(inventory: List[Dict[str, Any]]) -> str:
+    h = hashlib.sha256()
+    for e in inventory or []:
+        h.update("|".join(str(e.get(k) or "") for k in _FP_FIELDS).encode("utf-8"))
+        h.update(b"\n")
+    return h.hexdigest()
+
+
+def plan_cache_key(step: Dict[str, Any], url: str | None, inventory: List[Dict[str, Any]]) -> str:
+    h = hashlib.sha256()
+    for part in (normalize_step_text(step), normalize_url(url), inventory_fingerprint(inventory)):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+# === Хранилище ===
+class PlanCache:
+    """Персистентный кэш одобренных StepPlan (SQLite, LRU + TTL)."""
+
+    def __init__(
+        self,
+        path: str = PLAN_CACHE_PATH,
+        ttl: int = PLAN_CACHE_TTL,
+        max_entries: int = PLAN_CACHE_MAX,
+    ):
+        self._ttl = ttl
+        self._max = max_entries
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS plans (
+                key TEXT PRIMARY KEY,
+                plan TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS plans_last_used ON plans(last_used)")
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "invalidations": 0, "evictions": 0}
+
+    def get(self, key: str) -> Optional[StepPlan]:
+        row = self._db.execute("SELECT plan, created_at FROM plans WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row and self._ttl and now - row[1] > self._ttl:
+            self._db.execute("DELETE FROM plans WHERE key = ?", (key,))
+            self.stats["evictions"] += 1
+            row = None
+        if not row:
+            self.stats["misses"] += 1
+            return None
+        try:
+            plan = StepPlan.model_validate_json(row[0])
+        except Exception:
+            # Запись от несовместимой версии моделей — считаем промахом
+            self.invalidate(key)
+            self.stats["misses"] += 1
+            return None
+        self._db.execute("UPDATE plans SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        self.stats["hits"] += 1
+        return plan
+
+    def put(self, key: str, plan: StepPlan) -> None:
+        """Сохраняет план. У существующей записи меняется только план (например, вылеченный
+        селектор): возраст для TTL и счётчик попаданий остаются прежними."""
+        now = time.time()
+        self._db.execute(
+            """INSERT INTO plans (key, plan, created_at, last_used, hits) VALUES (?, ?, ?, ?, 0)
+            ON CONFLICT(key) DO UPDATE SET plan = excluded.plan, last_used = excluded.last_used""",
+            (key, plan.model_dump_json(by_alias=True), now, now),
+        )
+        self.stats["stores"] += 1
+        self._evict()
+
+    def invalidate(self, key: str) -> None:
+        cur = self._db.execute("DELETE FROM plans WHERE key = ?", (key,))
+        if cur.rowcount:
+            self.stats["invalidations"] += 1
+
+    def _evict(self) -> None:
+        if self._ttl:
+            cur = self._db.execute("DELETE FROM plans WHERE created_at < ?", (time.time() - self._ttl,))
+            self.stats["evictions"] += max(cur.rowcount, 0)
+        if self._max:
+            cur = self._db.execute(
+                """DELETE FROM plans WHERE key IN (
+                    SELECT key FROM plans ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )""",
+                (self._max,),
+            )
+            self.stats["evictions"] += max(cur.rowcount, 0)
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM plans").fetchone()[0]
+
+    def close(self) -> None:
+        self._db.close()
+
+    def summary(self) -> str:
+        s = self.stats
+        total = s["hits"] + s["misses"]
+        rate = (s["hits"] / total * 100) if total else 0.0
+        return (
+            f"hits={s['hits']} misses={s['misses']} ({rate:.0f}% попаданий), "
+            f"stores={s['stores']} invalidations={s['invalidations']} evictions={s['evictions']}"
+        )
@@ -0,0 +1,218 @@
+from __future__ import annotations
+import os
+from functools import lru_cache
+from typing import Annotated, Any, Dict, List, Optional, Type, get_args
+
+from pydantic import BaseModel, ConfigDict, Field, StringConstraints, ValidationError
+
+from models import (
+    ActionType, SelectorType, WaitForType,
+    Expectation, Instruction, Selector, StepPlan, Target, WaitSpec,
+)
+
+# === Конфиг формата ответа модели ===
+# 1 — response_format json_schema со strict-схемой; 0 — json_object (для endpoint'ов без structured outputs)
+LLM_STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "1") == "1"
+
+# Компактный формат плана, в котором отвечает модель. Ключи короткие, stepId/title/hints
+# не повторяются (они известны заранее), селектор — строка "тип:значение".
+# Типы и допустимые значения берутся из models.py, поэтому схема не расходится с StepPlan.
+_SELECTOR_RE = rf"^({'|'.join(get_args(SelectorType))}):.+"
+SelectorRef = Annotated[str, StringConstraints(pattern=_SELECTOR_RE)]
+ExpectKind = Expectation.model_fields["kind"].annotation
+
+# Действиям с элементом нужен селектор, вводу и переходам — значение
+_NEEDS_SELECTOR = {"click", "fill", "waitForSelector", "assertVisible"}
+_NEEDS_VALUE = {"navigate", "waitForURL", "fill", "assertText"}
+
+
+class PlanFormatError(ValueError):
+    """Ответ модели не разбирается в план; errors — по одной строке на проблему (путь: что не так)."""
+
+    def __init__(self, errors: List[str], raw: str = ""):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+        self.raw = raw
+
+
+class _Wire(BaseModel):
+    model_config = ConfigDict(extra="forbid", populate_by_name=True)
+
+
+class WireWait(_Wire):
+    for_: WaitForType = Field(alias="for")
+    ms: Optional[int] = None
+
+
+class WireInstruction(_Wire):
+    do: ActionType
+    sel: List[SelectorRef] = Field(default_factory=list)  # основной селектор, затем альтернативы
+    v: Optional[str] = None  # URL для navigate/waitForURL, текст для fill/assertText
+    mask: bool = False
+    wait: Optional[WireWait] = None
+    after: Optional[WireWait] = None
+
+
+class WireExpect(_Wire):
+    k: ExpectKind
+    v: Optional[str] = None
+    sel: Optional[SelectorRef] = None
+
+
+class WirePlan(_Wire):
+    ins: List[WireInstruction] = Field(default_factory=list)
+    exp: List[WireExpect] = Field(default_factory=list)
+
+
+class WireBatch(_Wire):
+    plans: List[WirePlan]
+
+
+# === Схема для response_format ===
+def _strict(node: Any) -> None:
+    # Strict-режим: все поля обязательны (необязательность — через null), лишние запрещены,
+    # default/title не поддерживаются
+    if isinstance(node, list):
+        for item in node:
+            _strict(item)
+        return
+    if not isinstance(node, dict):
+        return
+    node.pop("default", None)
+    node.pop("title", None)
+    if "properties" in node:
+        node["required"] = list(node["properties"])
+        node["additionalProperties"] = False
+    for key, value in node.items():
+        if key in ("properties", "$defs"):
+            for sub in value.values():
+                _strict(sub)
+        else:
+            _strict(value)
+
+
+@lru_cache(maxsize=None)
+def strict_schema(model: Type[BaseModel]) -> Dict[str, Any]:
+    schema = model.model_json_schema(by_alias=True)
+    _strict(schema)
+    return schema
+
+
+def response_format(model: Type[BaseModel]) -> Dict[str, Any]:
+    if not LLM_STRUCTURED_OUTPUT:
+        return {"type": "json_object"}
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": model.__name__.lower(), "strict": True, "schema": strict_schema(model)},
+    }
+
+
+# === Разбор и развёртка в StepPlan ===
+def _selector(ref: str) -> Selector:
+    kind, value = ref.split(":", 1)
+    return Selector(type=kind, value=value)
+
+
+def _wait(w: Optional[WireWait]) -> Optional[WaitSpec]:
+    if w is None:
+        return None
+    return WaitSpec(**{"for": w.for_}) if w.ms is None else WaitSpec(**{"for": w.for_, "timeoutMs": w.ms})
+
+
+def _check(plan: WirePlan, prefix: str = "") -> List[str]:
+    errors = []
+    for i, ins in enumerate(plan.ins):
+        if ins.do in _NEEDS_SELECTOR and not ins.sel:
+            errors.append(f"{prefix}ins.{i}.sel: для {ins.do} нужен селектор")
+        if ins.do in _NEEDS_VALUE and ins.v is None:
+            errors.append(f"{prefix}ins.{i}.v: для {ins.do} нужно значение")
+    for i, exp in enumerate(plan.exp):
+        if exp.k != "elementVisible" and not exp.v:
+            errors.append(f"{prefix}exp.{i}.v: для {exp.k} нужно значение")
+        if exp.k == "elementVisible" and exp.sel is None:
+            errors.append(f"{prefix}exp.{i}.sel: для elementVisible нужен селектор")
+    return errors
+
+
+def expand(plan: WirePlan, step_id: str, title: str, hints: Dict[str, Any] | None = None) -> StepPlan:
+    instructions = []
+    for ins in plan.ins:
+        target = None
+        if ins.sel and ins.do != "navigate":
+            target = Target(selector=_selector(ins.sel[0]), alternatives=[_selector(s) for s in ins.sel[1:]])
+        instructions.append(Instruction(
+            action=ins.do,
+            url=ins.v if ins.do == "navigate" else None,
+            target=target,
+            value=ins.v if ins.do != "navigate" else None,
+            masking=ins.mask,
+            wait=_wait(ins.wait),
+            waitAfter=_wait(ins.after),
+        ))
+    expects = [
+        Expectation(kind=e.k, value=e.v, selector=_selector(e.sel) if e.sel else None)
+        for e in plan.exp
+    ]
+    return StepPlan(stepId=step_id, title=title, instructions=instructions, expects=expects, hintsFromUser=hints)
+
+
+def _load(raw: str, model: Type[BaseModel]):
+    # Одна проверка: JSON разбирается и валидируется сразу моделью, без промежуточного dict
+    try:
+        return model.model_validate_json(raw)
+    except ValidationError as e:
+        errors = [f"{'.'.join(map(str, err['loc'])) or '$'}: {err['msg']}" for err in e.errors()]
+        raise PlanFormatError(errors, raw) from None
+
+
+def parse_plan(raw: str, step_id: str, title: str, hints: Dict[str, Any] | None = None) -> StepPlan:
+    """План одного шага из ответа модели или PlanFormatError."""
+    wire = _load(raw, WirePlan)
+    errors = _check(wire)
+    # Шаг только с проверками (ins пуст, exp нет) — нормальный план; пусто и то, и другое — нет
+    if not wire.ins and not wire.exp:
+        errors.append("ins, exp: оба пусты — шаг не спланирован")
+    if errors:
+        raise PlanFormatError(errors, raw)
+    return expand(wire, step_id, title, hints)
+
+
+def parse_batch(raw: str, steps: List[Dict[str, Any]]) -> List[StepPlan]:
+    """Планы пакета шагов по порядку. Пустой план (ни ins, ни exp) допустим только не для
+    первого шага: на нём очередь lookahead обрывается."""
+    wire = _load(raw, WireBatch)
+    errors = []
+    if not wire.plans or not (wire.plans[0].ins or wire.plans[0].exp):
+        errors.append("plans.0.ins: первый шаг пакета должен быть спланирован")
+    for i, plan in enumerate(wire.plans[:len(steps)]):
+        errors += _check(plan, f"plans.{i}.")
+    if errors:
+        raise PlanFormatError(errors, raw)
+    return [expand(plan, step["id"], step["raw"][:80]) for plan, step in zip(wire.plans, steps)]
+
+
+def to_wire(plan: StepPlan) -> Dict[str, Any]:
+    """StepPlan в компактном формате ответа (для стабов модели и примеров)."""
+    def sel(s: Selector) -> str:
+        return f"{s.type}:{s.value}"
+
+    def wait(w: Optional[WaitSpec]):
+        return {"for": w.for_, "ms": w.timeoutMs} if w else None
+
+    return {
+        "ins": [
+            {
+                "do": ins.action,
+                "sel": [sel(ins.target.selector), *map(sel, ins.target.alternatives)] if ins.target else [],
+                "v": ins.url if ins.action == "navigate" else ins.value,
+                "mask": bool(ins.masking),
+                "wait": wait(ins.wait),
+                "after": wait(ins.waitAfter),
+            }
+            for ins in plan.instructions
+        ],
+        "exp": [
+            {"k": e.kind, "v": e.value, "sel": sel(e.selector) if e.selector else None}
+            for e in plan.expects
+        ],
+    }
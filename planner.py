@@ -1,34 +1,83 @@
 from __future__ import annotations
 import os, json, textwrap
 from typing import Dict, Any, List
-from tenacity import (
-    retry,
-    stop_after_attempt,
-    wait_exponential,
-    retry_if_exception_type,
-)
 
-from openai import OpenAI
-from pydantic import ValidationError
+import httpx
+from openai import OpenAI, AsyncOpenAI
 
 from models import StepPlan, Instruction, Target, Selector
+from plan_wire import WirePlan, WireBatch, PlanFormatError, parse_plan, parse_batch, response_format
+from prompt_budget import (
+    select_context,
+    estimate_tokens,
+    tokens_for_chars,
+    PROMPT_TOKEN_BUDGET,
+    PROMPT_TOP_K,
+    PROMPT_DIFF_MAX_ITEMS,
+    PROMPT_DIFF_BUDGET,
+    PROMPT_DIFF_TOP_K,
+)
+from dom_tools import DIFF_FIELDS
+from telemetry import span, add
+from llm_scheduler import call_sync, get_scheduler, record_usage
 
 # === Конфиг модели ===
 LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")  # напр. локальный стаб-сервер
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))  # секунды на один запрос
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+PLAN_FORMAT_RETRIES = int(os.getenv("PLAN_FORMAT_RETRIES", "1"))  # повторных запросов на невалидный план
 
 _client = None
+_aclient = None
+
+
+def _api_key() -> str:
+    if OPENAI_API_KEY:
+        return OPENAI_API_KEY
+    if OPENAI_BASE_URL:
+        # Локальному стабу ключ не нужен, но клиент требует непустое значение
+        return "local"
+    raise RuntimeError("OPENAI_API_KEY не задан в окружении")
 
 
 def _get_client() -> OpenAI:
     global _client
     if _client is None:
-        if not OPENAI_API_KEY:
-            raise RuntimeError("OPENAI_API_KEY не задан в окружении")
-        _client = OpenAI(api_key=OPENAI_API_KEY)
+        # Повторы — в call_sync; встроенные ретраи SDK умножили бы число попыток
+        _client = OpenAI(api_key=_api_key(), base_url=OPENAI_BASE_URL, timeout=LLM_TIMEOUT, max_retries=0)
     return _client
 
 
+def _get_async_client() -> AsyncOpenAI:
+    # Один клиент на процесс: пул keep-alive соединений переиспользуется между шагами.
+    # Повторы делает планировщик запросов, поэтому встроенные ретраи SDK выключены.
+    global _aclient
+    if _aclient is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_CONNECTIONS,
+            ),
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0),
+        )
+        _aclient = AsyncOpenAI(
+            api_key=_api_key(),
+            base_url=OPENAI_BASE_URL,
+            http_client=http_client,
+            max_retries=0,
+        )
+    return _aclient
+
+
+async def aclose_llm_client() -> None:
+    global _aclient
+    if _aclient is not None:
+        await _aclient.close()
+        _aclient = None
+
+
 # === Утилиты усечения контекста ===
 def _truncate(s: str, max_chars: int) -> str:
     if s is None:
@@ -61,6 +110,10 @@ def _shrink_inventory(
                 "cssCandidates": (e.get("cssCandidates") or [])[:3],
             }
         )
+        # Доступное имя есть только у инвентаря из браузера; дублирующее text не шлём
+        name = e.get("name")
+        if name and name != out[-1]["text"]:
+            out[-1]["name"] = name[:120]
     return out
 
 
@@ -72,20 +125,104 @@ SYSTEM_INSTR = """Ты — планировщик шагов автотеста
 - Действия (action): navigate | click | fill | waitForSelector | waitForURL | assertVisible | assertText
 - Типы селекторов: testid | role | label | placeholder | text | css | id
 - НЕЛЬЗЯ использовать xpath; svg игнорируй полностью (во входном HTML уже вырезано).
-- Отдавай 1–3 альтернативных селектора (alternatives) на важные действия (click, fill).
+- Селектор — строка "тип:значение": testid:submit, placeholder:Пароль, role:button[name="Сохранить"].
+- В sel первым идёт основной селектор; на важные действия (click, fill) добавляй за ним 1–3 альтернативных.
 - Приоритет селекторов: testid > role > label/placeholder > id > text > css.
 - Для классов с хэш-суффиксами генерируй css только вида [class^="stable_part"] или [class*="stable_part"].
-- Для navigate используй wait: { "for": "domcontentloaded" } по умолчанию.
-- В expects формируй проверки из секции 'Результат' (urlIncludes, elementVisible, assertText).
-- Соблюдай JSON-схему: StepPlan { stepId, title, instructions[], expects[], hintsFromUser? }.
-
-Вывод — строго валидный JSON одного StepPlan и ничего больше.
+- Для role-селектора value — роль и доступное имя: button[name="Сохранить"] (или просто button).
+- Для navigate используй wait: { "for": "domcontentloaded", "ms": null } по умолчанию.
+- wait — чего дождаться перед действием (для navigate — условие загрузки), after — после действия
+  (например, { "for": "networkidle", "ms": null } после отправки формы). Фиксированные паузы не нужны.
+- В exp формируй проверки из секции 'Результат' (urlIncludes, elementVisible, assertText).
+- Если есть секция ИЗМЕНЕНИЯ DOM — это то, что появилось или поменялось после прошлого шага
+  (например, открытый выпадающий список); цель шага чаще всего среди этих элементов.
+- Формат плана (компактный, stepId и title не нужны):
+  { "ins": [{ "do": action, "sel": ["тип:значение", ...], "v": строка|null, "mask": bool, "wait": ...|null, "after": ...|null }],
+    "exp": [{ "k": "urlIncludes"|"elementVisible"|"assertText", "v": строка|null, "sel": "тип:значение"|null }] }
+  v — URL для navigate/waitForURL, текст для fill/assertText; mask: true для паролей и секретов.
+
+Вывод — строго валидный JSON одного плана и ничего больше.
 """
 
 
+def _diff_json(dom_diff: Dict[str, Any] | None) -> str:
+    """Дифф инвентаря для промпта или "", если его нет или изменилось слишком много."""
+    if not dom_diff:
+        return ""
+    total = len(dom_diff["added"]) + len(dom_diff["removed"]) + len(dom_diff["changed"])
+    if total > PROMPT_DIFF_MAX_ITEMS:
+        return ""
+    changed = []
+    for before, after in dom_diff["changed"]:
+        item = _shrink_inventory([after])[0]
+        item["before"] = {f: before.get(f) for f in DIFF_FIELDS if before.get(f) != after.get(f)}
+        changed.append(item)
+    removed = [
+        {k: v for k, v in e.items() if v and k in ("tag", "id", "testid", "role", "text")}
+        for e in _shrink_inventory(dom_diff["removed"])
+    ]
+    return json.dumps(
+        {"added": _shrink_inventory(dom_diff["added"]), "changed": changed, "removed": removed},
+        ensure_ascii=False,
+    )
+
+
+def _legacy_tokens(body_html: str, dom_inventory: List[Dict[str, Any]], inv_json: str, inv_sent: int) -> int:
+    # Оценка контекста без отбора (body до 40000 символов и до 120 элементов инвентаря) только
+    # для статистики: по длинам, без повторного рендера HTML и JSON всего инвентаря
+    per_item = len(inv_json) / inv_sent if inv_sent else 0
+    chars = min(len(body_html or ""), 40000) + per_item * min(len(dom_inventory or []), 120)
+    return tokens_for_chars(chars)
+
+
+def _prompt_context(
+    label: str,
+    body_html: str,
+    dom_inventory: List[Dict[str, Any]],
+    query: str,
+    dom_diff: Dict[str, Any] | None = None,
+) -> tuple[str, str, str]:
+    # В промпт идут только релевантные шагу элементы и HTML вокруг них — в пределах бюджета токенов.
+    # На той же странице, что и прошлый шаг, основное — дифф, а выборка по странице сокращается
+    diff_json = _diff_json(dom_diff)
+    budget, top_k = (PROMPT_DIFF_BUDGET, PROMPT_DIFF_TOP_K) if diff_json else (PROMPT_TOKEN_BUDGET, PROMPT_TOP_K)
+    inv_top, html_part, stats = select_context(
+        body_html or "", dom_inventory or [], query, _shrink_inventory, budget, top_k
+    )
+    inv_json = json.dumps(inv_top, ensure_ascii=False)
+    if body_html:
+        body_short = html_part
+    else:
+        body_short = "(не передаётся: инвентарь собран в браузере, только видимые интерактивные элементы)"
+    legacy_tokens = _legacy_tokens(body_html, dom_inventory, inv_json, stats["inventory_sent"])
+    diff_tokens = estimate_tokens(diff_json) if diff_json else 0
+    sent_tokens = estimate_tokens(body_short) + estimate_tokens(inv_json) + diff_tokens
+    add(
+        context_tokens=sent_tokens,
+        context_tokens_saved=max(0, legacy_tokens - sent_tokens),
+        inventory_sent=stats["inventory_sent"],
+        diff_tokens=diff_tokens,
+    )
+    diff_note = diff_block = ""
+    if diff_json:
+        diff_note = f", дифф +{len(dom_diff['added'])}/-{len(dom_diff['removed'])}/~{len(dom_diff['changed'])}"
+        diff_block = (
+            "\n    ИЗМЕНЕНИЯ DOM С ПРОШЛОГО ШАГА (та же страница; added / changed с прежними "
+            f"значениями в before / removed):\n    {diff_json}\n"
+        )
+    print(
+        f"[prompt] {label}: ~{sent_tokens} ток. контекста "
+        f"(элементов {stats['inventory_sent']}/{stats['inventory_total']}, "
+        f"HTML {stats['html_sent_chars']}/{stats['html_total_chars']} симв.{diff_note}), "
+        f"сэкономлено ~{max(0, legacy_tokens - sent_tokens)} ток."
+    )
+    return body_short, inv_json, diff_block
+
+
 def _build_user_prompt(
     step_id: str,
     step_title: str,
+    dano: str,
     action: str,
     result: str,
     url: str,
@@ -93,106 +230,225 @@ def _build_user_prompt(
     body_html: str,
     dom_inventory: List[Dict[str, Any]],
     hints: Dict[str, Any] | None,
+    dom_diff: Dict[str, Any] | None = None,
 ) -> str:
-    inv_json = json.dumps(_shrink_inventory(dom_inventory), ensure_ascii=False)
     hints_json = json.dumps(hints or {}, ensure_ascii=False)
-    body_short = _truncate(body_html, 40000)
+    body_short, inv_json, diff_block = _prompt_context(
+        f"шаг {step_id}", body_html, dom_inventory, f"{action or ''} {result or ''}", dom_diff
+    )
 
     return f"""
+    ДАНО: {dano or ""}
     ЧТО СДЕЛАТЬ: {action or ""}
     РЕЗУЛЬТАТ: {result or ""}
 
     ТЕКУЩЕЕ СОСТОЯНИЕ:
     - URL: {url}
     - TITLE: {title}
-    - BODY_HTML (без svg, усечён): <<<HTML_START>>>
+    - BODY_HTML (без svg, фрагменты вокруг релевантных элементов): <<<HTML_START>>>
 {body_short}
 <<<HTML_END>>>
-
-    DOM-ИНВЕНТАРЬ (усечён):
+{diff_block}
+    DOM-ИНВЕНТАРЬ (наиболее релевантные шагу элементы):
     {inv_json}
 
     ПОДСКАЗКИ ПОЛЬЗОВАТЕЛЯ (если есть):
     {hints_json}
 
-    Требуется сгенерировать JSON StepPlan для шага:
+    Требуется сгенерировать план (JSON) для шага:
     - stepId: "{step_id}"
     - title: "{_truncate(step_title, 120)}"
     """
 
 
-@retry(
-    reraise=True,
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1.2, min=1, max=8),
-    retry=retry_if_exception_type(Exception),
-)
-def _call_llm(messages: List[Dict[str, str]]) -> str:
+def _record_usage(resp) -> None:
+    usage = getattr(resp, "usage", None)
+    if usage is not None:
+        add(prompt_tokens=usage.prompt_tokens or 0, completion_tokens=usage.completion_tokens or 0)
+        record_usage((usage.prompt_tokens or 0) + (usage.completion_tokens or 0))
+
+
+def _call_llm_attempt(messages: List[Dict[str, str]], fmt: Dict[str, Any] | None = None) -> str:
+    # Одна попытка: повторы — в llm_scheduler.call_sync по той же политике, что и в асинхронном пути
+    add(llm_attempts=1)
     client = _get_client()
     resp = client.chat.completions.create(
         model=LLM_MODEL,
         messages=messages,
         temperature=0.1,
-        response_format={"type": "json_object"},  # просим чистый JSON
+        response_format=fmt or {"type": "json_object"},  # просим чистый JSON
     )
+    _record_usage(resp)
     return resp.choices[0].message.content or "{}"
 
 
-def _pydantic_load_or_repair(
-    raw: str, fallback_title: str, step_id: str, hints: Dict[str, Any] | None
-) -> StepPlan:
-    try:
-        data = json.loads(raw)
-    except Exception:
-        return StepPlan(
-            stepId=step_id,
-            title=fallback_title,
-            instructions=[],
-            expects=[],
-            hintsFromUser=hints,
-        )
-    try:
-        return StepPlan.model_validate(data)
-    except ValidationError:
-        data.setdefault("stepId", step_id)
-        data.setdefault("title", fallback_title)
-        data.setdefault("instructions", [])
-        data.setdefault("expects", [])
+def _call_llm(messages: List[Dict[str, str]], fmt: Dict[str, Any] | None = None) -> str:
+    with span("llm.call", model=LLM_MODEL):
+        return call_sync(lambda: _call_llm_attempt(messages, fmt))
+
+
+async def _acall_llm_attempt(messages: List[Dict[str, str]], fmt: Dict[str, Any] | None = None) -> str:
+    # Одна попытка: повторы, паузы по Retry-After и лимиты — в планировщике (llm_scheduler)
+    add(llm_attempts=1)
+    client = _get_async_client()
+    resp = await client.chat.completions.create(
+        model=LLM_MODEL,
+        messages=messages,
+        temperature=0.1,
+        response_format=fmt or {"type": "json_object"},
+        timeout=LLM_TIMEOUT,
+    )
+    _record_usage(resp)
+    return resp.choices[0].message.content or "{}"
+
+
+async def _acall_llm(messages: List[Dict[str, str]], fmt: Dict[str, Any] | None = None) -> str:
+    # Спан охватывает очередь и все попытки: llm_attempts - 1 = число ретраев
+    with span("llm.call", model=LLM_MODEL):
+        return await get_scheduler().call(messages, lambda: _acall_llm_attempt(messages, fmt), LLM_MODEL)
+
+
+def _repair_messages(messages: List[Dict[str, str]], err: PlanFormatError) -> List[Dict[str, str]]:
+    # Повтор с конкретными ошибками: модель правит свой ответ, а не планирует шаг заново
+    problems = "\n".join(f"- {e}" for e in err.errors[:10])
+    return [
+        *messages,
+        {"role": "assistant", "content": err.raw},
+        {"role": "user", "content": f"Ответ не прошёл проверку формата:\n{problems}\nИсправь эти места и верни JSON целиком."},
+    ]
+
+
+def _plan_with_retry(messages, fmt, parse):
+    raw = _call_llm(messages, fmt)
+    for attempt in range(PLAN_FORMAT_RETRIES + 1):
         try:
-            return StepPlan.model_validate(data)
-        except ValidationError:
-            return StepPlan(
-                stepId=step_id,
-                title=fallback_title,
-                instructions=[],
-                expects=[],
-                hintsFromUser=hints,
-            )
+            return parse(raw)
+        except PlanFormatError as e:
+            add(plan_format_errors=1)
+            if attempt == PLAN_FORMAT_RETRIES:
+                raise
+            print(f"[planner] план не прошёл проверку ({e}), повторный запрос")
+            raw = _call_llm(_repair_messages(messages, e), fmt)
+
+
+async def _aplan_with_retry(messages, fmt, parse):
+    raw = await _acall_llm(messages, fmt)
+    for attempt in range(PLAN_FORMAT_RETRIES + 1):
+        try:
+            return parse(raw)
+        except PlanFormatError as e:
+            add(plan_format_errors=1)
+            if attempt == PLAN_FORMAT_RETRIES:
+                raise
+            print(f"[planner] план не прошёл проверку ({e}), повторный запрос")
+            raw = await _acall_llm(_repair_messages(messages, e), fmt)
+
+
+# === Пакетное планирование нескольких шагов (lookahead) ===
+BATCH_SYSTEM_INSTR = SYSTEM_INSTR.replace(
+    "Вывод — строго валидный JSON одного плана и ничего больше.",
+    """Сейчас нужно спланировать НЕСКОЛЬКО идущих подряд шагов одним ответом.
+- Для каждого шага — отдельный план, в том же порядке, что и шаги во входе.
+- Планируй каждый следующий шаг так, будто предыдущие уже выполнены.
+- Для шагов, которые меняют страницу, обязательно заполняй exp (urlIncludes / elementVisible):
+  по ним проверяется, что следующий план ещё применим.
+- Если шаг невозможно спланировать без нового DOM, верни для него пустые ins и exp
+  (первый шаг планируется всегда).
+
+Вывод — строго валидный JSON вида {"plans": [план, ...]} и ничего больше.""",
+)
 
 
-def plan_step_llm(
+def _build_batch_prompt(
+    steps: List[Dict[str, Any]],
+    url: str,
+    title: str,
+    body_html: str,
+    dom_inventory: List[Dict[str, Any]],
+    hints: Dict[str, Any] | None,
+    dom_diff: Dict[str, Any] | None = None,
+) -> str:
+    hints_json = json.dumps(hints or {}, ensure_ascii=False)
+    query = " ".join(f"{s.get('do') or ''} {s.get('result') or ''}" for s in steps)
+    ids = ", ".join(str(s["id"]) for s in steps)
+    body_short, inv_json, diff_block = _prompt_context(f"шаги {ids}", body_html, dom_inventory, query, dom_diff)
+    steps_text = "\n".join(
+        f"    {s['id']}. ДАНО: {s.get('dano') or ''} | ЧТО СДЕЛАТЬ: {s.get('do') or ''} | РЕЗУЛЬТАТ: {s.get('result') or ''}"
+        for s in steps
+    )
+
+    return f"""
+    ШАГИ (по порядку):
+{steps_text}
+
+    ТЕКУЩЕЕ СОСТОЯНИЕ (перед первым шагом):
+    - URL: {url}
+    - TITLE: {title}
+    - BODY_HTML (без svg, фрагменты вокруг релевантных элементов): <<<HTML_START>>>
+{body_short}
+<<<HTML_END>>>
+{diff_block}
+    DOM-ИНВЕНТАРЬ (наиболее релевантные шагам элементы):
+    {inv_json}
+
+    ПОДСКАЗКИ ПОЛЬЗОВАТЕЛЯ К ПЕРВОМУ ШАГУ (если есть):
+    {hints_json}
+
+    Требуется сгенерировать {{"plans": [...]}} c планами для шагов: {ids}
+    """
+
+
+async def aplan_steps_llm_batch(
+    steps: List[Dict[str, Any]],
+    url: str,
+    title: str,
+    body_html: str,
+    dom_inventory: list,
+    hints: Dict[str, Any] | None = None,
+    dom_diff: Dict[str, Any] | None = None,
+) -> List[StepPlan]:
+    """Планы для нескольких шагов одним запросом. Подсказки применяются к первому шагу."""
+    with span("prompt.build", batch=len(steps)):
+        user_prompt = _build_batch_prompt(steps, url, title, body_html, dom_inventory, hints, dom_diff)
+    messages = [
+        {"role": "system", "content": BATCH_SYSTEM_INSTR},
+        {"role": "user", "content": user_prompt},
+    ]
+    plans = await _aplan_with_retry(messages, response_format(WireBatch), lambda raw: parse_batch(raw, steps))
+    # Пустой план (ни действий, ни проверок) модель не смогла построить заранее — дальше него очередь не строим
+    for i in range(1, len(plans)):
+        if not plans[i].instructions and not plans[i].expects:
+            del plans[i:]
+            break
+    if plans:
+        _apply_hints(plans[0], hints)
+    return plans
+
+
+def _build_messages(
     step_id: str,
     step_title: str,
+    dano: str,
     action: str,
     result: str,
     url: str,
     title: str,
     body_html: str,
     dom_inventory: list,
-    hints: Dict[str, Any] | None = None,
-) -> StepPlan:
-    user_prompt = _build_user_prompt(
-        step_id, step_title, action, result, url, title, body_html, dom_inventory, hints
-    )
-
-    messages = [
+    hints: Dict[str, Any] | None,
+    dom_diff: Dict[str, Any] | None = None,
+) -> List[Dict[str, str]]:
+    with span("prompt.build"):
+        user_prompt = _build_user_prompt(
+            step_id, step_title, dano, action, result, url, title, body_html, dom_inventory, hints, dom_diff
+        )
+    return [
         {"role": "system", "content": SYSTEM_INSTR},
         {"role": "user", "content": user_prompt},
     ]
 
-    raw = _call_llm(messages)
-    plan = _pydantic_load_or_repair(raw, step_title, step_id, hints)
 
+def _apply_hints(plan: StepPlan, hints: Dict[str, Any] | None) -> StepPlan:
     # Гарантированно применим подсказки локально (на случай игнора моделью)
     if hints:
         if isinstance(hints.get("prepend_instructions"), list):
@@ -224,3 +480,45 @@ def plan_step_llm(
                     pass
 
     return plan
+
+
+def plan_step_llm(
+    step_id: str,
+    step_title: str,
+    action: str,
+    result: str,
+    url: str,
+    title: str,
+    body_html: str,
+    dom_inventory: list,
+    hints: Dict[str, Any] | None = None,
+    dano: str = "",
+    dom_diff: Dict[str, Any] | None = None,
+) -> StepPlan:
+    messages = _build_messages(
+        step_id, step_title, dano, action, result, url, title, body_html, dom_inventory, hints, dom_diff
+    )
+    plan = _plan_with_retry(messages, response_format(WirePlan), lambda raw: parse_plan(raw, step_id, step_title, hints))
+    return _apply_hints(plan, hints)
+
+
+async def aplan_step_llm(
+    step_id: str,
+    step_title: str,
+    action: str,
+    result: str,
+    url: str,
+    title: str,
+    body_html: str,
+    dom_inventory: list,
+    hints: Dict[str, Any] | None = None,
+    dano: str = "",
+    dom_diff: Dict[str, Any] | None = None,
+) -> StepPlan:
+    messages = _build_messages(
+        step_id, step_title, dano, action, result, url, title, body_html, dom_inventory, hints, dom_diff
+    )
+    plan = await _aplan_with_retry(
+        messages, response_format(WirePlan), lambda raw: parse_plan(raw, step_id, step_title, hints)
+    )
+    return _apply_hints(plan, hints)
@@ -0,0 +1,130 @@
+from __future__ import annotations
+import os, json, time
+from typing import Literal, List, Dict, Any, Optional
+from pydantic import BaseModel, ConfigDict
+
+from models import StepPlan
+from cli import print_plan
+
+ApprovalPolicy = Literal["ask", "auto", "cached-only"]
+ErrorPolicy = Literal["ask", "fail-fast", "continue"]
+
+APPROVAL_POLICY = os.getenv("APPROVAL_POLICY", "ask")
+ON_ERROR_POLICY = os.getenv("ON_ERROR_POLICY", "ask")
+APPROVAL_QUEUE_PATH = os.getenv("APPROVAL_QUEUE_PATH", "approvals.jsonl")
+
+
+class RunPolicy(BaseModel):
+    """Как прогон реагирует на новые планы и на упавшие шаги.
+
+    approval: ask — спрашивать в консоли; auto — одобрять всё; cached-only — исполнять
+    только планы из кэша, новые складывать в очередь одобрения и останавливать тест-кейс.
+    on_error: ask — спрашивать; fail-fast — остановить тест-кейс (в наборе — и весь набор);
+    continue — идти к следующему шагу.
+    """
+
+    model_config = ConfigDict(validate_default=True)
+
+    approval: ApprovalPolicy = APPROVAL_POLICY
+    on_error: ErrorPolicy = ON_ERROR_POLICY
+    approval_queue: str = APPROVAL_QUEUE_PATH
+
+
+# === Очередь одобрения (JSONL) ===
+def enqueue_approval(
+    path: str,
+    plan: StepPlan,
+    step: Dict[str, Any],
+    url: Optional[str],
+    cache_key: Optional[str],
+    case_name: str = "",
+) -> bool:
+    """Кладёт план в очередь; False — план с тем же ключом кэша уже ждёт ревью или импорта."""
+    entry = {
+        "status": "pending",
+        "key": cache_key,
+        "case": case_name,
+        "stepId": plan.stepId,
+        "step": {k: step.get(k) for k in ("id", "dano", "do", "result")},
+        "url": url,
+        "plan": plan.model_dump(by_alias=True),
+        "created_at": time.time(),
+    }
+    return append_approvals(path, [entry]) == 1
+
+
+# Записи, которые ещё не дошли до кэша: повторно их в очередь не кладём
+_OPEN_STATUSES = ("pending", "approved")
+
+
+def append_approvals(path: str, entries: List[Dict[str, Any]]) -> int:
+    """Дописывает записи в очередь (например, присланные воркерами вместе с результатом).
+
+    Запись с ключом кэша, который уже ждёт ревью или импорта, пропускается: каждый прогон
+    cached-only иначе добавлял бы ту же запись заново. Возвращает число добавленных.
+    """
+    seen = {e.get("key") for e in load_approvals(path) if e.get("status") in _OPEN_STATUSES}
+    fresh = []
+    for e in entries:
+        key = e.get("key")
+        if key and key in seen:
+            continue
+        seen.add(key)
+        fresh.append(e)
+    if fresh:
+        with open(path, "a", encoding="utf-8") as f:
+            for e in fresh:
+                f.write(json.dumps(e, ensure_ascii=False) + "\n")
+    return len(fresh)
+
+
+def load_approvals(path: str) -> List[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_approvals(path: str, entries: List[Dict[str, Any]]) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for e in entries:
+            f.write(json.dumps(e, ensure_ascii=False) + "\n")
+    os.replace(tmp, path)
+
+
+def review_approvals(path: str) -> Dict[str, int]:
+    """Офлайн-ревью очереди: по каждому pending-плану спросить y/n/s(kip)."""
+    entries = load_approvals(path)
+    counts = {"approved": 0, "rejected": 0, "skipped": 0}
+    for e in entries:
+        if e.get("status") != "pending":
+            continue
+        print(f"\n[{e.get('case') or '-'}] URL: {e.get('url')}")
+        print(f"ЧТО СДЕЛАТЬ: {e['step'].get('do')}\nРЕЗУЛЬТАТ: {e['step'].get('result')}")
+        print_plan(StepPlan.model_validate(e["plan"]))
+        ans = input("Одобрить? [y/n/s]: ").strip().lower()
+        if ans in ("y", "yes"):
+            e["status"] = "approved"
+            counts["approved"] += 1
+        elif ans in ("n", "no"):
+            e["status"] = "rejected"
+            counts["rejected"] += 1
+        else:
+            counts["skipped"] += 1
+    save_approvals(path, entries)
+    return counts
+
+
+def import_approvals(path: str, cache) -> int:
+    """Переносит одобренные планы в кэш планов: следующий прогон cached-only их исполнит."""
+    entries = load_approvals(path)
+    imported = 0
+    for e in entries:
+        if e.get("status") == "approved" and e.get("key"):
+            cache.put(e["key"], StepPlan.model_validate(e["plan"]))
+            e["status"] = "imported"
+            imported += 1
+    if imported:
+        save_approvals(path, entries)
+    return imported
@@ -0,0 +1,165 @@
+from __future__ import annotations
+import os, re, json, math, html as html_lib
+from collections import Counter
+from typing import Dict, Any, List, Tuple
+
+# === Конфиг бюджета промпта ===
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+PROMPT_TOP_K = int(os.getenv("PROMPT_TOP_K", "60"))
+PROMPT_FRAGMENTS = int(os.getenv("PROMPT_FRAGMENTS", "12"))
+FRAGMENT_RADIUS = int(os.getenv("PROMPT_FRAGMENT_RADIUS", "400"))  # символов вокруг элемента
+# Если страница та же, что на прошлом шаге, и изменилось не больше PROMPT_DIFF_MAX_ITEMS
+# элементов — шлём дифф и сокращённую выборку под меньший бюджет
+PROMPT_DIFF_MAX_ITEMS = int(os.getenv("PROMPT_DIFF_MAX_ITEMS", "40"))
+PROMPT_DIFF_BUDGET = int(os.getenv("PROMPT_DIFF_BUDGET", "2500"))
+PROMPT_DIFF_TOP_K = int(os.getenv("PROMPT_DIFF_TOP_K", "20"))
+
+# Доля бюджета под инвентарь; остаток — HTML-фрагменты
+_INVENTORY_SHARE = 0.5
+CHARS_PER_TOKEN = 3.5
+_WORD_RE = re.compile(r"[0-9a-zа-яё]+", re.IGNORECASE)
+_BM25_K1 = 1.2
+_BM25_B = 0.75
+
+
+def estimate_tokens(s: str) -> int:
+    return tokens_for_chars(len(s or ""))
+
+
+def tokens_for_chars(chars: float) -> int:
+    # Грубая оценка без токенайзера: ~CHARS_PER_TOKEN символа на токен для смеси кириллицы и HTML
+    return int(chars / CHARS_PER_TOKEN) + 1
+
+
+def _stem(word: str) -> str:
+    # Примитивный стемминг: русские словоформы («реестр», «реестра») сводим к префиксу
+    return word[:5] if len(word) > 5 else word
+
+
+def tokenize(text: str) -> List[str]:
+    return [_stem(w) for w in _WORD_RE.findall((text or "").lower()) if len(w) > 1]
+
+
+def _item_document(e: Dict[str, Any]) -> str:
+    parts = [
+        e.get("text"), e.get("name"), e.get("label"), e.get("placeholder"),
+        e.get("id"), e.get("testid"), e.get("role"), e.get("tag"),
+    ]
+    return " ".join(p for p in parts if p)
+
+
+def rank_inventory(inventory: List[Dict[str, Any]], query: str) -> List[Tuple[float, int]]:
+    """BM25 по текстовым полям элементов. Возвращает (score, индекс) по убыванию score."""
+    docs = [tokenize(_item_document(e)) for e in inventory]
+    q_terms = set(tokenize(query))
+    if not docs:
+        return []
+    n = len(docs)
+    avg_len = sum(len(d) for d in docs) / n or 1.0
+    df = Counter()
+    for d in docs:
+        df.update(set(d) & q_terms)
+    idf = {t: math.log(1 + (n - df[t] + 0.5) / (df[t] + 0.5)) for t in q_terms if df[t]}
+    scored = []
+    for i, (e, d) in enumerate(zip(inventory, docs)):
+        score = 0.0
+        if idf:
+            tf = Counter(t for t in d if t in idf)
+            norm = _BM25_K1 * (1 - _BM25_B + _BM25_B * len(d) / avg_len)
+            for t, f in tf.items():
+                score += idf[t] * f * (_BM25_K1 + 1) / (f + norm)
+        # Небольшой бонус стабильно адресуемым элементам: при равенстве они полезнее
+        if e.get("testid"):
+            score += 0.3
+        elif e.get("id") or e.get("role"):
+            score += 0.1
+        scored.append((score, i))
+    scored.sort(key=lambda x: (-x[0], x[1]))
+    return scored
+
+
+def _anchors(e: Dict[str, Any]) -> List[str]:
+    out = []
+    if e.get("testid"):
+        out.append(f'data-testid="{html_lib.escape(e["testid"])}"')
+    if e.get("id"):
+        out.append(f'id="{html_lib.escape(e["id"])}"')
+    if e.get("placeholder"):
+        out.append(f'placeholder="{html_lib.escape(e["placeholder"])}"')
+    text = (e.get("text") or "").strip()
+    if text:
+        out.append(html_lib.escape(text[:40], quote=False))
+    return out
+
+
+def html_fragments(body_html: str, items: List[Dict[str, Any]], radius: int = FRAGMENT_RADIUS) -> List[Tuple[int, int]]:
+    """Окна [start, end) вокруг элементов в body_html, слитые при пересечении, в порядке документа."""
+    spans = []
+    for e in items:
+        for anchor in _anchors(e):
+            pos = body_html.find(anchor)
+            if pos >= 0:
+                spans.append((max(0, pos - radius), min(len(body_html), pos + len(anchor) + radius)))
+                break
+    spans.sort()
+    merged: List[Tuple[int, int]] = []
+    for s, e in spans:
+        if merged and s <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+        else:
+            merged.append((s, e))
+    return merged
+
+
+def select_context(
+    body_html: str,
+    inventory: List[Dict[str, Any]],
+    query: str,
+    shrink,
+    budget_tokens: int = PROMPT_TOKEN_BUDGET,
+    top_k: int = PROMPT_TOP_K,
+) -> Tuple[List[Dict[str, Any]], str, Dict[str, int]]:
+    """Отбирает под бюджет токенов самые релевантные шагу элементы и HTML вокруг них.
+
+    shrink — функция сжатия записей инвентаря (planner._shrink_inventory).
+    Возвращает (инвентарь для промпта, HTML-фрагменты, статистику).
+    """
+    ranked = rank_inventory(inventory, query)
+    inv_budget = int(budget_tokens * _INVENTORY_SHARE)
+    chosen: List[int] = []
+    used = 0
+    for _, idx in ranked[:top_k]:
+        cost = estimate_tokens(json.dumps(shrink([inventory[idx]]), ensure_ascii=False))
+        if used + cost > inv_budget and chosen:
+            break
+        chosen.append(idx)
+        used += cost
+    # В промпт — в порядке документа, чтобы модель видела структуру страницы
+    top_items = [inventory[i] for i in sorted(chosen)]
+
+    html_part = ""
+    if body_html:
+        html_budget_chars = int((budget_tokens - used) * CHARS_PER_TOKEN)
+        best = [inventory[i] for i in chosen[:PROMPT_FRAGMENTS]]
+        pieces = []
+        total = 0
+        for s, e in html_fragments(body_html, best):
+            piece = body_html[s:e]
+            if total + len(piece) > html_budget_chars:
+                piece = piece[: max(0, html_budget_chars - total)]
+            if not piece:
+                break
+            pieces.append(piece)
+            total += len(piece)
+        if not pieces and html_budget_chars > 0:
+            # Якоря не нашлись (например, текст с entity) — отдадим начало body
+            pieces.append(body_html[:html_budget_chars])
+        html_part = "\n...\n".join(pieces)
+
+    stats = {
+        "inventory_total": len(inventory),
+        "inventory_sent": len(top_items),
+        "html_total_chars": len(body_html or ""),
+        "html_sent_chars": len(html_part),
+    }
+    return shrink(top_items, max_items=len(top_items)), html_part, stats
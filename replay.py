@@ -0,0 +1,212 @@
+from __future__ import annotations
+import json
+import time
+from typing import Dict, Any, List, Tuple
+
+from models import StepPlan, Selector, Instruction, Expectation
+from executor import execute_step, _ROLE_RE
+
+# Бандл: версионированный JSON одобренных планов. Replay исполняет его без LangGraph,
+# DOM-инвентаря и LLM; агенту отдаются только упавшие шаги.
+BUNDLE_VERSION = 1
+
+
+# === Бандл ===
+def compile_bundle(executed: List[Tuple[Dict[str, Any], StepPlan]], base_url: str | None = None, name: str = "") -> Dict[str, Any]:
+    return {
+        "version": BUNDLE_VERSION,
+        "name": name,
+        "createdAt": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "baseUrl": base_url,
+        "steps": [
+            {
+                "step": {k: step.get(k) for k in ("id", "dano", "do", "result", "raw")},
+                "plan": plan.model_dump(by_alias=True, exclude_none=True),
+            }
+            for step, plan in executed
+        ],
+    }
+
+
+def save_bundle(path: str, bundle: Dict[str, Any]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(bundle, f, ensure_ascii=False, indent=2)
+
+
+def load_bundle(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        bundle = json.load(f)
+    if bundle.get("version") != BUNDLE_VERSION:
+        raise ValueError(f"Неподдерживаемая версия бандла: {bundle.get('version')} (ожидается {BUNDLE_VERSION})")
+    return bundle
+
+
+# === Генерация Playwright-скрипта ===
+def _locator_code(sel: Selector) -> str:
+    v = sel.value
+    if sel.type == "testid":
+        return f"page.get_by_test_id({v!r})"
+    if sel.type == "role":
+        m = _ROLE_RE.match(v)
+        if m:
+            role, _, name = m.groups()
+            return f"page.get_by_role({role.lower()!r}, name={name!r})" if name else f"page.get_by_role({role.lower()!r})"
+        return f"page.locator({f'[role={chr(34)}{v}{chr(34)}]'!r})"
+    if sel.type == "label":
+        return f"page.get_by_label({v!r})"
+    if sel.type == "placeholder":
+        return f"page.get_by_placeholder({v!r})"
+    if sel.type == "text":
+        return f"page.get_by_text({v!r})"
+    if sel.type == "id":
+        ident = v[1:] if v.startswith("#") else v
+        return f"page.locator({f'[id={chr(34)}{ident}{chr(34)}]'!r})"
+    return f"page.locator({v!r})"
+
+
+def _instruction_code(ins: Instruction) -> List[str]:
+    out = []
+    loc = f"{_locator_code(ins.target.selector)}.first" if ins.target else None
+    if ins.action == "navigate" and ins.url:
+        wait_until = ins.wait.for_ if ins.wait else "domcontentloaded"
+        return [f"await page.goto({ins.url!r}, wait_until={wait_until!r})"] + _wait_code(ins.waitAfter)
+    if ins.action != "waitForURL":
+        out += _wait_code(ins.wait)
+    if ins.action == "click" and loc:
+        out.append(f"await {loc}.click()")
+    elif ins.action == "fill" and loc:
+        out.append(f"await {loc}.fill({(ins.value or '')!r})")
+    elif ins.action in ("waitForSelector", "assertVisible") and loc:
+        out.append(f"await expect({loc}).to_be_visible()")
+    elif ins.action == "waitForURL" and (ins.url or ins.value):
+        out.append(f"await page.wait_for_url(lambda u: {(ins.url or ins.value)!r} in u, wait_until=\"commit\")")
+        out += _wait_code(ins.wait)
+    elif ins.action == "assertText" and ins.value is not None:
+        out.append(f"await expect({loc or 'page.locator(' + repr('body') + ')'}).to_contain_text({ins.value!r})")
+    return out + _wait_code(ins.waitAfter)
+
+
+def _wait_code(spec) -> List[str]:
+    if not spec:
+        return []
+    return [f"await page.wait_for_load_state({spec.for_!r}, timeout={spec.timeoutMs})"]
+
+
+def _expectation_code(exp: Expectation) -> List[str]:
+    if exp.kind == "urlIncludes" and exp.value:
+        return [f"await page.wait_for_url(lambda u: {exp.value!r} in u, wait_until=\"commit\")"]
+    if exp.kind == "elementVisible" and exp.selector:
+        return [f"await expect({_locator_code(exp.selector)}.first).to_be_visible()"]
+    if exp.kind == "assertText" and exp.value:
+        loc = f"{_locator_code(exp.selector)}.first" if exp.selector else "page.locator('body')"
+        return [f"await expect({loc}).to_contain_text({exp.value!r})"]
+    return []
+
+
+def generate_playwright_script(bundle: Dict[str, Any]) -> str:
+    """Самостоятельный async-скрипт Playwright, эквивалентный бандлу."""
+    body: List[str] = []
+    if bundle.get("baseUrl"):
+        body.append(f"await page.goto({bundle['baseUrl']!r})")
+    for entry in bundle["steps"]:
+        plan = StepPlan.model_validate(entry["plan"])
+        body.append("")
+        body.append(f"# Шаг {plan.stepId}: {plan.title}".replace("\n", " "))
+        for ins in plan.instructions:
+            body += _instruction_code(ins)
+        for exp in plan.expects:
+            body += _expectation_code(exp)
+    indent = " " * 8
+    lines = [
+        f"# Сгенерировано из бандла {bundle.get('name') or ''} ({bundle.get('createdAt')}), версия {bundle['version']}",
+        "import asyncio",
+        "from playwright.async_api import async_playwright, expect",
+        "",
+        "",
+        "async def main():",
+        "    async with async_playwright() as p:",
+        "        browser = await p.chromium.launch(headless=True)",
+        "        page = await browser.new_page()",
+        *[(indent + line) if line else "" for line in body],
+        "        await browser.close()",
+        "",
+        "",
+        "if __name__ == \"__main__\":",
+        "    asyncio.run(main())",
+        "",
+    ]
+    return "\n".join(lines)
+
+
+# === Прогон бандла ===
+async def run_replay(
+    bundle: Dict[str, Any],
+    driver,
+    cache=None,
+    policy=None,
+    fallback: bool = True,
+    case_name: str = "",
+) -> Tuple[Dict[str, Any], bool]:
+    """Исполняет бандл. Упавший шаг (при fallback) перепланируется агентом.
+
+    Возвращает (отчёт в формате run_test, изменился ли бандл) — бандл обновляется на месте:
+    сработавшие альтернативные и вылеченные селекторы, новые планы от агента.
+    """
+    started = time.monotonic()
+    entries = bundle["steps"]
+    steps = [e["step"] for e in entries]
+    report = {
+        "name": case_name or bundle.get("name") or "",
+        "ok": False,
+        "steps_total": len(entries),
+        "steps_passed": 0,
+        "failed_step": None,
+        "pending_approvals": 0,
+        "errors": [],
+        "duration_s": 0.0,
+        "replayed": 0,
+        "agent_fallbacks": 0,
+    }
+    changed = False
+    graph = None
+    if bundle.get("baseUrl"):
+        await driver.page.goto(bundle["baseUrl"])
+
+    for i, entry in enumerate(entries):
+        plan = StepPlan.model_validate(entry["plan"])
+        before = plan.model_dump(by_alias=True, exclude_none=True)
+        res = await execute_step(driver, plan, snapshot=False)
+        if res.ok:
+            report["replayed"] += 1
+            print(f"[replay] шаг {plan.stepId}: OK")
+        elif fallback:
+            print(f"[replay] шаг {plan.stepId}: {res.errors[0].message if res.errors else 'FAIL'} — передаём агенту")
+            report["agent_fallbacks"] += 1
+            if graph is None:
+                # Агент нужен только для упавших шагов — импортируем лениво
+                from graph import build_graph
+                graph = build_graph(driver, cache, lookahead=1, policy=policy).compile()
+            state = {
+                "steps": steps, "current_idx": i, "user_hints": None,
+                "need_replan": False, "case_name": report["name"],
+            }
+            state = await graph.ainvoke(state)
+            res = state["exec_result"]
+            if state.get("pending_approval"):
+                report["pending_approvals"] += 1
+            if res.ok:
+                plan = state["plan"]
+        after = plan.model_dump(by_alias=True, exclude_none=True)
+        if res.ok and after != before:
+            entry["plan"] = after
+            changed = True
+        if not res.ok:
+            # Номер шага — int, как в отчётах run_test и набора
+            report["failed_step"] = int(steps[i]["id"])
+            report["errors"].extend(f"[{e.code}] {e.message}" for e in res.errors)
+            break
+        report["steps_passed"] += 1
+
+    report["ok"] = report["failed_step"] is None
+    report["duration_s"] = round(time.monotonic() - started, 3)
+    return report, changed
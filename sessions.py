@@ -0,0 +1,103 @@
+from __future__ import annotations
+import os, re, json, time, asyncio
+from fnmatch import fnmatchcase
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+
+# === Конфиг сессий ===
+SESSIONS_DIR = os.getenv("SESSIONS_DIR", ".qa_cache/sessions")
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(8 * 3600)))  # секунды, 0 = без TTL
+# URL, на которых оказывается разлогиненный пользователь
+SESSION_LOGOUT_PATTERNS = os.getenv("SESSION_LOGOUT_PATTERNS", "*/login*,*/signin*,*/sign-in*,*/auth/*")
+SETUP_CASE_STEM = "_setup"  # файл набора с этим именем — setup-кейс сессии, а не тест
+
+_NAME_RE = re.compile(r"[^0-9A-Za-z._-]+")
+
+
+class SessionStore:
+    """Именованные storage state (cookies + localStorage) на диске, с TTL."""
+
+    def __init__(self, root: str = SESSIONS_DIR, ttl: int = SESSION_TTL, logout_patterns: Optional[List[str]] = None):
+        self._root = root
+        self._ttl = ttl
+        self._logout = logout_patterns if logout_patterns is not None else [
+            p.strip() for p in SESSION_LOGOUT_PATTERNS.split(",") if p.strip()
+        ]
+
+    def path(self, name: str) -> str:
+        return os.path.join(self._root, f"{_NAME_RE.sub('_', name)}.json")
+
+    def load(self, name: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.path(name), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self._ttl and time.time() - entry.get("created_at", 0) > self._ttl:
+            self.invalidate(name)
+            return None
+        return entry.get("storage_state")
+
+    def save(self, name: str, storage_state: Dict[str, Any]) -> None:
+        os.makedirs(self._root, exist_ok=True)
+        path = self.path(name)
+        tmp = path + ".tmp"
+        # В файле живые cookies — читать его должен только владелец
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"name": name, "created_at": time.time(), "storage_state": storage_state}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def invalidate(self, name: str) -> None:
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def looks_logged_out(self, url: Optional[str]) -> bool:
+        return bool(url) and any(fnmatchcase(url.lower(), p) for p in self._logout)
+
+
+class Session:
+    """Именованная сессия: сохранённый storage state и setup-кейс, который его создаёт.
+
+    setup — корутина без аргументов, возвращающая storage state или None. При параллельных
+    вызовах setup прогоняется один раз; упавший setup повторно не запускается.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        setup: Optional[Callable[[], Awaitable[Optional[Dict[str, Any]]]]] = None,
+        store: Optional[SessionStore] = None,
+    ):
+        self.name = name
+        self.store = store or SessionStore()
+        self._setup = setup
+        self._state: Optional[Dict[str, Any]] = None
+        self._failed = False
+        self._lock = asyncio.Lock()
+
+    async def state(self) -> Optional[Dict[str, Any]]:
+        async with self._lock:
+            if self._state is None and not self._failed:
+                self._state = self.store.load(self.name)
+                if self._state is None and self._setup is not None:
+                    print(f"[session] {self.name}: сохранённой сессии нет, прогоняем setup-кейс")
+                    self._state = await self._setup()
+                    if self._state is not None:
+                        self.store.save(self.name, self._state)
+                        print(f"[session] {self.name}: сессия сохранена")
+                self._failed = self._state is None
+            return self._state
+
+    async def refresh(self, stale: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Сессия оказалась разлогиненной: выбрасываем её и создаём заново (один раз на всех)."""
+        async with self._lock:
+            if self._state is stale and self._state is not None:
+                print(f"[session] {self.name}: сессия устарела, пересоздаём")
+                self.store.invalidate(self.name)
+                self._state = None
+        return await self.state()
+
+    def logged_out(self, url: Optional[str]) -> bool:
+        return self.store.looks_logged_out(url)
@@ -0,0 +1,167 @@
+from __future__ import annotations
+import os
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Iterator
+
+# Куда выгружать спаны прогона: JSON lines и Chrome trace (chrome://tracing, Perfetto)
+TRACE_PATH = os.getenv("TRACE_PATH")
+TRACE_CHROME_PATH = os.getenv("TRACE_CHROME_PATH")
+
+# Числовые атрибуты, которые суммируются в сводной таблице
+SUMMARY_COUNTERS = (
+    "context_tokens", "prompt_tokens", "completion_tokens", "llm_attempts", "llm_queue_ms", "rate_limited",
+    "plan_format_errors", "html_chars", "inventory_items",
+)
+
+
+@dataclass(slots=True)
+class Span:
+    name: str
+    case: str
+    start: float
+    parent: Optional[str] = None
+    dur: float = 0.0
+    attrs: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "case": self.case,
+            "name": self.name,
+            "parent": self.parent,
+            "start_ms": round(self.start * 1000, 3),
+            "dur_ms": round(self.dur * 1000, 3),
+            **self.attrs,
+        }
+
+
+class Tracer:
+    """Собирает спаны прогона. Один трейсер может обслуживать несколько тест-кейсов набора."""
+
+    def __init__(self, jsonl_path: Optional[str] = TRACE_PATH, chrome_path: Optional[str] = TRACE_CHROME_PATH):
+        self.jsonl_path = jsonl_path
+        self.chrome_path = chrome_path
+        self.spans: List[Span] = []
+        self._t0 = time.perf_counter()
+
+    def now(self) -> float:
+        return time.perf_counter() - self._t0
+
+    def summary(self, case: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        rows: Dict[str, Dict[str, Any]] = {}
+        for s in self.spans:
+            if case is not None and s.case != case:
+                continue
+            row = rows.setdefault(s.name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            ms = s.dur * 1000
+            row["count"] += 1
+            row["total_ms"] += ms
+            row["max_ms"] = max(row["max_ms"], ms)
+            for key in SUMMARY_COUNTERS:
+                if isinstance(s.attrs.get(key), (int, float)):
+                    row[key] = row.get(key, 0) + s.attrs[key]
+        return rows
+
+    def summary_table(self, case: Optional[str] = None) -> str:
+        rows = self.summary(case)
+        if not rows:
+            return "(спанов нет)"
+        extra = [k for k in SUMMARY_COUNTERS if any(k in r for r in rows.values())]
+        header = f"{'спан':<28}{'кол-во':>8}{'всего, мс':>12}{'сред., мс':>12}{'макс., мс':>12}"
+        header += "".join(f"{k:>{max(len(k) + 2, 10)}}" for k in extra)
+        lines = [header, "-" * len(header)]
+        for name, r in sorted(rows.items(), key=lambda kv: -kv[1]["total_ms"]):
+            line = (
+                f"{name:<28}{r['count']:>8}{r['total_ms']:>12.1f}"
+                f"{r['total_ms'] / r['count']:>12.1f}{r['max_ms']:>12.1f}"
+            )
+            line += "".join(f"{r.get(k, ''):>{max(len(k) + 2, 10)}}" for k in extra)
+            lines.append(line)
+        return "\n".join(lines)
+
+    def write_jsonl(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for s in self.spans:
+                f.write(json.dumps(s.to_dict(), ensure_ascii=False, default=str) + "\n")
+
+    def write_chrome_trace(self, path: str) -> None:
+        # Каждый тест-кейс — отдельный поток на таймлайне
+        tids: Dict[str, int] = {}
+        events = []
+        for s in self.spans:
+            if s.case not in tids:
+                tids[s.case] = len(tids) + 1
+                events.append({
+                    "name": "thread_name", "ph": "M", "pid": 1, "tid": tids[s.case],
+                    "args": {"name": s.case or "main"},
+                })
+            events.append({
+                "name": s.name, "cat": s.name.split(".")[0], "ph": "X", "pid": 1, "tid": tids[s.case],
+                "ts": round(s.start * 1e6), "dur": round(s.dur * 1e6),
+                "args": {k: v for k, v in s.attrs.items() if isinstance(v, (str, int, float, bool))},
+            })
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+
+    def export(self) -> None:
+        if self.jsonl_path:
+            self.write_jsonl(self.jsonl_path)
+            print(f"Трейс (JSONL) сохранён: {self.jsonl_path}")
+        if self.chrome_path:
+            self.write_chrome_trace(self.chrome_path)
+            print(f"Трейс (Chrome) сохранён: {self.chrome_path}")
+
+
+_tracer: ContextVar[Optional[Tracer]] = ContextVar("qa_tracer", default=None)
+_case: ContextVar[str] = ContextVar("qa_trace_case", default="")
+_current: ContextVar[Optional[Span]] = ContextVar("qa_trace_span", default=None)
+
+
+@contextmanager
+def bind(tracer: Tracer, case: str = "") -> Iterator[Tracer]:
+    """Делает трейсер текущим для этой задачи asyncio (и порождённых ею задач)."""
+    t_token, c_token = _tracer.set(tracer), _case.set(case)
+    try:
+        yield tracer
+    finally:
+        _tracer.reset(t_token)
+        _case.reset(c_token)
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Optional[Span]]:
+    """Замер участка кода. Без активного трейсера ничего не делает."""
+    tracer = _tracer.get()
+    if tracer is None:
+        yield None
+        return
+    parent = _current.get()
+    s = Span(name=name, case=_case.get(), start=tracer.now(), parent=parent.name if parent else None, attrs=attrs)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        s.dur = tracer.now() - s.start
+        _current.reset(token)
+        tracer.spans.append(s)
+
+
+def annotate(**attrs: Any) -> None:
+    """Добавляет атрибуты текущему спану."""
+    s = _current.get()
+    if s is not None:
+        s.attrs.update(attrs)
+
+
+def add(**counters: float) -> None:
+    """Прибавляет значения к числовым атрибутам текущего спана."""
+    s = _current.get()
+    if s is not None:
+        for k, v in counters.items():
+            s.attrs[k] = s.attrs.get(k, 0) + v
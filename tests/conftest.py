@@ -0,0 +1,30 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# Модули проекта лежат в корне репозитория, без пакета
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def _chromium_launches() -> bool:
+    from playwright.async_api import async_playwright
+
+    play = await async_playwright().start()
+    try:
+        browser = await play.chromium.launch(headless=True)
+    except Exception:
+        return False
+    else:
+        await browser.close()
+        return True
+    finally:
+        await play.stop()
+
+
+@pytest.fixture(scope="session")
+def chromium():
+    """Пропускает тест, если Chromium для Playwright не установлен."""
+    if not asyncio.run(_chromium_launches()):
+        pytest.skip("Chromium не запускается (python -m playwright install chromium)")
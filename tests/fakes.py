@@ -0,0 +1,159 @@
+"""Минимальные заглушки Playwright для тестов драйвера и исполнителя без браузера.
+
+Элементы страницы — словарь "тип:значение" → обработчик клика (или None).
+"""
+import asyncio
+
+
+class FakeLocator:
+    def __init__(self, page, key, *more):
+        self.page = page
+        self.key = key
+        self.keys = (key, *more)
+
+    @property
+    def first(self):
+        return self
+
+    def or_(self, other):
+        return FakeLocator(self.page, *self.keys, *other.keys)
+
+    async def wait_for(self, state="visible", timeout=0):
+        # Элемент может появиться позже: page.elements меняется из теста
+        self.page.waits.append((self.keys, timeout))
+        deadline = asyncio.get_running_loop().time() + timeout / 1000
+        while not any(k in self.page.elements for k in self.keys):
+            if asyncio.get_running_loop().time() >= deadline:
+                raise TimeoutError(f"{self.key} не найден за {timeout} мс")
+            await asyncio.sleep(0.005)
+
+    async def count(self):
+        return sum(k in self.page.elements for k in self.keys)
+
+    async def click(self, timeout=0):
+        self.page.log.append(("click", self.key))
+        handler = self.page.elements.get(self.key)
+        if handler:
+            await handler(self.page)
+
+    async def fill(self, value, timeout=0):
+        self.page.log.append(("fill", self.key, value))
+
+    async def evaluate(self, js, arg=None, timeout=0):
+        # Только проверка перед кликом: открывает ли цель новую вкладку
+        return [self.key in self.page.blank_targets, self.page.window_opens]
+
+
+class FakePage:
+    _ids = 0
+
+    def __init__(self, context, elements=None):
+        FakePage._ids += 1
+        self.id = FakePage._ids
+        self.context = context
+        self.url = "about:blank"
+        self.elements = dict(elements or {})
+        self.log = []
+        self.waits = []
+        self._handlers = {}
+        self._doc = 0
+        self.version = 0  # счётчик мутаций DOM: тест увеличивает его вместе с изменением elements
+        self.closed = False
+        self.window_opens = 0  # сколько раз страница вызвала window.open
+        self.blank_targets = set()  # элементы с target="_blank"
+
+    def on(self, event, fn):
+        self._handlers[event] = fn
+
+    async def goto(self, url, **kw):
+        await asyncio.sleep(0.01)
+        self.url = url
+        self._doc += 1
+        self.context.requests.append(url)
+
+    async def evaluate(self, js, *args):
+        if "__qaWindowOpens" in js:
+            return self.window_opens
+        return [f"doc{self.id}-{self._doc}", self.version]
+
+    async def content(self):
+        items = "".join(f"<button data-testid=\"{k.split(':', 1)[1]}\">x</button>" for k in self.elements)
+        return f"<html><body>{items}</body></html>"
+
+    async def title(self):
+        return f"page{self.id}"
+
+    async def wait_for_load_state(self, *args, **kw):
+        pass
+
+    async def wait_for_url(self, predicate, timeout=0, **kw):
+        if not predicate(self.url):
+            raise TimeoutError(f"URL {self.url}")
+
+    async def close(self):
+        self.closed = True
+        if "close" in self._handlers:
+            self._handlers["close"](self)
+
+    def get_by_test_id(self, v):
+        return FakeLocator(self, f"testid:{v}")
+
+    def get_by_text(self, v):
+        return FakeLocator(self, f"text:{v}")
+
+    def get_by_placeholder(self, v):
+        return FakeLocator(self, f"placeholder:{v}")
+
+    def get_by_label(self, v):
+        return FakeLocator(self, f"label:{v}")
+
+    def get_by_role(self, role, name=None):
+        return FakeLocator(self, f"role:{role}[name=\"{name}\"]" if name else f"role:{role}")
+
+    def locator(self, v):
+        return FakeLocator(self, f"css:{v}")
+
+
+class FakeContext:
+    def __init__(self, elements=None):
+        self._handlers = {"page": []}
+        self.cookie_jar = []
+        self.requests = []
+        self.elements = elements or {}
+
+    def on(self, event, fn):
+        self._handlers.setdefault(event, []).append(fn)
+
+    def remove_listener(self, event, fn):
+        self._handlers[event].remove(fn)
+
+    async def new_page(self):
+        page = FakePage(self, self.elements)
+        for fn in list(self._handlers["page"]):
+            fn(page)
+        return page
+
+    async def cookies(self):
+        return list(self.cookie_jar)
+
+    async def add_init_script(self, script):
+        pass
+
+    async def route(self, *args, **kw):
+        pass
+
+    async def storage_state(self):
+        return {"cookies": list(self.cookie_jar), "origins": []}
+
+    async def close(self):
+        pass
+
+
+class FakeBrowser:
+    def __init__(self, elements=None):
+        self.elements = elements
+        self.storage_states = []  # storage_state каждого созданного контекста
+
+    async def new_context(self, storage_state=None, **kw):
+        self.storage_states.append(storage_state)
+        return FakeContext(self.elements)
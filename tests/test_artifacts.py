@@ -0,0 +1,39 @@
+import os
+import time
+
+from artifacts import ArtifactStore
+
+
+def _age(store, ref, days):
+    t = time.time() - days * 86400
+    os.utime(store.path(ref), (t, t))
+
+
+def test_prune_by_age_keeps_rewritten(tmp_path):
+    store = ArtifactStore(str(tmp_path), codec="gzip")
+    old, reused, fresh = store.put("старый"), store.put("повторный"), store.put("новый")
+    _age(store, old, 10)
+    _age(store, reused, 10)
+    # Повторная запись того же содержимого продлевает жизнь артефакта
+    store.put("повторный")
+    size = os.path.getsize(store.path(old))
+    assert store.prune(max_age_days=7, max_mb=0) == (1, size)
+    assert store.path(old) is None
+    assert store.path(reused) and store.path(fresh)
+
+
+def test_prune_by_size_drops_oldest_first(tmp_path):
+    store = ArtifactStore(str(tmp_path), codec="gzip")
+    refs = [store.put(os.urandom(64 * 1024).hex()) for _ in range(4)]
+    for days, ref in zip((4, 3, 2, 1), refs):
+        _age(store, ref, days)
+    per_file = os.path.getsize(store.path(refs[0]))
+    removed, _ = store.prune(max_age_days=0, max_mb=2.5 * per_file / 1024 / 1024)
+    assert removed == 2
+    assert [store.path(r) is not None for r in refs] == [False, False, True, True]
+    # Удалённый артефакт читается как пустой, из памяти — по-прежнему
+    assert ArtifactStore(str(tmp_path)).text(refs[0]) == ""
+
+
+def test_prune_missing_dir(tmp_path):
+    assert ArtifactStore(str(tmp_path / "nope")).prune() == (0, 0)
@@ -0,0 +1,90 @@
+import argparse
+import asyncio
+import inspect
+import json
+
+import pytest
+
+import graph
+import main
+import planner
+from benchmarks import bench_run
+from context import PlaywrightDriver
+from models import StepPlan
+from parser import parse_test_case
+from plan_wire import to_wire
+
+
+@pytest.fixture
+def stub_llm(monkeypatch):
+    # bench_run подменяет глобальные настройки и попытки LLM — вернём их после теста
+    monkeypatch.setattr(planner, "_call_llm_attempt", planner._call_llm_attempt)
+    monkeypatch.setattr(planner, "_acall_llm_attempt", planner._acall_llm_attempt)
+    for name in ("PLAN_CACHE_ENABLED", "CHECKPOINTS_ENABLED", "BASE_URL"):
+        monkeypatch.setattr(main, name, getattr(main, name))
+    bench_run.install_stub_llm()
+
+
+def _form():
+    scenario = bench_run.load_scenarios("http://127.0.0.1:1", ["form"])["form"]
+    bench_run._recorded.clear()
+    bench_run._recorded.update({k: to_wire(StepPlan.model_validate(p)) for k, p in scenario["plans"].items()})
+    return scenario
+
+
+def test_stub_answers_real_prompts(stub_llm):
+    # Регулярки стаба должны находить stepId и список шагов в настоящих промптах планировщика
+    scenario = _form()
+    steps = parse_test_case(scenario["test"])
+
+    async def run():
+        plan = await planner.aplan_step_llm(
+            step_id="2", step_title=steps[1]["raw"][:80], action=steps[1]["do"], result=steps[1]["result"],
+            url="http://127.0.0.1:1/form", title="Вход", body_html="", dom_inventory=[],
+        )
+        assert [ins.value for ins in plan.instructions] == ["qa", "secret"]
+        plans = await planner.aplan_steps_llm_batch(
+            steps=steps, url="http://127.0.0.1:1/form", title="Вход", body_html="", dom_inventory=[],
+        )
+        assert [p.stepId for p in plans] == ["1", "2", "3"]
+        assert plans[2].instructions[0].target.selector.value == "submit"
+    asyncio.run(run())
+
+
+def test_stage_spans_exist():
+    # Этапы бенчмарка — имена спанов, которые реально открывает код
+    sources = "".join(inspect.getsource(m) for m in (planner, PlaywrightDriver))
+    for stage in ("snapshot", "inventory", "prompt", "llm"):
+        assert f'span("{bench_run.STAGES[stage]}"' in sources
+    nodes = graph.build_graph(None, None).nodes
+    for stage in ("plan", "execute"):
+        assert bench_run.STAGES[stage].split(".", 1)[1] in nodes
+
+
+def test_form_scenario_smoke(chromium, stub_llm):
+    args = argparse.Namespace(
+        scenario=["form"], registry_nodes=200, spa_nodes=200, repeat=1, warmup=0, verbose=False,
+    )
+    result = asyncio.run(bench_run.run(args))["scenarios"]["form"]
+    assert result["ok"], result["errors"]
+    assert all(result["stages"][stage] > 0 for stage in bench_run.STAGES)
+    assert result["prompt_tokens"] > 0
+
+
+def test_offline_stages_compare_with_baseline():
+    offline = bench_run.run_offline(bench_run.fixture_pages(200, 200), repeat=1)
+    assert set(offline) == {"form", "registry", "spa"}
+    assert offline["form"]["inventory_items"] > 0 and offline["form"]["prompt_tokens"] > 0
+    current = {"offline": offline, "scenarios": {}}
+    assert bench_run.compare(current, current, 0.15, 5.0) == []
+    # Рост промпта — регрессия даже на быстрой машине; лишний этап без baseline — нет
+    grown = {"offline": {**offline, "form": {**offline["form"], "prompt_tokens": offline["form"]["prompt_tokens"] * 2}}}
+    regressions = bench_run.compare({**grown, "scenarios": {}}, {"offline": {"form": offline["form"]}}, 0.15, 5.0)
+    assert len(regressions) == 1 and regressions[0].startswith("offline.form.prompt_tokens")
+
+
+def test_committed_baseline_is_comparable():
+    with open(bench_run.BASELINE_PATH, encoding="utf-8") as f:
+        baseline = json.load(f)
+    assert set(baseline["offline"]) == {"form", "registry", "spa"}
+    assert baseline["sizes"] == {"registry_nodes": 10_000, "spa_nodes": 100_000}
@@ -0,0 +1,146 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+pytest.importorskip("langgraph.checkpoint.sqlite")
+
+import graph
+import main
+from artifacts import ArtifactStore
+from checkpoints import open_checkpointer, run_thread_id
+from dom_tools import InventoryItem
+from models import StepPlan, ExecResult, ExecError
+from parser import parse_test_case
+from policy import RunPolicy
+from telemetry import Tracer
+
+CASE = (
+    "1. Что сделать: Открыть реестр. Результат: Реестр открыт\n"
+    "2. Что сделать: Создать документ. Результат: Документ создан\n"
+    "3. Что сделать: Открыть документ. Результат: Карточка открыта"
+)
+POLICY = RunPolicy(approval="auto", on_error="fail-fast")
+
+
+class _Page:
+    url = "about:blank"
+
+    async def goto(self, url, **kw):
+        self.url = url
+
+
+class _Context:
+    async def storage_state(self):
+        return {"cookies": [{"name": "sid", "value": "1"}], "origins": []}
+
+
+class FakeDriver:
+    def __init__(self, tmp_path):
+        self.page = _Page()
+        self.context = _Context()
+        self.artifacts = ArtifactStore(str(tmp_path / "artifacts"))
+        self.restarts = []
+
+    async def restart(self, storage_state=None):
+        self.restarts.append(storage_state)
+
+    async def snapshot(self, since=None):
+        return {
+            "url": self.page.url, "title": "t", "bodyRef": None, "tabs": 1,
+            "inventory": [InventoryItem(tag="button", testid=f"b{i}") for i in range(50)],
+            "diff": None,
+        }
+
+
+@pytest.fixture
+def fake_steps(monkeypatch):
+    calls = {"planned": [], "executed": [], "fail": set()}
+
+    async def plan(**kw):
+        calls["planned"].append(kw["step_id"])
+        return StepPlan.model_validate({
+            "stepId": kw["step_id"], "title": "t",
+            "instructions": [{"action": "click", "target": {"selector": {"type": "testid", "value": "b1"}}}],
+        })
+
+    async def execute(driver, plan, heal_inventory=None, snapshot=True):
+        calls["executed"].append(plan.stepId)
+        driver.page.url = f"https://app.test/p{plan.stepId}"
+        ok = plan.stepId not in calls["fail"]
+        return ExecResult(ok=ok, url=driver.page.url, errors=[] if ok else [ExecError(code="x", message="boom")])
+
+    monkeypatch.setattr(graph, "aplan_step_llm", plan)
+    monkeypatch.setattr(graph, "execute_step", execute)
+    monkeypatch.setattr(main, "PLAN_CACHE_ENABLED", False)
+    monkeypatch.setattr(main, "BASE_URL", None)
+    return calls
+
+
+def _run(driver, checkpointer, resume=False):
+    return main.run_test(
+        CASE, driver=driver, case_name="case", policy=POLICY, tracer=Tracer(None, None),
+        checkpointer=checkpointer, resume=resume,
+    )
+
+
+def test_sqlite_run_and_resume(tmp_path, fake_steps):
+    path = str(tmp_path / "checkpoints.sqlite")
+
+    async def run():
+        fake_steps["fail"].add("2")
+        async with open_checkpointer(path, required=True) as saver:
+            report = await _run(FakeDriver(tmp_path), saver)
+        assert (report["ok"], report["steps_passed"], report["failed_step"]) == (False, 1, 2)
+
+        fake_steps["fail"].clear()
+        fake_steps["planned"].clear()
+        driver = FakeDriver(tmp_path)
+        # Новое соединение с тем же файлом — как новый процесс после падения
+        async with open_checkpointer(path, required=True) as saver:
+            report = await _run(driver, saver, resume=True)
+        assert report["ok"] and report["steps_passed"] == 3
+        assert fake_steps["planned"] == ["2", "3"]
+        assert driver.restarts == [{"cookies": [{"name": "sid", "value": "1"}], "origins": []}]
+        assert driver.page.url == "https://app.test/p3"
+
+        fake_steps["planned"].clear()
+        async with open_checkpointer(path, required=True) as saver:
+            report = await _run(FakeDriver(tmp_path), saver)
+        # Без --resume поток начинается заново
+        assert fake_steps["planned"] == ["1", "2", "3"]
+    asyncio.run(run())
+
+
+def test_checkpoint_per_step_without_inventory(tmp_path, fake_steps):
+    path = str(tmp_path / "checkpoints.sqlite")
+
+    async def run():
+        async with open_checkpointer(path, required=True) as saver:
+            await _run(FakeDriver(tmp_path), saver)
+            config = {"configurable": {"thread_id": run_thread_id("case", parse_test_case(CASE))}}
+            checkpoints = [c async for c in saver.alist(config)]
+            state = (await saver.aget_tuple(config)).checkpoint["channel_values"]
+        assert len(checkpoints) == 3  # один на шаг, а не на каждый узел графа
+        assert "inventory" not in state and "last_snapshot" not in state
+        assert [h["idx"] for h in state["history"]] == [0, 1, 2]
+    asyncio.run(run())
+    db = sqlite3.connect(path)
+    blobs = b"".join(row[0] for row in db.execute("select checkpoint from checkpoints"))
+    assert b"InventoryItem" not in blobs and b"b49" not in blobs
+
+
+def test_setup_case_opens_no_checkpointer(tmp_path, fake_steps, monkeypatch):
+    monkeypatch.setattr(main, "CHECKPOINTS_ENABLED", True)
+
+    def _forbidden(*a, **kw):
+        raise AssertionError("setup-кейс не должен открывать свой чекпоинтер")
+    monkeypatch.setattr(main, "open_checkpointer", _forbidden)
+
+    async def run():
+        report = await main.run_test(
+            CASE, driver=FakeDriver(tmp_path), case_name="setup:s", policy=POLICY,
+            tracer=Tracer(None, None), checkpoints=False,
+        )
+        assert report["ok"]
+    asyncio.run(run())
@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+import pytest
+
+import executor
+from artifacts import ArtifactStore
+from context import PlaywrightDriver
+from dom_tools import build_dom_inventory
+from executor import execute_step
+from healing import find_origin, heal_selector
+from models import Selector, StepPlan
+from fakes import FakeBrowser
+
+
+def _role(value):
+    return Selector(type="role", value=value)
+
+
+def test_role_selector_needs_matching_name():
+    inventory = [
+        {"role": "button", "tag": "button"},
+        {"role": "button", "name": "Сохранить", "testid": "save"},
+    ]
+    # Безымянная кнопка раньше совпадала с любым role-селектором с именем
+    assert find_origin(_role('button[name="Сохранить"]'), inventory)["testid"] == "save"
+    assert find_origin(_role("button[name=Сохранить]"), inventory)["testid"] == "save"
+    assert find_origin(_role('button[name="Сохр"]'), inventory).get("testid") is None
+    assert find_origin(_role("button"), inventory).get("testid") is None
+
+
+def test_heal_selector_picks_renamed_testid():
+    css = ["form > button.primary"]
+    old = [{"testid": "save", "tag": "button", "text": "Сохранить", "role": "button", "cssCandidates": css}]
+    new = [
+        {"testid": "cancel", "tag": "button", "text": "Отмена", "role": "button"},
+        {"testid": "save-v2", "tag": "button", "text": "Сохранить", "role": "button", "cssCandidates": css},
+    ]
+    sel, score = heal_selector(Selector(type="testid", value="save"), old, new)
+    assert sel == Selector(type="testid", value="save-v2")
+    assert score >= 0.6
+
+
+def _plan():
+    return StepPlan.model_validate({
+        "stepId": "1", "title": "t",
+        "instructions": [{"action": "click", "target": {"selector": {"type": "testid", "value": "save"}}}],
+    })
+
+
+@pytest.fixture
+def driver(tmp_path, monkeypatch):
+    monkeypatch.setattr(executor, "SELECTOR_PROBE_MS", 100)
+    monkeypatch.setattr(executor, "ACTION_TIMEOUT_MS", 5000)
+    return PlaywrightDriver(browser=FakeBrowser({"testid:save-v2": None}), artifacts=ArtifactStore(str(tmp_path)))
+
+
+def test_heal_starts_after_short_probe(driver, monkeypatch):
+    monkeypatch.setattr(executor, "heal_selector", lambda *a: (Selector(type="testid", value="save-v2"), 0.9))
+
+    async def run():
+        await driver.start()
+        plan = _plan()
+        t0 = time.monotonic()
+        res = await execute_step(driver, plan, heal_inventory=[], snapshot=False)
+        assert res.ok, res.errors
+        assert time.monotonic() - t0 < 1.0
+        assert plan.instructions[0].target.selector.value == "save-v2"
+        assert ("click", "testid:save-v2") in driver.page.log
+    asyncio.run(run())
+
+
+def test_full_wait_when_nothing_to_heal(driver, monkeypatch):
+    monkeypatch.setattr(executor, "heal_selector", lambda *a: None)
+
+    async def run():
+        await driver.start()
+
+        async def appear():
+            await asyncio.sleep(0.3)
+            driver.page.elements["testid:save"] = None
+        asyncio.get_running_loop().create_task(appear())
+        res = await execute_step(driver, _plan(), heal_inventory=[], snapshot=False)
+        assert res.ok, res.errors
+        assert ("click", "testid:save") in driver.page.log
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("wrap", ['<div id="app">{}</div>', '<form data-testid="f">{}</form>'])
+def test_renamed_button_does_not_heal_to_container(wrap):
+    def page(label):
+        return build_dom_inventory(wrap.format(f'<input placeholder="Имя"><button class="btn-primary">{label}</button>'))
+
+    failed = Selector(type="text", value="Сохранить")
+    # Текст обёртки тот же, что у кнопки, но исходным элементом считается кнопка
+    assert find_origin(failed, page("Сохранить"))["tag"] == "button"
+    healed = heal_selector(failed, page("Сохранить"), page("Записать"))
+    assert healed is not None
+    assert healed[0] not in (Selector(type="id", value="app"), Selector(type="testid", value="f"))
+    assert healed[0] == Selector(type="text", value="Записать")
@@ -0,0 +1,108 @@
+import asyncio
+import time
+from email.utils import formatdate
+
+from load_profile import HttpCache, LoadProfile, freshness, install, storable
+
+
+def test_freshness_from_headers():
+    now = time.time()
+    assert freshness({"cache-control": "public, max-age=600"}) == 600
+    assert freshness({"cache-control": "max-age=600, s-maxage=60"}) == 60
+    assert freshness({"cache-control": "max-age=600", "age": "100"}) == 500
+    assert freshness({"cache-control": "no-cache, max-age=600"}) == 0
+    assert 3590 < freshness({"date": formatdate(now, usegmt=True), "expires": formatdate(now + 3600, usegmt=True)}) <= 3600
+    assert freshness({"expires": "0"}) == 0
+    # Эвристика: 10% возраста Last-Modified, но не больше предела
+    modified = {"date": formatdate(now, usegmt=True), "last-modified": formatdate(now - 1000, usegmt=True)}
+    assert 99 <= freshness(modified, heuristic_cap=3600) <= 100
+    assert freshness(modified, heuristic_cap=30) == 30
+    assert freshness({}) == 0
+
+
+def test_storable():
+    assert storable({"cache-control": "max-age=60", "vary": "Accept-Encoding"})
+    assert not storable({"cache-control": "no-store"})
+    assert not storable({"cache-control": "private, max-age=60"})
+    assert not storable({"cache-control": "max-age=60", "vary": "Accept-Language"})
+    assert not storable({"vary": "*"})
+
+
+def test_stale_entry_needs_validators():
+    cache = HttpCache(":memory:")
+    assert cache.put("https://cdn/app.js", 200, {"cache-control": "max-age=60", "content-length": "3"}, b"abc")
+    assert cache.get("https://cdn/app.js") == (200, {"cache-control": "max-age=60"}, b"abc")
+    # Без срока свежести и без валидаторов хранить незачем
+    assert not cache.put("https://cdn/no-ttl.js", 200, {}, b"x")
+    assert cache.put("https://cdn/etag.js", 200, {"cache-control": "no-cache", "etag": '"v1"'}, b"x")
+    assert cache.get("https://cdn/etag.js") is None
+    assert cache.validators("https://cdn/etag.js") == {"if-none-match": '"v1"'}
+    status, headers, body = cache.revalidate("https://cdn/etag.js", {"cache-control": "max-age=60"})
+    assert (status, body, headers["etag"]) == (200, b"x", '"v1"')
+    assert cache.get("https://cdn/etag.js") is not None
+
+
+class _Request:
+    method = "GET"
+    resource_type = "script"
+
+    def __init__(self, url):
+        self.url = url
+        self.headers = {"accept": "*/*"}
+
+
+class _Response:
+    def __init__(self, status, headers, body=b""):
+        self.status = status
+        self.headers = headers
+        self._body = body
+
+    async def body(self):
+        return self._body
+
+
+class _Route:
+    def __init__(self, url, server):
+        self.request = _Request(url)
+        self.server = server
+        self.fulfilled = None
+
+    async def fetch(self, headers=None):
+        return self.server(headers or {})
+
+    async def fulfill(self, response=None, status=None, headers=None, body=None):
+        self.fulfilled = (response.status if response else status, body)
+
+    async def continue_(self):
+        self.fulfilled = ("continue", None)
+
+
+class _Context:
+    async def add_init_script(self, script):
+        pass
+
+    async def route(self, pattern, handler):
+        self.handler = handler
+
+
+def test_route_revalidates_with_etag():
+    requests = []
+
+    def server(headers):
+        requests.append(headers.get("if-none-match"))
+        if headers.get("if-none-match") == '"v1"':
+            return _Response(304, {"etag": '"v1"'})
+        return _Response(200, {"etag": '"v1"', "cache-control": "no-cache"}, b"console.log(1)")
+
+    async def run():
+        ctx = _Context()
+        cache = HttpCache(":memory:")
+        await install(ctx, LoadProfile(name="full"), cache)
+        for _ in range(2):
+            route = _Route("https://cdn/app.js", server)
+            await ctx.handler(route)
+            assert route.fulfilled == (200, b"console.log(1)")
+        # Второй раз — условный запрос и тело из кэша
+        assert requests == [None, '"v1"']
+        assert cache.stats["revalidated"] == 1
+    asyncio.run(run())
@@ -0,0 +1,65 @@
+import asyncio
+
+from playwright.async_api import async_playwright
+
+from dom_tools import INVENTORY_JS, build_snapshot, inventory_from_records
+
+PAGE = """<html><body><form data-testid="login" class="form-main">
+<label for="u">Логин</label><input id="u" placeholder="логин" class="inp-text">
+<label>Пароль <input type="password" name="p"></label>
+<button class="btn-primary" data-testid="go">Войти</button>
+<a href="/help" id="help">Помощь</a>
+<div role="alert">Ошибка</div>
+</form></body></html>"""
+
+# Что INVENTORY_JS возвращает для PAGE (bbox не важен)
+RECORDS = [
+    {"tag": "form", "id": None, "role": None, "testid": "login", "placeholder": None, "label": None,
+     "text": "Логин Пароль Войти Помощь Ошибка", "name": "Логин Пароль Войти Помощь Ошибка", "cls": "form-main"},
+    {"tag": "label", "id": None, "role": None, "testid": None, "placeholder": None, "label": None,
+     "text": "Логин", "name": "Логин", "cls": ""},
+    {"tag": "input", "id": "u", "role": "textbox", "testid": None, "placeholder": "логин", "label": "Логин",
+     "text": "", "name": "Логин", "cls": "inp-text"},
+    {"tag": "label", "id": None, "role": None, "testid": None, "placeholder": None, "label": None,
+     "text": "Пароль", "name": "Пароль", "cls": ""},
+    {"tag": "input", "id": None, "role": "textbox", "testid": None, "placeholder": None, "label": "Пароль",
+     "text": "", "name": "Пароль", "cls": ""},
+    {"tag": "button", "id": None, "role": "button", "testid": "go", "placeholder": None, "label": None,
+     "text": "Войти", "name": "Войти", "cls": "btn-primary"},
+    {"tag": "a", "id": "help", "role": "link", "testid": None, "placeholder": None, "label": None,
+     "text": "Помощь", "name": "Помощь", "cls": ""},
+    {"tag": "div", "id": None, "role": "alert", "testid": None, "placeholder": None, "label": None,
+     "text": "Ошибка", "name": "Ошибка", "cls": ""},
+]
+
+
+def _common(items):
+    # Роли и имена браузер вычисляет сам (неявные роли, доступное имя) — в HTML-режиме их нет.
+    # Текст сравниваем без пробелов: innerText разделяет блоки, разбор HTML склеивает
+    return [
+        (e.tag, e.id, e.testid, e.placeholder, e.label, "".join(e.text.split()), e.cssCandidates)
+        for e in items
+    ]
+
+
+def test_records_match_html_inventory():
+    items = inventory_from_records(RECORDS)
+    assert _common(items) == _common(build_snapshot(PAGE)[1])
+    by_tag = {e.tag: e for e in items}
+    assert by_tag["button"].name == "Войти" and by_tag["a"].role == "link"
+    assert inventory_from_records(None) == []
+
+
+def test_browser_inventory_matches_html(chromium):
+    async def run():
+        async with async_playwright() as play:
+            browser = await play.chromium.launch(headless=True)
+            try:
+                page = await browser.new_page()
+                await page.set_content(PAGE)
+                return await page.evaluate(INVENTORY_JS, 100)
+            finally:
+                await browser.close()
+    records = asyncio.run(run())
+    assert _common(inventory_from_records(records)) == _common(build_snapshot(PAGE)[1])
+    assert [r["role"] for r in records] == [r["role"] for r in RECORDS]
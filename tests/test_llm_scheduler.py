@@ -0,0 +1,142 @@
+import asyncio
+import time
+
+import httpx
+import openai
+import pytest
+
+import llm_scheduler
+from llm_scheduler import (
+    PRIORITY_BACKGROUND, PRIORITY_CRITICAL, LlmScheduler, TokenBucket, call_sync, llm_background, llm_priority,
+)
+
+_REQUEST = httpx.Request("POST", "http://llm.test/v1/chat/completions")
+
+
+def _rate_limited(retry_after="0"):
+    resp = httpx.Response(429, headers={"retry-after": retry_after}, request=_REQUEST)
+    return openai.RateLimitError("rate limited", response=resp, body=None)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(llm_scheduler, "_backoff", lambda attempt: 0.0)
+
+
+def test_token_bucket_refills_evenly():
+    bucket = TokenBucket(60)
+    assert bucket.delay(1) == 0
+    bucket.take(60)
+    assert 0.9 < bucket.delay(1) <= 1.0
+    assert TokenBucket(0).delay(10 ** 6) == 0
+
+
+def test_identical_requests_share_one_call():
+    calls = []
+
+    async def send():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "{}"
+
+    async def run():
+        sched = LlmScheduler()
+        msgs = [{"role": "user", "content": "шаг 1"}]
+        results = await asyncio.gather(*(sched.call(msgs, send, "m") for _ in range(3)))
+        assert results == ["{}"] * 3
+        assert len(calls) == 1 and sched.stats["coalesced"] == 2
+        # Завершённый запрос не кэшируется: следующий идёт к модели
+        await sched.call(msgs, send, "m")
+        assert len(calls) == 2
+    asyncio.run(run())
+
+
+def test_rpm_limit_spaces_requests():
+    async def send():
+        return "{}"
+
+    async def run():
+        sched = LlmScheduler(rpm=600)  # 10 в секунду, ведро на 600
+        sched._requests.take(600)
+        t0 = time.monotonic()
+        await asyncio.gather(*(sched.call([{"role": "user", "content": str(i)}], send) for i in range(3)))
+        assert time.monotonic() - t0 >= 0.25
+    asyncio.run(run())
+
+
+def test_priority_order_after_pause():
+    order = []
+
+    async def run():
+        sched = LlmScheduler()
+        sched._pause_until = time.monotonic() + 0.1
+
+        async def ask(name, priority):
+            async def send():
+                order.append(name)
+                return name
+            with llm_priority(priority):
+                return await sched.call([{"role": "user", "content": name}], send)
+
+        await asyncio.gather(ask("lookahead", PRIORITY_BACKGROUND), ask("step", 1), ask("setup", PRIORITY_CRITICAL))
+    asyncio.run(run())
+    assert order == ["setup", "step", "lookahead"]
+
+
+def test_retries_and_rate_limit_pause():
+    attempts = []
+
+    async def send():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise openai.APIConnectionError(request=_REQUEST)
+        if len(attempts) == 2:
+            raise _rate_limited()
+        return "ok"
+
+    async def run():
+        sched = LlmScheduler()
+        assert await sched.call([{"role": "user", "content": "x"}], send) == "ok"
+        assert sched.stats["retries"] == 2 and sched.stats["rate_limited"] == 1
+    asyncio.run(run())
+
+
+def test_non_retryable_error_raises_at_once():
+    attempts = []
+
+    async def send():
+        attempts.append(1)
+        raise openai.BadRequestError("bad", response=httpx.Response(400, request=_REQUEST), body=None)
+
+    with pytest.raises(openai.BadRequestError):
+        asyncio.run(LlmScheduler().call([{"role": "user", "content": "x"}], send))
+    assert len(attempts) == 1
+
+
+def test_sync_path_uses_same_retry_policy(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(llm_scheduler.time, "sleep", sleeps.append)
+    attempts = []
+
+    def send():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise _rate_limited("2")
+        return "ok"
+
+    assert call_sync(send) == "ok"
+    assert sleeps == [2.0, 2.0]
+
+    def broken():
+        raise openai.APIConnectionError(request=_REQUEST)
+
+    with pytest.raises(openai.APIConnectionError):
+        call_sync(broken)
+    assert len(sleeps) == 2 + llm_scheduler.LLM_MAX_ATTEMPTS - 1
+
+
+def test_background_does_not_demote_critical():
+    with llm_background():
+        assert llm_scheduler._priority.get() == PRIORITY_BACKGROUND
+    with llm_priority(PRIORITY_CRITICAL), llm_background():
+        assert llm_scheduler._priority.get() == PRIORITY_CRITICAL
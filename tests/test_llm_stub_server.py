@@ -0,0 +1,149 @@
+"""Асинхронный планировщик против локального OpenAI-совместимого стаб-сервера."""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import llm_scheduler
+import planner
+from plan_wire import to_wire
+from models import StepPlan
+
+PLAN = StepPlan.model_validate({
+    "stepId": "1", "title": "t",
+    "instructions": [{"action": "click", "target": {"selector": {"type": "testid", "value": "save"}}}],
+    "expects": [{"kind": "elementVisible", "selector": {"type": "testid", "value": "saved"}}],
+})
+
+
+class StubServer:
+    def __init__(self, delay=0.0, fail_first=0):
+        self.delay = delay
+        self.fail_first = fail_first
+        self.requests = []
+        self.connections = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive: клиент должен переиспользовать соединение
+
+            def setup(self):
+                super().setup()
+                stub.connections += 1
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stub.requests.append(body)
+                time.sleep(stub.delay)
+                if len(stub.requests) <= stub.fail_first:
+                    return self._send(503, {"error": {"message": "перегружен"}})
+                self._send(200, {
+                    "id": "stub", "object": "chat.completion", "created": 0, "model": body["model"],
+                    "choices": [{
+                        "index": 0, "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": json.dumps(to_wire(PLAN))},
+                    }],
+                    "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+                })
+
+            def _send(self, status, payload):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    servers = []
+
+    def start(**kw):
+        server = StubServer(**kw)
+        servers.append(server)
+        monkeypatch.setattr(planner, "OPENAI_BASE_URL", server.url)
+        monkeypatch.setattr(planner, "OPENAI_API_KEY", None)
+        monkeypatch.setattr(planner, "_aclient", None)
+        monkeypatch.setattr(llm_scheduler, "_backoff", lambda attempt: 0.0)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+async def _plan(step_id="1"):
+    return await planner.aplan_step_llm(
+        step_id=step_id, step_title="Сохранить", action="Нажать «Сохранить»", result="Сохранено",
+        url="http://app.test/form", title="Форма", body_html="<button data-testid=save>Сохранить</button>",
+        dom_inventory=[{"tag": "button", "testid": "save", "text": "Сохранить"}],
+    )
+
+
+def test_plan_through_stub_server(stub):
+    server = stub()
+
+    async def run():
+        try:
+            plan = await _plan()
+            await _plan("2")
+        finally:
+            await planner.aclose_llm_client()
+        assert plan.instructions[0].target.selector.value == "save"
+        assert plan.expects[0].selector.value == "saved"
+    asyncio.run(run())
+    assert len(server.requests) == 2
+    assert server.requests[0]["response_format"]["type"] == "json_schema"
+    # Пул соединений клиента: оба запроса — по одному keep-alive соединению
+    assert server.connections == 1
+
+
+def test_event_loop_runs_during_planning(stub):
+    stub(delay=0.3)
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.02)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        try:
+            await _plan()
+        finally:
+            task.cancel()
+            await planner.aclose_llm_client()
+        # Пока модель «думает», другие корутины (браузер, соседние кейсы) продолжают работать
+        assert ticks >= 5
+    asyncio.run(run())
+
+
+def test_server_errors_are_retried(stub):
+    server = stub(fail_first=1)
+
+    async def run():
+        try:
+            plan = await _plan()
+        finally:
+            await planner.aclose_llm_client()
+        assert plan.stepId == "1"
+    asyncio.run(run())
+    assert len(server.requests) == 2
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+import graph
+from artifacts import ArtifactStore
+from models import ExecError, ExecResult, StepPlan
+
+STEPS = [{"id": str(i), "raw": f"Шаг {i}", "dano": "", "do": f"Нажать {i}", "result": "ок"} for i in (1, 2, 3)]
+
+
+def _plan(step_id):
+    return StepPlan.model_validate({
+        "stepId": step_id, "title": "t",
+        "instructions": [{"action": "click", "target": {"selector": {"type": "testid", "value": f"b{step_id}"}}}],
+    })
+
+
+class _Driver:
+    def __init__(self, tmp_path):
+        self.artifacts = ArtifactStore(str(tmp_path))
+
+
+@pytest.fixture
+def batches(monkeypatch):
+    calls = []
+
+    async def batch(steps, **kw):
+        calls.append([s["id"] for s in steps])
+        return [_plan(s["id"]) for s in steps]
+    monkeypatch.setattr(graph, "aplan_steps_llm_batch", batch)
+    return calls
+
+
+def _state(idx, inventory_ids):
+    return {
+        "steps": STEPS, "current_idx": idx,
+        "last_snapshot": {"url": "https://app.test/", "title": "App", "bodyRef": None},
+        "inventory": [{"tag": "button", "testid": f"b{i}"} for i in inventory_ids],
+    }
+
+
+def _plan_step(state, driver):
+    return asyncio.run(graph.node_plan(state, driver, None, lookahead=3))
+
+
+def test_queued_plan_used_when_page_matches(tmp_path, batches):
+    driver = _Driver(tmp_path)
+    state = _plan_step(_state(0, [1]), driver)
+    assert state["plan"].stepId == "1"
+    assert [p.stepId for p in state["plan_queue"]] == ["2", "3"]
+
+    state.update(current_idx=1, inventory=[{"tag": "button", "testid": "b2"}])
+    state = _plan_step(state, driver)
+    assert state["plan"].stepId == "2" and [p.stepId for p in state["plan_queue"]] == ["3"]
+    assert batches == [["1", "2", "3"]]
+
+
+def test_queue_replanned_when_target_missing(tmp_path, batches):
+    driver = _Driver(tmp_path)
+    state = _plan_step(_state(0, [1]), driver)
+    # Цели шага 2 на странице нет: пакет устарел, планируем заново с шага 2
+    state.update(current_idx=1, inventory=[{"tag": "button", "testid": "other"}])
+    state = _plan_step(state, driver)
+    assert batches == [["1", "2", "3"], ["2", "3"]]
+    assert [p.stepId for p in state["plan_queue"]] == ["3"]
+
+
+def test_failed_step_drops_queue(tmp_path, batches, monkeypatch):
+    driver = _Driver(tmp_path)
+    state = _plan_step(_state(0, [1, 2, 3]), driver)
+
+    async def fail(driver, plan, heal_inventory=None):
+        return ExecResult(ok=False, errors=[ExecError(code="timeout", message="b1 не найден")])
+    monkeypatch.setattr(graph, "execute_step", fail)
+    state = asyncio.run(graph.node_execute(state, driver))
+    assert state["plan_queue"] == []
+
+    # Даже если цели следующего шага на странице есть, план шага 2 — новый
+    state["current_idx"] = 1
+    state = _plan_step(state, driver)
+    assert batches == [["1", "2", "3"], ["2", "3"]]
@@ -0,0 +1,52 @@
+import main
+from parser import iter_test_cases, parse_test_case, split_sections
+from sessions import SETUP_CASE_STEM
+
+SUITE = """\
+Тест-кейс: Вход
+Дано: открыта страница входа
+1. Что сделать: ввести логин
+Результат: логин введён
+2. Что сделать: нажать «Войти»
+Ожидаемый результат: открыт кабинет
+---
+3. ДЕЙСТВИЕ: выйти
+РЕЗУЛЬТАТ: открыта страница входа
+"""
+
+
+def test_split_sections():
+    assert split_sections("Дано: форма Что сделать: нажать Результат: ок") == {
+        "dano": "форма", "do": "нажать", "result": "ок",
+    }
+    assert split_sections("ОЖИДАЕМЫЙ РЕЗУЛЬТАТ: ок\nДЕЙСТВИЕ: нажать")["result"] == "ок"
+    assert split_sections("просто нажать кнопку") == {"dano": "", "do": "просто нажать кнопку", "result": ""}
+
+
+def test_iter_test_cases_splits_cases_and_carries_preamble():
+    cases = list(iter_test_cases(SUITE.splitlines(True)))
+    assert [c["name"] for c in cases] == ["Вход", ""]
+    first, second = cases
+    assert [s["id"] for s in first["steps"]] == ["1", "2"]
+    # «Дано» кейса подставляется только первому шагу
+    assert first["steps"][0]["dano"] == "открыта страница входа"
+    assert first["steps"][1]["dano"] == ""
+    assert first["steps"][1]["result"] == "открыт кабинет"
+    assert second["steps"][0]["do"] == "выйти"
+    assert parse_test_case(SUITE) == first["steps"]
+    assert parse_test_case("нет шагов") == []
+
+
+def test_suite_names_cases_and_skips_setup(tmp_path):
+    (tmp_path / "login.txt").write_text(SUITE, encoding="utf-8")
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "nested" / "one.md").write_text("1. Открыть главную\n", encoding="utf-8")
+    (tmp_path / "empty.txt").write_text("без шагов\n", encoding="utf-8")
+    (tmp_path / f"{SETUP_CASE_STEM}.txt").write_text("1. Войти\n", encoding="utf-8")
+    (tmp_path / "notes.json").write_text("{}", encoding="utf-8")
+
+    files = main._collect_suite(str(tmp_path))
+    assert [p.name for p in files] == ["empty.txt", "login.txt", "one.md"]
+    cases = [(name, len(steps)) for name, steps, error in main._iter_suite_cases(str(tmp_path), files)]
+    assert cases == [("empty.txt", 0), ("login.txt::Вход", 2), ("login.txt::#2", 1), ("nested/one.md", 1)]
+    assert main._suite_setup_case(str(tmp_path)).name == f"{SETUP_CASE_STEM}.txt"
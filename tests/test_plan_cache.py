@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+import graph
+from models import ExecResult, Instruction, StepPlan
+from plan_cache import PlanCache, normalize_url, plan_cache_key
+
+STEP = {"dano": "Открыта форма", "do": "Нажать  «Сохранить»", "result": "Сохранено"}
+INVENTORY = [
+    {"tag": "button", "testid": "save", "text": "Сохранить"},
+    {"tag": "span", "id": "clock", "text": "12:00"},
+]
+
+
+def _plan(step_id="1"):
+    return StepPlan.model_validate({"stepId": step_id, "title": "t", "instructions": [], "expects": []})
+
+
+def test_key_ignores_formatting_and_dynamic_text():
+    key = plan_cache_key(STEP, "https://App.test/form/#top", INVENTORY)
+    same = {"dano": " открыта   форма ", "do": "нажать «сохранить»\n", "result": "СОХРАНЕНО"}
+    assert plan_cache_key(same, "https://app.test/form", INVENTORY) == key
+    # Текст элементов (время, счётчики) в ключ не входит
+    ticking = [dict(INVENTORY[0]), {**INVENTORY[1], "text": "12:01"}]
+    assert plan_cache_key(STEP, "https://app.test/form", ticking) == key
+
+
+def test_key_follows_structure_url_and_step():
+    key = plan_cache_key(STEP, "https://app.test/form", INVENTORY)
+    renamed = [{**INVENTORY[0], "testid": "submit"}, INVENTORY[1]]
+    assert plan_cache_key(STEP, "https://app.test/form", renamed) != key
+    assert plan_cache_key(STEP, "https://app.test/form", INVENTORY[:1]) != key
+    assert plan_cache_key(STEP, "https://app.test/form?id=2", INVENTORY) != key
+    assert plan_cache_key({**STEP, "result": "Ошибка"}, "https://app.test/form", INVENTORY) != key
+    assert normalize_url(None) == "" and normalize_url("https://app.test") == "https://app.test/"
+
+
+def test_put_get_invalidate():
+    cache = PlanCache(":memory:")
+    assert cache.get("k") is None
+    cache.put("k", _plan("7"))
+    assert cache.get("k").stepId == "7"
+    cache.invalidate("k")
+    assert cache.get("k") is None
+    assert cache.stats == {"hits": 1, "misses": 2, "stores": 1, "invalidations": 1, "evictions": 0}
+
+
+def test_ttl_expires_entries(tmp_path):
+    cache = PlanCache(str(tmp_path / "plans.sqlite"), ttl=60)
+    cache.put("k", _plan())
+    cache._db.execute("UPDATE plans SET created_at = ?", (time.time() - 120,))
+    assert cache.get("k") is None and len(cache) == 0
+    assert cache.stats["evictions"] == 1
+
+
+def test_lru_evicts_least_recently_used():
+    cache = PlanCache(":memory:", ttl=0, max_entries=2)
+    cache.put("a", _plan())
+    cache.put("b", _plan())
+    cache._db.execute("UPDATE plans SET last_used = last_used - 10")
+    cache.get("a")  # «a» свежее «b»
+    cache.put("c", _plan())
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") and cache.get("c")
+
+
+def test_reuse_keeps_age_and_counts_hits():
+    cache = PlanCache(":memory:", ttl=60)
+    cache.put("k", _plan())
+    cache._db.execute("UPDATE plans SET created_at = created_at - 50")
+    for _ in range(3):
+        cache.get("k")
+    # Повторная запись (вылеченный селектор) не продлевает TTL и не сбрасывает попадания
+    cache.put("k", _plan("2"))
+    created, hits = cache._db.execute("SELECT created_at, hits FROM plans").fetchone()
+    assert hits == 3 and time.time() - created >= 50
+    assert cache.get("k").stepId == "2"
+
+
+def test_cached_plan_not_rewritten_after_success(monkeypatch):
+    cache = PlanCache(":memory:")
+    cache.put("k", _plan())
+    puts = []
+    monkeypatch.setattr(cache, "put", lambda *a: puts.append(a))
+
+    async def execute(driver, plan, heal_inventory=None):
+        return ExecResult(ok=True)
+    monkeypatch.setattr(graph, "execute_step", execute)
+
+    plan = cache.get("k")
+    plan.instructions.append(Instruction(action="click", target={"selector": {"type": "testid", "value": "go"}}))
+    state = {"plan": plan, "plan_from_cache": True, "plan_cache_key": "k", "current_idx": 0}
+    asyncio.run(graph.node_execute(dict(state), None, cache))
+    assert puts == []
+
+    async def heal(driver, plan, heal_inventory=None):
+        plan.instructions[0].target.selector.value = "go-v2"
+        return ExecResult(ok=True)
+    monkeypatch.setattr(graph, "execute_step", heal)
+    asyncio.run(graph.node_execute(dict(state), None, cache))
+    assert [p.instructions[0].target.selector.value for _, p in puts] == ["go-v2"]
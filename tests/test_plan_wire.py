@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+from models import StepPlan
+from plan_wire import (
+    PlanFormatError, WireBatch, WirePlan, parse_batch, parse_plan, response_format, strict_schema, to_wire,
+)
+
+STEPS = [{"id": "1", "raw": "Открыть реестр"}, {"id": "2", "raw": "Открыть документ"}]
+
+
+def test_check_only_step_is_a_valid_plan():
+    plan = parse_plan('{"ins": [], "exp": [{"k":"urlIncludes","v":"/home","sel":null}]}', "1", "t")
+    assert plan.instructions == []
+    assert plan.expects[0].kind == "urlIncludes" and plan.expects[0].value == "/home"
+
+
+def test_plan_without_actions_and_checks_is_rejected():
+    with pytest.raises(PlanFormatError) as e:
+        parse_plan('{"ins": [], "exp": []}', "1", "t")
+    assert "оба пусты" in str(e.value)
+
+
+def test_errors_name_the_broken_fields():
+    raw = json.dumps({"ins": [
+        {"do": "click", "sel": []},
+        {"do": "fill", "sel": ["xpath://input"], "v": "x"},
+        {"do": "navigate", "sel": []},
+    ], "exp": [{"k": "elementVisible", "v": None, "sel": None}]})
+    with pytest.raises(PlanFormatError) as e:
+        parse_plan(raw, "1", "t")
+    assert e.value.raw == raw
+    assert any(err.startswith("ins.1.sel.0") for err in e.value.errors)
+    with pytest.raises(PlanFormatError) as e:
+        parse_plan(raw.replace("xpath://input", "placeholder:Логин"), "1", "t")
+    assert e.value.errors == [
+        "ins.0.sel: для click нужен селектор",
+        "ins.2.v: для navigate нужно значение",
+        "exp.0.sel: для elementVisible нужен селектор",
+    ]
+
+
+def test_invalid_json_is_an_error_not_an_empty_plan():
+    with pytest.raises(PlanFormatError):
+        parse_plan("не JSON", "1", "t")
+    with pytest.raises(PlanFormatError):
+        parse_plan('{"ins": [], "exp": [], "stepId": "1"}', "1", "t")
+
+
+def test_expand_and_to_wire_roundtrip():
+    plan = StepPlan.model_validate({
+        "stepId": "3", "title": "Войти",
+        "instructions": [
+            {"action": "navigate", "url": "https://app.test/login", "wait": {"for": "domcontentloaded", "timeoutMs": 5000}},
+            {"action": "fill", "target": {"selector": {"type": "placeholder", "value": "Пароль"}}, "value": "s", "masking": True},
+            {"action": "click", "target": {
+                "selector": {"type": "role", "value": 'button[name="Войти: сейчас"]'},
+                "alternatives": [{"type": "css", "value": "form button:nth-child(2)"}],
+            }, "waitAfter": {"for": "networkidle", "timeoutMs": 10000}},
+        ],
+        "expects": [{"kind": "assertText", "value": "Привет", "selector": {"type": "testid", "value": "hello"}}],
+    })
+    wire = json.dumps(to_wire(plan), ensure_ascii=False)
+    assert parse_plan(wire, "3", "Войти") == plan
+    assert len(wire) < len(plan.model_dump_json(by_alias=True))
+
+
+def test_batch_allows_empty_tail_but_not_empty_head():
+    plans = parse_batch(json.dumps({"plans": [
+        {"ins": [{"do": "navigate", "v": "https://app.test/"}], "exp": []},
+        {"ins": [], "exp": []},
+    ]}), STEPS)
+    assert [p.stepId for p in plans] == ["1", "2"]
+    assert plans[0].title == "Открыть реестр"
+    with pytest.raises(PlanFormatError):
+        parse_batch('{"plans": [{"ins": [], "exp": []}]}', STEPS)
+
+
+def test_strict_schema_requires_every_field():
+    def objects(node):
+        if isinstance(node, dict):
+            if "properties" in node:
+                yield node
+            for value in node.values():
+                yield from objects(value)
+        elif isinstance(node, list):
+            for value in node:
+                yield from objects(value)
+
+    for model in (WirePlan, WireBatch):
+        schema = strict_schema(model)
+        for obj in objects(schema):
+            assert obj["additionalProperties"] is False
+            assert obj["required"] == list(obj["properties"])
+        assert "default" not in json.dumps(schema)
+    fmt = response_format(WirePlan)
+    assert fmt["type"] in ("json_schema", "json_object")
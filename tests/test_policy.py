@@ -0,0 +1,90 @@
+import asyncio
+import builtins
+
+import graph
+import policy
+from models import StepPlan
+from plan_cache import PlanCache
+from policy import RunPolicy, import_approvals, load_approvals, review_approvals
+
+PLAN = StepPlan.model_validate({"stepId": "1", "title": "t", "instructions": [], "expects": []})
+
+
+def _state():
+    return {
+        "plan": PLAN, "current_idx": 0, "case_name": "login.txt",
+        "steps": [{"id": "1", "dano": "", "do": "Нажать «Войти»", "result": "Открыт кабинет"}],
+        "last_snapshot": {"url": "https://app.test/login", "title": "Вход"},
+        "plan_cache_key": "key-1",
+    }
+
+
+def _validate(state, approval, queue):
+    return asyncio.run(graph.node_validate(state, RunPolicy(approval=approval, approval_queue=str(queue))))
+
+
+def test_auto_runs_plan(tmp_path):
+    state = _validate(_state(), "auto", tmp_path / "q.jsonl")
+    assert not state["need_replan"] and not state["pending_approval"]
+    assert not (tmp_path / "q.jsonl").exists()
+
+
+def test_ask_rejection_replans_with_hints(tmp_path, monkeypatch):
+    monkeypatch.setattr(graph, "ask_approval", lambda plan: (False, "кнопка внизу"))
+    state = _validate(_state(), "ask", tmp_path / "q.jsonl")
+    assert state["need_replan"] and state["user_hints"] == "кнопка внизу"
+
+
+def test_cached_only_queues_and_stops(tmp_path):
+    queue = tmp_path / "q.jsonl"
+    state = _validate(_state(), "cached-only", queue)
+    assert state["pending_approval"]
+    assert state["exec_result"].errors[0].code == "pending_approval"
+    [entry] = load_approvals(str(queue))
+    assert (entry["status"], entry["key"], entry["case"], entry["url"]) == (
+        "pending", "key-1", "login.txt", "https://app.test/login",
+    )
+
+
+def test_review_then_import_into_cache(tmp_path, monkeypatch):
+    queue = tmp_path / "q.jsonl"
+    for key in ("k1", "k2", "k3"):
+        state = {**_state(), "plan_cache_key": key}
+        _validate(state, "cached-only", queue)
+    answers = iter(["y", "n", ""])
+    monkeypatch.setattr(builtins, "input", lambda prompt="": next(answers))
+    monkeypatch.setattr(policy, "print_plan", lambda plan: None)
+    assert review_approvals(str(queue)) == {"approved": 1, "rejected": 1, "skipped": 1}
+
+    cache = PlanCache(":memory:")
+    assert import_approvals(str(queue), cache) == 1
+    assert cache.get("k1").stepId == "1" and cache.get("k2") is None
+    assert [e["status"] for e in load_approvals(str(queue))] == ["imported", "rejected", "pending"]
+    # Повторный импорт ничего не переносит
+    assert import_approvals(str(queue), cache) == 0
+
+
+def test_suite_never_asks(capsys):
+    import main
+
+    policy = main._unattended_policy(RunPolicy(approval="ask", on_error="ask"))
+    assert (policy.approval, policy.on_error) == ("cached-only", "fail-fast")
+    assert "approval=ask" in capsys.readouterr().out
+    explicit = RunPolicy(approval="auto", on_error="continue")
+    assert main._unattended_policy(explicit) == explicit
+
+
+def test_queue_keeps_one_entry_per_key(tmp_path):
+    queue = tmp_path / "q.jsonl"
+    for _ in range(3):
+        _validate(_state(), "cached-only", queue)
+    assert [e["key"] for e in load_approvals(str(queue))] == ["key-1"]
+    # Отклонённый план можно предложить снова
+    entries = load_approvals(str(queue))
+    entries[0]["status"] = "rejected"
+    policy.save_approvals(str(queue), entries)
+    _validate(_state(), "cached-only", queue)
+    _validate({**_state(), "plan_cache_key": "key-2"}, "cached-only", queue)
+    assert [(e["key"], e["status"]) for e in load_approvals(str(queue))] == [
+        ("key-1", "rejected"), ("key-1", "pending"), ("key-2", "pending"),
+    ]
@@ -0,0 +1,90 @@
+import asyncio
+import importlib
+
+import pytest
+
+import context
+from artifacts import ArtifactStore
+from context import PlaywrightDriver
+from executor import execute_step
+from models import StepPlan
+from fakes import FakeBrowser
+
+
+def _plan(*instructions):
+    return StepPlan.model_validate({"stepId": "1", "title": "t", "instructions": list(instructions)})
+
+
+async def _driver(tmp_path, elements=None):
+    driver = PlaywrightDriver(browser=FakeBrowser(elements), artifacts=ArtifactStore(str(tmp_path)))
+    await driver.start()
+    return driver
+
+
+@pytest.fixture
+def prefetch_on(monkeypatch):
+    monkeypatch.setattr(context, "PREFETCH_ENABLED", True)
+
+
+def test_prefetch_off_by_default(tmp_path, monkeypatch):
+    monkeypatch.delenv("PREFETCH", raising=False)
+    assert importlib.reload(context).PREFETCH_ENABLED is False
+
+    async def run():
+        driver = await _driver(tmp_path)
+        await driver.prefetch("https://example.test/list")
+        assert driver._prefetch is None
+        assert driver.context.requests == []
+    asyncio.run(run())
+
+
+def test_navigate_takes_prefetched_page(tmp_path, prefetch_on):
+    async def run():
+        driver = await _driver(tmp_path)
+        first = driver.page
+        await driver.prefetch("https://example.test/list#top")
+        assert driver.page is first and driver.tabs == 1
+        res = await execute_step(driver, _plan({"action": "navigate", "url": "https://example.test/list"}))
+        assert res.ok, res.errors
+        assert "0. navigate: из prefetch" in res.logs
+        assert first.closed and driver.page.url == "https://example.test/list"
+        assert driver.context.requests == ["https://example.test/list"]
+    asyncio.run(run())
+
+
+def test_mutating_instruction_discards_prefetch(tmp_path, prefetch_on):
+    async def run():
+        driver = await _driver(tmp_path, {"testid:delete": None})
+        await driver.prefetch("https://example.test/list")
+        prefetched = driver._prefetch["page"]
+        await driver._prefetch["task"]
+        res = await execute_step(driver, _plan(
+            {"action": "click", "target": {"selector": {"type": "testid", "value": "delete"}}},
+            {"action": "navigate", "url": "https://example.test/list"},
+        ))
+        assert res.ok, res.errors
+        assert prefetched.closed
+        assert not any("из prefetch" in line for line in res.logs)
+        # Страница после удаления загружена заново, а не взята из загрузки до клика
+        assert driver.context.requests == ["https://example.test/list", "https://example.test/list"]
+    asyncio.run(run())
+
+
+def test_unused_prefetch_dropped_after_step(tmp_path, prefetch_on):
+    async def run():
+        driver = await _driver(tmp_path)
+        await driver.prefetch("https://example.test/other")
+        await execute_step(driver, _plan({"action": "assertText", "value": ""}), snapshot=False)
+        assert driver._prefetch is None
+    asyncio.run(run())
+
+
+def test_cookie_change_rejects_prefetch(tmp_path, prefetch_on):
+    async def run():
+        driver = await _driver(tmp_path)
+        await driver.prefetch("https://example.test/list")
+        await asyncio.sleep(0.05)
+        driver.context.cookie_jar.append({"name": "sid", "domain": "example.test", "path": "/", "value": "1"})
+        assert await driver.take_prefetched("https://example.test/list") is False
+        assert driver.tabs == 1
+    asyncio.run(run())
@@ -0,0 +1,35 @@
+import json
+
+import planner
+from prompt_budget import estimate_tokens
+
+
+def _page(n=200):
+    inventory = [
+        {"tag": "button", "text": f"Кнопка номер {i}", "testid": f"btn-{i}", "cssCandidates": [f"#b{i}"]}
+        for i in range(n)
+    ]
+    body = "".join(f'<div class="row"><button data-testid="btn-{i}">Кнопка номер {i}</button></div>' for i in range(n))
+    return body * 20, inventory
+
+
+def test_savings_estimate_does_not_render_full_context(monkeypatch):
+    body, inventory = _page()
+    calls = []
+    shrink = planner._shrink_inventory
+    monkeypatch.setattr(planner, "_truncate", lambda *a: calls.append("truncate"))
+    monkeypatch.setattr(planner, "_shrink_inventory", lambda inv, **kw: calls.append(len(inv)) or shrink(inv, **kw))
+    planner._prompt_context("1", body, inventory, "нажать кнопку номер 7")
+    # Сжимаются только отобранные элементы (по одному и итоговая выборка), не весь инвентарь
+    assert "truncate" not in calls
+    assert max(calls) < len(inventory)
+
+
+def test_savings_estimate_close_to_full_render():
+    body, inventory = _page()
+    inv_top = planner._shrink_inventory(inventory[:30])
+    estimate = planner._legacy_tokens(body, inventory, json.dumps(inv_top, ensure_ascii=False), len(inv_top))
+    exact = estimate_tokens(planner._truncate(body, 40000)) + estimate_tokens(
+        json.dumps(planner._shrink_inventory(inventory), ensure_ascii=False)
+    )
+    assert abs(estimate - exact) / exact < 0.1
@@ -0,0 +1,32 @@
+import asyncio
+
+import executor
+from artifacts import ArtifactStore
+from context import PlaywrightDriver
+from replay import run_replay
+from fakes import FakeBrowser
+
+
+def _entry(step_id, testid):
+    return {
+        "step": {"id": step_id, "raw": f"Шаг {step_id}", "do": "Нажать", "result": ""},
+        "plan": {
+            "stepId": step_id, "title": f"Шаг {step_id}",
+            "instructions": [{"action": "click", "target": {"selector": {"type": "testid", "value": testid}}}],
+            "expects": [],
+        },
+    }
+
+
+def test_failed_step_is_int_like_run_test(tmp_path, monkeypatch):
+    monkeypatch.setattr(executor, "ACTION_TIMEOUT_MS", 100)
+    monkeypatch.setattr(executor, "SELECTOR_PROBE_MS", 50)
+
+    async def run():
+        driver = PlaywrightDriver(browser=FakeBrowser({"testid:ok": None}), artifacts=ArtifactStore(str(tmp_path)))
+        await driver.start()
+        bundle = {"name": "case", "steps": [_entry("1", "ok"), _entry("2", "missing")]}
+        report, changed = await run_replay(bundle, driver, fallback=False)
+        assert report["failed_step"] == 2
+        assert (report["ok"], report["steps_passed"], changed) == (False, 1, False)
+    asyncio.run(run())
@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+import pytest
+
+import executor
+from executor import resolve_target
+from models import Target
+from fakes import FakePage
+
+
+def _target(*refs):
+    sels = [{"type": r.split(":", 1)[0], "value": r.split(":", 1)[1]} for r in refs]
+    return Target.model_validate({"selector": sels[0], "alternatives": sels[1:]})
+
+
+@pytest.fixture(autouse=True)
+def short_probe(monkeypatch):
+    monkeypatch.setattr(executor, "SELECTOR_PROBE_MS", 100)
+
+
+def test_alternative_wins_without_full_timeout():
+    async def run():
+        page = FakePage(None, {"testid:alt": None})
+        t0 = time.monotonic()
+        _, winner = await resolve_target(page, _target("testid:gone", "testid:alt"), 10000)
+        assert winner.value == "alt"
+        assert time.monotonic() - t0 < 0.5
+        # Каждый кандидат ждёт не дольше короткого бюджета
+        assert all(timeout <= 100 for _, timeout in page.waits)
+    asyncio.run(run())
+
+
+def test_late_element_found_by_single_full_wait():
+    async def run():
+        page = FakePage(None, {})
+
+        async def appear():
+            await asyncio.sleep(0.3)
+            page.elements["testid:alt"] = None
+        asyncio.get_running_loop().create_task(appear())
+        _, winner = await resolve_target(page, _target("testid:main", "testid:alt"), 5000)
+        assert winner.value == "alt"
+        probes = [w for w in page.waits if len(w[0]) == 1]
+        combined = [w for w in page.waits if len(w[0]) == 2]
+        # Два коротких ожидания, одно общее на остаток таймаута, затем повторная гонка
+        assert [t for _, t in probes[:2]] == [100, 100]
+        assert len(combined) == 1 and 4800 <= combined[0][1] < 5000
+    asyncio.run(run())
+
+
+def test_probe_only_gives_up_after_budget():
+    async def run():
+        page = FakePage(None, {})
+        t0 = time.monotonic()
+        with pytest.raises(TimeoutError):
+            await resolve_target(page, _target("testid:main"), 5000, probe_only=True)
+        assert time.monotonic() - t0 < 0.5
+        assert len(page.waits) == 1
+    asyncio.run(run())
+
+
+def test_missing_target_waits_full_timeout_once():
+    async def run():
+        page = FakePage(None, {})
+        t0 = time.monotonic()
+        with pytest.raises(TimeoutError):
+            await resolve_target(page, _target("testid:a", "testid:b", "testid:c"), 300)
+        elapsed = time.monotonic() - t0
+        # Короткая гонка + общее ожидание укладываются в один таймаут, а не в три
+        assert 0.25 < elapsed < 0.6
+        assert len(page.waits) == 4
+    asyncio.run(run())
@@ -0,0 +1,113 @@
+import asyncio
+import json
+import os
+import stat
+import time
+
+from artifacts import ArtifactStore
+from context import PlaywrightDriver
+from fakes import FakeBrowser
+from sessions import Session, SessionStore
+
+STATE = {"cookies": [{"name": "sid", "value": "1", "domain": "app.test", "path": "/"}], "origins": []}
+
+
+def test_store_roundtrip_private_file(tmp_path):
+    store = SessionStore(str(tmp_path), ttl=60)
+    store.save("staging/admin", STATE)
+    path = store.path("staging/admin")
+    assert os.path.dirname(path) == str(tmp_path)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert store.load("staging/admin") == STATE
+    assert not [p for p in os.listdir(tmp_path) if p.endswith(".tmp")]
+
+
+def test_store_ttl_and_invalidate(tmp_path):
+    store = SessionStore(str(tmp_path), ttl=60)
+    store.save("s", STATE)
+    with open(store.path("s"), "r+", encoding="utf-8") as f:
+        entry = json.load(f)
+        entry["created_at"] = time.time() - 120
+        f.seek(0)
+        f.truncate()
+        json.dump(entry, f)
+    # Просроченная сессия удаляется при чтении
+    assert store.load("s") is None
+    assert not os.path.exists(store.path("s"))
+    store.save("s", STATE)
+    store.invalidate("s")
+    store.invalidate("s")
+    assert store.load("s") is None
+    assert SessionStore(str(tmp_path), ttl=0).load("nope") is None
+
+
+def test_logout_patterns(tmp_path):
+    store = SessionStore(str(tmp_path), logout_patterns=["*/login*", "*/auth/*"])
+    assert store.looks_logged_out("https://app.test/Login?next=/")
+    assert store.looks_logged_out("https://app.test/auth/callback")
+    assert not store.looks_logged_out("https://app.test/registry")
+    assert not store.looks_logged_out(None)
+
+
+def _session(tmp_path, results):
+    calls = []
+
+    async def setup():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return results[min(len(calls), len(results)) - 1]
+    return Session("s", setup, SessionStore(str(tmp_path), ttl=60)), calls
+
+
+def test_concurrent_cases_run_setup_once(tmp_path):
+    session, calls = _session(tmp_path, [STATE])
+
+    async def run():
+        states = await asyncio.gather(*(session.state() for _ in range(5)))
+        assert all(s == STATE for s in states)
+    asyncio.run(run())
+    assert len(calls) == 1
+    # Следующий прогон берёт сессию с диска, без setup-кейса
+    fresh, calls = _session(tmp_path, [None])
+    assert asyncio.run(fresh.state()) == STATE and calls == []
+
+
+def test_failed_setup_not_retried(tmp_path):
+    session, calls = _session(tmp_path, [None, STATE])
+
+    async def run():
+        assert await asyncio.gather(session.state(), session.state()) == [None, None]
+        assert await session.state() is None
+    asyncio.run(run())
+    assert len(calls) == 1
+
+
+def test_refresh_recreates_once_for_all_callers(tmp_path):
+    renewed = {"cookies": [], "origins": [{"origin": "https://app.test", "localStorage": []}]}
+    session, calls = _session(tmp_path, [STATE, renewed])
+
+    async def run():
+        stale = await session.state()
+        # Несколько кейсов одновременно увидели страницу входа
+        states = await asyncio.gather(*(session.refresh(stale) for _ in range(3)))
+        assert states == [renewed] * 3
+        # Устаревшая копия у опоздавшего кейса не сбрасывает уже новую сессию
+        assert await session.refresh(stale) == renewed
+    asyncio.run(run())
+    assert len(calls) == 2
+    assert session.store.load("s") == renewed
+
+
+def test_driver_restarts_with_session_state(tmp_path):
+    browser = FakeBrowser()
+
+    async def run():
+        driver = PlaywrightDriver(browser=browser, storage_state=STATE, artifacts=ArtifactStore(str(tmp_path)))
+        await driver.start()
+        renewed = {"cookies": [], "origins": []}
+        await driver.restart(renewed)
+        assert driver.page is not None
+        await driver.stop()
+        return renewed
+    renewed = asyncio.run(run())
+    assert browser.storage_states == [STATE, renewed]
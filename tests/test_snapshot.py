@@ -0,0 +1,34 @@
+import asyncio
+
+from artifacts import ArtifactStore
+from context import PlaywrightDriver
+from fakes import FakeBrowser
+
+
+def _mutate(page, key):
+    page.elements[key] = None
+    page.version += 1
+
+
+def test_diff_is_relative_to_given_snapshot(tmp_path):
+    async def run():
+        driver = PlaywrightDriver(browser=FakeBrowser({"testid:a": None}), artifacts=ArtifactStore(str(tmp_path)))
+        await driver.start()
+        await driver.page.goto("https://example.test/app")
+        planned = await driver.snapshot()
+        assert planned["diff"] is None
+
+        _mutate(driver.page, "testid:b")
+        after = await driver.snapshot(since=planned)
+        assert [e["testid"] for e in after["diff"]["added"]] == ["b"]
+
+        # DOM не менялся: повторно выданный снимок не несёт прежний дифф
+        assert (await driver.snapshot())["diff"] is None
+        assert (await driver.snapshot(since=after))["diff"] is None
+        # ...а относительно снимка прошлого шага дифф тот же
+        again = await driver.snapshot(since=planned)
+        assert [e["testid"] for e in again["diff"]["added"]] == ["b"]
+
+        await driver.page.goto("https://example.test/other")
+        assert (await driver.snapshot(since=after))["diff"] is None
+    asyncio.run(run())
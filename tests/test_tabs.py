@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+from artifacts import ArtifactStore
+from context import PlaywrightDriver
+from executor import execute_step
+from models import StepPlan
+from fakes import FakeBrowser
+
+
+async def _open_popup_later(page):
+    # window.open в обработчике клика, а событие новой вкладки — уже после возврата click()
+    page.window_opens += 1
+
+    async def _popup():
+        await asyncio.sleep(0.05)
+        popup = await page.context.new_page()
+        popup.url = "https://example.test/popup"
+    asyncio.get_running_loop().create_task(_popup())
+
+
+async def _close_page(page):
+    await page.close()
+
+
+def _driver(tmp_path, elements):
+    return PlaywrightDriver(browser=FakeBrowser(elements), artifacts=ArtifactStore(str(tmp_path)))
+
+
+def test_late_popup_becomes_active_before_expects(tmp_path):
+    async def run():
+        driver = _driver(tmp_path, {"testid:open": _open_popup_later})
+        await driver.start()
+        plan = StepPlan.model_validate({
+            "stepId": "1", "title": "t",
+            "instructions": [{"action": "click", "target": {"selector": {"type": "testid", "value": "open"}}}],
+            "expects": [{"kind": "urlIncludes", "value": "/popup"}],
+        })
+        res = await execute_step(driver, plan, snapshot=False)
+        assert res.ok, res.errors
+        assert driver.page.url == "https://example.test/popup"
+        assert driver.tabs == 2
+    asyncio.run(run())
+
+
+def test_click_without_popup_keeps_tab(tmp_path):
+    async def run():
+        driver = _driver(tmp_path, {"testid:save": None})
+        await driver.start()
+        first = driver.page
+        plan = StepPlan.model_validate({
+            "stepId": "1", "title": "t",
+            "instructions": [{"action": "click", "target": {"selector": {"type": "testid", "value": "save"}}}],
+        })
+        t0 = time.monotonic()
+        res = await execute_step(driver, plan, snapshot=False)
+        assert res.ok, res.errors
+        assert driver.page is first
+        # Клик, который не может открыть окно, не ждёт POPUP_WAIT_MS
+        assert time.monotonic() - t0 < 0.3
+    asyncio.run(run())
+
+
+def test_blank_target_waits_for_new_tab(tmp_path):
+    async def _open_tab(page):
+        async def _tab():
+            await asyncio.sleep(0.05)
+            await page.context.new_page()
+        asyncio.get_running_loop().create_task(_tab())
+
+    async def run():
+        driver = _driver(tmp_path, {"testid:docs": _open_tab})
+        await driver.start()
+        driver.page.blank_targets.add("testid:docs")
+        plan = StepPlan.model_validate({
+            "stepId": "1", "title": "t",
+            "instructions": [{"action": "click", "target": {"selector": {"type": "testid", "value": "docs"}}}],
+        })
+        res = await execute_step(driver, plan, snapshot=False)
+        assert res.ok, res.errors
+        assert driver.tabs == 2
+    asyncio.run(run())
+
+
+def test_snapshot_after_last_tab_closed(tmp_path):
+    async def run():
+        driver = _driver(tmp_path, {"testid:close": _close_page})
+        await driver.start()
+        plan = StepPlan.model_validate({
+            "stepId": "1", "title": "t",
+            "instructions": [{"action": "click", "target": {"selector": {"type": "testid", "value": "close"}}}],
+        })
+        res = await execute_step(driver, plan)
+        assert res.ok, res.errors
+        snap = await driver.snapshot()
+        assert snap["tabs"] == 1 and driver.page is not None
+    asyncio.run(run())
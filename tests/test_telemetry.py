@@ -0,0 +1,63 @@
+import asyncio
+import json
+
+import pytest
+
+from telemetry import Tracer, add, annotate, bind, span
+
+
+def test_no_tracer_is_noop():
+    with span("llm") as s:
+        annotate(prompt_tokens=10)
+    assert s is None
+
+
+def test_nesting_attrs_and_errors():
+    tracer = Tracer(None, None)
+    with bind(tracer, "login.txt"):
+        with span("node.plan", step="1"):
+            with span("llm", model="m"):
+                add(prompt_tokens=100, llm_attempts=1)
+                add(prompt_tokens=20)
+            with pytest.raises(ValueError):
+                with span("snapshot"):
+                    raise ValueError("boom")
+            annotate(source="llm")
+    by_name = {s.name: s for s in tracer.spans}
+    # Спан закрывается раньше родителя, поэтому в списке дети идут первыми
+    assert [s.name for s in tracer.spans] == ["llm", "snapshot", "node.plan"]
+    assert by_name["llm"].parent == "node.plan" and by_name["node.plan"].parent is None
+    assert by_name["llm"].attrs == {"model": "m", "prompt_tokens": 120, "llm_attempts": 1}
+    assert by_name["snapshot"].attrs["error"] == "ValueError"
+    assert by_name["node.plan"].attrs == {"step": "1", "source": "llm"}
+    assert all(s.case == "login.txt" for s in tracer.spans)
+    assert by_name["node.plan"].dur >= by_name["llm"].dur + by_name["snapshot"].dur
+
+
+def test_summary_and_exports(tmp_path):
+    tracer = Tracer(str(tmp_path / "trace.jsonl"), str(tmp_path / "trace.json"))
+
+    async def case(name, tokens):
+        with bind(tracer, name):
+            for t in tokens:
+                with span("llm", prompt_tokens=t):
+                    await asyncio.sleep(0)
+
+    async def run():
+        # Кейсы набора идут параллельно, но их спаны не перемешиваются
+        await asyncio.gather(case("a", [10, 30]), case("b", [5]))
+    asyncio.run(run())
+
+    summary = tracer.summary()
+    assert summary["llm"]["count"] == 3 and summary["llm"]["prompt_tokens"] == 45
+    assert tracer.summary("a")["llm"]["prompt_tokens"] == 40
+    assert "prompt_tokens" in tracer.summary_table()
+    assert Tracer(None, None).summary_table() == "(спанов нет)"
+
+    tracer.export()
+    lines = [json.loads(line) for line in (tmp_path / "trace.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert sorted((r["case"], r["prompt_tokens"]) for r in lines) == [("a", 10), ("a", 30), ("b", 5)]
+    events = json.loads((tmp_path / "trace.json").read_text(encoding="utf-8"))["traceEvents"]
+    threads = {e["args"]["name"]: e["tid"] for e in events if e["ph"] == "M"}
+    assert set(threads) == {"a", "b"} and threads["a"] != threads["b"]
+    assert {e["tid"] for e in events if e["ph"] == "X" and e["args"]["prompt_tokens"] == 5} == {threads["b"]}
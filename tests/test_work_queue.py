@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+from work_queue import RedisQueue, SqliteQueue
+
+STEPS = [{"id": "1", "raw": "Открыть главную"}]
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def make_queue(request, tmp_path):
+    queues = []
+    server = None
+
+    def make(**kw):
+        nonlocal server
+        if request.param == "sqlite":
+            q = SqliteQueue(str(tmp_path / "queue.sqlite"), **kw)
+        else:
+            fakeredis = pytest.importorskip("fakeredis")
+            pytest.importorskip("lupa")  # Lua-скрипты в fakeredis
+            server = server or fakeredis.FakeServer()
+            q = RedisQueue(fakeredis.FakeRedis(server=server), **kw)
+        queues.append(q)
+        return q
+
+    yield make
+    for q in queues:
+        q.close()
+
+
+def test_lease_complete_results(make_queue):
+    q = make_queue()
+    ids = q.enqueue_many("run1", [("a", STEPS), ("b", STEPS)], {"on_error": "fail-fast"})
+    job = q.lease("w1")
+    assert (job.id, job.name, job.attempts, job.run_id) == (ids[0], "a", 1, "run1")
+    assert job.policy == {"on_error": "fail-fast"} and job.steps == STEPS
+    assert q.heartbeat(job.id, "w1")
+    assert not q.heartbeat(job.id, "w2")
+    assert q.complete(job.id, "w1", {"name": "a", "ok": True})
+    # Повторный результат того же кейса не засчитывается
+    assert not q.complete(job.id, "w2", {"name": "a", "ok": False})
+    assert q.results("run1") == {ids[0]: {"name": "a", "ok": True}}
+    assert not q.idle()
+    job = q.lease("w1")
+    q.complete(job.id, "w1", {"name": "b", "ok": True})
+    assert q.lease("w1") is None
+    assert q.idle()
+
+
+def test_expired_lease_requeued_then_lost(make_queue):
+    q = make_queue(lease_ttl=-1, max_attempts=2)
+    (job_id,) = q.enqueue_many("run1", [("a", STEPS)], {})
+    first = q.lease("w1")
+    assert q.requeue_expired() == 1
+    # Пропавший воркер аренду не продлит: кейс уже вернулся в очередь
+    assert not q.heartbeat(first.id, "w1")
+    second = q.lease("w2")
+    assert (second.id, second.attempts) == (job_id, 2)
+    assert q.requeue_expired() == 1
+    assert q.lease("w3") is None
+    (result,) = q.results("run1").values()
+    assert not result["ok"] and "[lease_lost]" in result["errors"][0]
+    assert q.idle()
+
+
+def test_queue_shared_between_processes(make_queue):
+    # Координатор и воркер открывают очередь независимо (для SQLite — тот же файл)
+    coordinator, worker = make_queue(), make_queue()
+    (job_id,) = coordinator.enqueue_many("run1", [("a", STEPS)], {})
+    job = worker.lease("w1")
+    worker.complete(job.id, "w1", {"name": "a", "ok": True})
+    assert coordinator.results("run1") == {job_id: {"name": "a", "ok": True}}
+
+
+def test_calls_from_worker_threads(make_queue):
+    q = make_queue()
+    q.enqueue_many("run1", [(f"c{i}", STEPS) for i in range(8)], {})
+
+    async def run():
+        # Так их вызывает main.py: через asyncio.to_thread, параллельно из разных потоков
+        jobs = await asyncio.gather(*(asyncio.to_thread(q.lease, f"w{i}") for i in range(8)))
+        assert len({j.id for j in jobs}) == 8
+        await asyncio.gather(*(asyncio.to_thread(q.complete, j.id, "w", {"ok": True}) for j in jobs))
+    asyncio.run(run())
+    assert len(q.results("run1")) == 8
+
+
+def test_coordinator_collects_worker_approvals(tmp_path, monkeypatch):
+    import main
+    from policy import RunPolicy, load_approvals
+
+    monkeypatch.setattr(main, "QUEUE_POLL", 0.01)
+    suite = tmp_path / "cases"
+    suite.mkdir()
+    (suite / "login.txt").write_text("1. Войти\n", encoding="utf-8")
+    url = f"sqlite:///{tmp_path / 'queue.sqlite'}"
+    queue_path = tmp_path / "approvals.jsonl"
+    pending = {"status": "pending", "key": "k1", "case": "login.txt", "plan": {"stepId": "1"}}
+
+    async def worker():
+        q = SqliteQueue(str(tmp_path / "queue.sqlite"))
+        try:
+            while (job := q.lease("w1")) is None:
+                await asyncio.sleep(0.01)
+            # Файл очереди координатора на воркере не открывается: записи едут с результатом
+            assert job.policy["approval"] == "cached-only"
+            case = {**main._case_stub(job.name, "pending_approval", "план ждёт одобрения"), "pending_approvals": 1}
+            q.complete(job.id, "w1", {**case, "approvals": [pending]})
+        finally:
+            q.close()
+
+    async def run():
+        policy = RunPolicy(approval="cached-only", on_error="fail-fast", approval_queue=str(queue_path))
+        report, _ = await asyncio.gather(main.run_coordinator(str(suite), url, None, policy), worker())
+        return report
+
+    report = asyncio.run(run())
+    assert report["pending_approvals"] == 1
+    assert "approvals" not in report["cases"][0]
+    assert load_approvals(str(queue_path)) == [pending]
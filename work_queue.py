@@ -0,0 +1,321 @@
+from __future__ import annotations
+import os, json, time, uuid, socket, sqlite3, threading
+from functools import wraps
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Iterable, Tuple
+
+# === Конфиг очереди ===
+# sqlite:///path — координатор и воркеры на одном хосте; redis://host:6379/0 — для нескольких машин.
+# SQLite-файл на сетевом диске (NFS, SMB) не годится: блокировки и WAL там не работают, очередь ломается
+QUEUE_URL = os.getenv("QUEUE_URL", "sqlite:///.qa_cache/queue.sqlite")
+QUEUE_LEASE_TTL = float(os.getenv("QUEUE_LEASE_TTL", "120"))  # секунды без heartbeat до возврата в очередь
+QUEUE_MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", "3"))
+QUEUE_POLL = float(os.getenv("QUEUE_POLL", "1.0"))
+
+
+@dataclass(slots=True)
+class Job:
+    id: str
+    run_id: str
+    name: str
+    steps: List[Dict[str, Any]]
+    policy: Dict[str, Any] = field(default_factory=dict)
+    attempts: int = 1
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _payload(name: str, steps: List[Dict[str, Any]], policy: Dict[str, Any]) -> str:
+    return json.dumps({"name": name, "steps": steps, "policy": policy}, ensure_ascii=False)
+
+
+def lost_result(name: str, attempts: int) -> Dict[str, Any]:
+    """Результат кейса, воркеры которого пропали QUEUE_MAX_ATTEMPTS раз подряд."""
+    return {
+        "name": name, "ok": False, "steps_total": 0, "steps_passed": 0,
+        "failed_step": None, "pending_approvals": 0,
+        "errors": [f"[lease_lost] воркер пропал, попыток: {attempts}"], "duration_s": 0.0,
+    }
+
+
+def _locked(fn):
+    @wraps(fn)
+    def wrapper(self, *args, **kw):
+        with self._lock:
+            return fn(self, *args, **kw)
+    return wrapper
+
+
+class SqliteQueue:
+    """Очередь тест-кейсов в SQLite: переживает рестарт координатора и воркеров.
+
+    Аренда (lease) действует QUEUE_LEASE_TTL секунд и продлевается heartbeat; просроченная
+    аренда возвращает кейс в очередь, после QUEUE_MAX_ATTEMPTS попыток кейс считается упавшим.
+
+    Только для одного хоста: файл на сетевом диске не поддерживается, для нескольких машин — RedisQueue.
+    Методы блокирующие (ожидание блокировки файла — до 30 с); из event loop их вызывают через
+    asyncio.to_thread, поэтому соединение общее для потоков и защищено своим замком.
+    """
+
+    def __init__(self, path: str, lease_ttl: float = QUEUE_LEASE_TTL, max_attempts: int = QUEUE_MAX_ATTEMPTS):
+        self.lease_ttl = lease_ttl
+        self.max_attempts = max_attempts
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                run_id TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                worker TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                updated_at REAL NOT NULL
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_until)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_run ON jobs (run_id)")
+
+    @_locked
+    def enqueue_many(self, run_id: str, cases: Iterable[Tuple[str, List[Dict[str, Any]]]], policy: Dict[str, Any]) -> List[str]:
+        ids = []
+        now = time.time()
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            for name, steps in cases:
+                job_id = uuid.uuid4().hex
+                self._db.execute(
+                    "INSERT INTO jobs (id, run_id, payload, status, updated_at) VALUES (?, ?, ?, 'pending', ?)",
+                    (job_id, run_id, _payload(name, steps, policy), now),
+                )
+                ids.append(job_id)
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return ids
+
+    @_locked
+    def lease(self, worker: str) -> Optional[Job]:
+        now = time.time()
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._db.execute(
+                "SELECT id, run_id, payload, attempts FROM jobs WHERE status = 'pending' ORDER BY rowid LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                self._db.execute(
+                    "UPDATE jobs SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, "
+                    "updated_at = ? WHERE id = ?",
+                    (worker, now + self.lease_ttl, now, row[0]),
+                )
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        data = json.loads(row[2])
+        return Job(row[0], row[1], data["name"], data["steps"], data.get("policy") or {}, row[3] + 1)
+
+    @_locked
+    def heartbeat(self, job_id: str, worker: str) -> bool:
+        """Продлевает аренду. False — аренда потеряна (кейс уже отдан другому воркеру)."""
+        now = time.time()
+        cur = self._db.execute(
+            "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+            (now + self.lease_ttl, now, job_id, worker),
+        )
+        return cur.rowcount == 1
+
+    @_locked
+    def complete(self, job_id: str, worker: str, result: Dict[str, Any]) -> bool:
+        # Кейс мог уйти второму воркеру после потери аренды: засчитывается первый результат
+        cur = self._db.execute(
+            "UPDATE jobs SET status = 'done', worker = ?, result = ?, updated_at = ? WHERE id = ? AND status != 'done'",
+            (worker, json.dumps(result, ensure_ascii=False), time.time(), job_id),
+        )
+        return cur.rowcount == 1
+
+    @_locked
+    def requeue_expired(self) -> int:
+        now = time.time()
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            rows = self._db.execute(
+                "SELECT id, payload, attempts FROM jobs WHERE status = 'leased' AND lease_until < ?", (now,)
+            ).fetchall()
+            for job_id, payload, attempts in rows:
+                if attempts >= self.max_attempts:
+                    result = json.dumps(lost_result(json.loads(payload)["name"], attempts), ensure_ascii=False)
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'done', result = ?, updated_at = ? WHERE id = ?", (result, now, job_id)
+                    )
+                else:
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'pending', worker = NULL, lease_until = NULL, updated_at = ? WHERE id = ?",
+                        (now, job_id),
+                    )
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+    @_locked
+    def results(self, run_id: str) -> Dict[str, Dict[str, Any]]:
+        rows = self._db.execute(
+            "SELECT id, result FROM jobs WHERE run_id = ? AND status = 'done'", (run_id,)
+        ).fetchall()
+        return {job_id: json.loads(result) for job_id, result in rows}
+
+    @_locked
+    def idle(self) -> bool:
+        """Нет ни ожидающих, ни арендованных кейсов (ни одного рана)."""
+        return self._db.execute("SELECT 1 FROM jobs WHERE status != 'done' LIMIT 1").fetchone() is None
+
+    @_locked
+    def close(self) -> None:
+        self._db.close()
+
+
+# Lua-скрипты: каждая операция над очередью атомарна на стороне сервера
+_LEASE_LUA = """
+local id = redis.call('LPOP', KEYS[1])
+if not id then return false end
+redis.call('ZADD', KEYS[2], ARGV[1], id)
+redis.call('HSET', KEYS[3], id, ARGV[2])
+local n = redis.call('HINCRBY', KEYS[4], id, 1)
+return {id, redis.call('HGET', KEYS[5], id), n}
+"""
+_HEARTBEAT_LUA = """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then return 0 end
+if not redis.call('ZSCORE', KEYS[1], ARGV[1]) then return 0 end
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+return 1
+"""
+_COMPLETE_LUA = """
+if redis.call('HEXISTS', KEYS[3], ARGV[1]) == 1 then return 0 end
+redis.call('HSET', KEYS[3], ARGV[1], ARGV[2])
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('LREM', KEYS[4], 0, ARGV[1])
+return 1
+"""
+# Просроченные аренды: обратно в pending, а исчерпавшие попытки — в dead (результат пишет Python)
+_REQUEUE_LUA = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+for _, id in ipairs(ids) do
+  redis.call('ZREM', KEYS[1], id)
+  redis.call('HDEL', KEYS[4], id)
+  if tonumber(redis.call('HGET', KEYS[3], id) or '0') >= tonumber(ARGV[2]) then
+    redis.call('RPUSH', KEYS[5], id)
+  else
+    redis.call('RPUSH', KEYS[2], id)
+  end
+end
+return #ids
+"""
+
+
+class RedisQueue:
+    """Та же очередь поверх Redis-совместимого сервера (Redis, Valkey, KeyDB) — для нескольких машин.
+
+    client — клиент redis-py или совместимая с ним локальная замена (напр. fakeredis с Lua).
+    """
+
+    def __init__(self, client, prefix: str = "qa:queue:", lease_ttl: float = QUEUE_LEASE_TTL, max_attempts: int = QUEUE_MAX_ATTEMPTS):
+        self.lease_ttl = lease_ttl
+        self.max_attempts = max_attempts
+        self._r = client
+        p = prefix
+        self._pending, self._leases, self._owner = f"{p}pending", f"{p}leases", f"{p}owner"
+        self._attempts, self._jobs, self._results, self._dead = f"{p}attempts", f"{p}jobs", f"{p}results", f"{p}dead"
+        self._run_prefix = f"{p}run:"
+        self._lease = client.register_script(_LEASE_LUA)
+        self._heartbeat = client.register_script(_HEARTBEAT_LUA)
+        self._complete = client.register_script(_COMPLETE_LUA)
+        self._requeue = client.register_script(_REQUEUE_LUA)
+
+    @staticmethod
+    def _s(v) -> str:
+        return v.decode("utf-8") if isinstance(v, bytes) else v
+
+    def enqueue_many(self, run_id: str, cases: Iterable[Tuple[str, List[Dict[str, Any]]]], policy: Dict[str, Any]) -> List[str]:
+        ids = []
+        pipe = self._r.pipeline(transaction=True)
+        for name, steps in cases:
+            job_id = uuid.uuid4().hex
+            payload = json.loads(_payload(name, steps, policy))
+            payload["run_id"] = run_id
+            pipe.hset(self._jobs, job_id, json.dumps(payload, ensure_ascii=False))
+            pipe.rpush(self._run_prefix + run_id, job_id)
+            pipe.rpush(self._pending, job_id)
+            ids.append(job_id)
+        pipe.execute()
+        return ids
+
+    def lease(self, worker: str) -> Optional[Job]:
+        got = self._lease(
+            keys=[self._pending, self._leases, self._owner, self._attempts, self._jobs],
+            args=[time.time() + self.lease_ttl, worker],
+        )
+        if not got:
+            return None
+        job_id, payload, attempts = self._s(got[0]), json.loads(self._s(got[1])), int(got[2])
+        return Job(job_id, payload["run_id"], payload["name"], payload["steps"], payload.get("policy") or {}, attempts)
+
+    def heartbeat(self, job_id: str, worker: str) -> bool:
+        return bool(self._heartbeat(keys=[self._leases, self._owner], args=[job_id, worker, time.time() + self.lease_ttl]))
+
+    def complete(self, job_id: str, worker: str, result: Dict[str, Any]) -> bool:
+        return bool(self._complete(
+            keys=[self._leases, self._owner, self._results, self._pending],
+            args=[job_id, json.dumps(result, ensure_ascii=False)],
+        ))
+
+    def requeue_expired(self) -> int:
+        n = int(self._requeue(
+            keys=[self._leases, self._pending, self._attempts, self._owner, self._dead],
+            args=[time.time(), self.max_attempts],
+        ))
+        # dead разбирается и после падения посреди прошлого вызова
+        while (job_id := self._r.lpop(self._dead)) is not None:
+            job_id = self._s(job_id)
+            payload = json.loads(self._s(self._r.hget(self._jobs, job_id)))
+            attempts = int(self._r.hget(self._attempts, job_id) or 0)
+            self.complete(job_id, "coordinator", lost_result(payload["name"], attempts))
+        return n
+
+    def results(self, run_id: str) -> Dict[str, Dict[str, Any]]:
+        ids = [self._s(i) for i in self._r.lrange(self._run_prefix + run_id, 0, -1)]
+        if not ids:
+            return {}
+        values = self._r.hmget(self._results, ids)
+        return {i: json.loads(self._s(v)) for i, v in zip(ids, values) if v is not None}
+
+    def idle(self) -> bool:
+        return not (self._r.llen(self._pending) or self._r.zcard(self._leases) or self._r.llen(self._dead))
+
+    def close(self) -> None:
+        self._r.close()
+
+
+def open_queue(url: str = QUEUE_URL):
+    """sqlite:///path/queue.sqlite или redis://host:port/db (нужен пакет redis)."""
+    if url.startswith("sqlite:///"):
+        return SqliteQueue(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("Для очереди в Redis нужен пакет redis (pip install redis)") from None
+        return RedisQueue(redis.Redis.from_url(url))
+    raise ValueError(f"Неизвестный QUEUE_URL: {url!r} (ожидается sqlite:///… или redis://…)")